@@ -0,0 +1,214 @@
+import argparse
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from importlib.metadata import version
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from benchmarks.star_schema import StarSchema, generate
+from cantrip.implementations.sqlite import SQLiteSemanticLayer
+from cantrip.models import SemanticView
+
+BASELINES = Path(__file__).parent / "baselines"
+
+
+@dataclass(frozen=True)
+class Timing:
+    """
+    Wall-clock timings of a benchmark, in milliseconds.
+    """
+
+    median: float
+    minimum: float
+
+    @classmethod
+    def measure(cls, function: Callable[[], Any], repeat: int) -> "Timing":
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return cls(statistics.median(timings), min(timings))
+
+
+def run_benchmarks(engine: Engine, repeat: int = 5) -> dict[str, Timing]:
+    """
+    Time the main operations of the semantic layer against a database.
+
+    Operations that depend on the catalog are timed cold (on a new semantic layer, so
+    that the time includes introspecting the database) and warm.
+    """
+    semantic_view = SemanticView("semantic_view")
+    semantic_layer = SQLiteSemanticLayer(engine)
+
+    metrics = sorted(semantic_layer.get_metrics(semantic_view), key=lambda m: m.name)
+    # a metric from the first fact table, and the dimensions available for it
+    metric = {metrics[0]}
+    dimensions = semantic_layer.get_valid_dimensions(semantic_view, metric, set())
+    dimension = {min(dimensions, key=lambda d: d.name)}
+    # all the metrics that share a context, for end-to-end execution by the dimension
+    siblings = {other for other in metrics if other.tables == metrics[0].tables}
+
+    def cold(function: Callable[[SQLiteSemanticLayer], Any]) -> Callable[[], Any]:
+        return lambda: function(SQLiteSemanticLayer(engine))
+
+    def execute() -> list[dict[str, Any]]:
+        semantic_layer.query_cache.clear()
+        query = semantic_layer.get_query(semantic_view, siblings, dimension, set())
+        return list(semantic_layer.execute(query.sql))
+
+    benchmarks: dict[str, Callable[[], Any]] = {
+        "get_metrics[cold]": cold(lambda layer: layer.get_metrics(semantic_view)),
+        "get_metrics": lambda: semantic_layer.get_metrics(semantic_view),
+        "get_dimensions[cold]": cold(lambda layer: layer.get_dimensions(semantic_view)),
+        "get_dimensions": lambda: semantic_layer.get_dimensions(semantic_view),
+        "get_valid_metrics": lambda: semantic_layer.get_valid_metrics(
+            semantic_view,
+            metric,
+            dimension,
+        ),
+        "get_valid_dimensions": lambda: semantic_layer.get_valid_dimensions(
+            semantic_view,
+            metric,
+            dimension,
+        ),
+        "get_query[uncached]": lambda: (
+            semantic_layer.query_cache.clear(),
+            semantic_layer.get_query(semantic_view, set(metrics), set(), set()),
+        ),
+        "get_query": lambda: semantic_layer.get_query(
+            semantic_view,
+            set(metrics),
+            set(),
+            set(),
+        ),
+        "execute": execute,
+    }
+
+    return {
+        name: Timing.measure(function, repeat) for name, function in benchmarks.items()
+    }
+
+
+def compare(
+    results: dict[str, Timing],
+    baseline: dict[str, Timing],
+    tolerance: float,
+) -> list[str]:
+    """
+    Return the benchmarks whose median is slower than the baseline by over `tolerance`.
+    """
+    return [
+        name
+        for name, timing in results.items()
+        if name in baseline and timing.median > baseline[name].median * (1 + tolerance)
+    ]
+
+
+def load_baseline(name: str) -> tuple[StarSchema, dict[str, Timing]]:
+    payload = json.loads((BASELINES / f"{name}.json").read_text())
+    return StarSchema(**payload["schema"]), {
+        benchmark: Timing(**timing) for benchmark, timing in payload["results"].items()
+    }
+
+
+def save_baseline(name: str, schema: StarSchema, results: dict[str, Timing]) -> None:
+    payload = {
+        "schema": asdict(schema),
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sqlglot": version("sqlglot"),
+            "sqlalchemy": version("sqlalchemy"),
+        },
+        "results": {benchmark: asdict(timing) for benchmark, timing in results.items()},
+    }
+    BASELINES.mkdir(exist_ok=True)
+    (BASELINES / f"{name}.json").write_text(json.dumps(payload, indent=2) + "\n")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the semantic layer.")
+    parser.add_argument("--facts", type=int, default=StarSchema.facts)
+    parser.add_argument("--chains", type=int, default=StarSchema.chains)
+    parser.add_argument("--chain-length", type=int, default=StarSchema.chain_length)
+    parser.add_argument(
+        "--metrics-per-fact",
+        type=int,
+        default=StarSchema.metrics_per_fact,
+    )
+    parser.add_argument("--rows", type=int, default=StarSchema.rows)
+    parser.add_argument(
+        "--dimension-rows",
+        type=int,
+        default=StarSchema.dimension_rows,
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--save", metavar="NAME", help="store the results as a baseline"
+    )
+    parser.add_argument("--compare", metavar="NAME", help="compare against a baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown relative to the baseline (default: 0.2)",
+    )
+    args = parser.parse_args(argv)
+
+    schema = StarSchema(
+        facts=args.facts,
+        chains=args.chains,
+        chain_length=args.chain_length,
+        metrics_per_fact=args.metrics_per_fact,
+        rows=args.rows,
+        dimension_rows=args.dimension_rows,
+    )
+
+    baseline: dict[str, Timing] = {}
+    if args.compare:
+        baseline_schema, baseline = load_baseline(args.compare)
+        if baseline_schema != schema:
+            parser.error(
+                f"The baseline was measured on a different schema: {baseline_schema}"
+            )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "benchmark.db"
+        generate(path, schema)
+        engine = create_engine(f"sqlite:///{path}")
+        try:
+            results = run_benchmarks(engine, args.repeat)
+        finally:
+            engine.dispose()
+
+    for name, timing in results.items():
+        line = f"{name:<24}{timing.median:>12.3f} ms{timing.minimum:>12.3f} ms"
+        if name in baseline:
+            change = timing.median / baseline[name].median - 1
+            line += f"{change:>+10.1%}"
+        print(line)
+
+    if args.save:
+        save_baseline(args.save, schema, results)
+
+    if regressions := compare(results, baseline, args.tolerance):
+        print("Regressions: " + ", ".join(regressions), file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
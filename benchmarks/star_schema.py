@@ -0,0 +1,160 @@
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+# aggregations used for the generated metrics, in rotation
+AGGREGATIONS = [
+    "SUM(amount)",
+    "COUNT(*)",
+    "AVG(amount)",
+    "MIN(quantity)",
+    "MAX(quantity)",
+    "SUM(amount * quantity)",
+]
+
+# multipliers used to spread the foreign keys of each chain over the dimension rows
+PRIMES = [7919, 104729, 1299709, 15485863]
+
+
+@dataclass(frozen=True)
+class StarSchema:
+    """
+    The shape of a synthetic star schema.
+
+    Dimensions are organized in `chains` of `chain_length` tables, where each table has
+    a foreign key to the next one in the chain (eg, city → state → country). The first
+    chain is referenced by every fact table, and the remaining chains are spread across
+    fact tables, so that not every metric is compatible with every dimension.
+    """
+
+    facts: int = 2
+    chains: int = 3
+    chain_length: int = 2
+    metrics_per_fact: int = 6
+    rows: int = 100_000
+    dimension_rows: int = 1_000
+
+    def get_chains(self, fact: int) -> list[int]:
+        """
+        Return the dimension chains referenced by a fact table.
+        """
+        return [
+            chain
+            for chain in range(self.chains)
+            if chain == 0 or chain % self.facts == fact
+        ]
+
+    def get_dimension_rows(self, level: int) -> int:
+        """
+        Return the number of rows in a dimension table at a given level of its chain.
+        """
+        return max(self.dimension_rows // 10**level, 1)
+
+
+def get_dimension_table(chain: int, level: int) -> str:
+    return f"dim_{chain}_{level}"
+
+
+def get_fact_table(fact: int) -> str:
+    return f"fact_{fact}"
+
+
+def get_metric(fact: int, metric: int) -> str:
+    return f"fact_{fact}_metric_{metric}"
+
+
+def generate(path: str | Path, schema: StarSchema) -> None:
+    """
+    Create a SQLite database with the given star schema.
+
+    The data is generated with recursive CTEs in SQLite itself, so that millions of fact
+    rows can be created in a few seconds. Values are a deterministic function of the row
+    number, so that the same schema always produces the same database.
+    """
+    with sqlite3.connect(path) as connection:
+        connection.executescript(get_ddl(schema))
+        for statement in get_dml(schema):
+            connection.execute(statement)
+
+    connection.close()
+
+
+def get_ddl(schema: StarSchema) -> str:
+    """
+    Return the statements creating the tables and metric views.
+    """
+    statements: list[str] = []
+
+    for chain in range(schema.chains):
+        for level in range(schema.chain_length):
+            table = get_dimension_table(chain, level)
+            columns = ["id INTEGER PRIMARY KEY", "name TEXT", "category TEXT"]
+            if level + 1 < schema.chain_length:
+                parent = get_dimension_table(chain, level + 1)
+                columns.append(f"parent_id INTEGER REFERENCES {parent}(id)")
+            statements.append(f"CREATE TABLE {table} ({', '.join(columns)})")
+
+    for fact in range(schema.facts):
+        columns = ["id INTEGER PRIMARY KEY"]
+        for chain in schema.get_chains(fact):
+            table = get_dimension_table(chain, 0)
+            columns.append(f"{table}_id INTEGER REFERENCES {table}(id)")
+        columns.extend(["amount REAL", "quantity INTEGER"])
+        statements.append(f"CREATE TABLE {get_fact_table(fact)} ({', '.join(columns)})")
+
+        for metric in range(schema.metrics_per_fact):
+            name = get_metric(fact, metric)
+            aggregation = AGGREGATIONS[metric % len(AGGREGATIONS)]
+            # every other rotation adds a filter, for conditional metrics
+            where = " WHERE quantity > 5" if metric // len(AGGREGATIONS) % 2 else ""
+            statements.append(
+                f"CREATE VIEW {name} AS "
+                f"SELECT {aggregation} AS {name} FROM {get_fact_table(fact)}{where}"
+            )
+
+    return ";\n".join(statements) + ";\n"
+
+
+def get_dml(schema: StarSchema) -> list[str]:
+    """
+    Return the statements populating the tables.
+    """
+    statements: list[str] = []
+
+    for chain in range(schema.chains):
+        for level in range(schema.chain_length):
+            rows = schema.get_dimension_rows(level)
+            columns = [
+                "n",
+                f"'{get_dimension_table(chain, level)} ' || n",
+                "'c' || n % 7",
+            ]
+            if level + 1 < schema.chain_length:
+                columns.append(f"n % {schema.get_dimension_rows(level + 1)} + 1")
+            statements.append(
+                get_sequence(rows)
+                + f"INSERT INTO {get_dimension_table(chain, level)} "
+                + f"SELECT {', '.join(columns)} FROM seq"
+            )
+
+    for fact in range(schema.facts):
+        rows = schema.get_dimension_rows(0)
+        columns = ["n"]
+        for chain in schema.get_chains(fact):
+            # spread the references with a different prime per chain
+            columns.append(f"(n * {PRIMES[chain % len(PRIMES)]}) % {rows} + 1")
+        columns.extend(["(n % 1000) / 10.0", "n % 10 + 1"])
+        statements.append(
+            get_sequence(schema.rows)
+            + f"INSERT INTO {get_fact_table(fact)} "
+            + f"SELECT {', '.join(columns)} FROM seq"
+        )
+
+    return statements
+
+
+def get_sequence(rows: int) -> str:
+    return (
+        "WITH RECURSIVE seq(n) AS "
+        f"(SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows}) "
+    )
@@ -0,0 +1,356 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Generic, Protocol, TypeVar
+
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters for cache lookups.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+class LRUCache(Generic[V]):
+    """
+    A thread-safe, bounded LRU cache with an optional TTL.
+
+    When `maxsize` is reached the least recently used entry is evicted; entries older
+    than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if maxsize < 0:
+            raise ValueError("The cache size must be non-negative")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> V | None:
+        """
+        Return the value for a key, or `None` if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+
+            created, value = entry
+            if self.ttl is not None and self.clock() - created > self.ttl:
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        """
+        Store a value, evicting the least recently used entries if needed.
+        """
+        if self.maxsize == 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """
+    A query result stored in a result cache, with the wall-clock time it was computed.
+    """
+
+    columns: tuple[str, ...]
+    rows: tuple[tuple[Any, ...], ...]
+    created: float = field(default=0.0, compare=False)
+
+
+@dataclass
+class ResultCacheStats(CacheStats):
+    """
+    Counters for result cache lookups.
+
+    A stale hit is a lookup served from an expired entry while it's being refreshed in
+    the background.
+    """
+
+    stale_hits: int = 0
+    refreshes: int = 0
+
+
+def get_result_key(
+    sql: str,
+    kwargs: dict[str, Any] | None,
+    version: Hashable | None,
+) -> str:
+    """
+    Return the cache key for the result of a query at a given data version.
+    """
+    payload = repr((sql, sorted((kwargs or {}).items()), version))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultStore(Protocol):
+    """
+    Storage backend for a `ResultCache`.
+    """
+
+    def get(self, key: str) -> CachedResult | None: ...
+
+    def set(self, key: str, result: CachedResult) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+class MemoryResultStore:
+    """
+    An in-memory LRU store bounded by the approximate size of the results, in bytes.
+
+    The size of a result is estimated from its pickled representation; results larger
+    than the whole budget are not stored.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        if max_bytes < 0:
+            raise ValueError("The cache size must be non-negative")
+
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[str, tuple[int, CachedResult]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CachedResult | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, result: CachedResult) -> None:
+        size = len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (size, result)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][0]
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key: str) -> None:
+        if (entry := self._entries.pop(key, None)) is not None:
+            self.size -= entry[0]
+
+
+class DiskResultStore:
+    """
+    A store that keeps each result in a pickle file inside a directory.
+
+    The store can be shared between processes. Files are written atomically, and
+    unreadable files are treated as missing. Since results are unpickled, the directory
+    must only be writable by trusted users.
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> CachedResult | None:
+        path = self.directory / (key + self.suffix)
+        try:
+            with open(path, "rb") as file:
+                result = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            self.delete(key)
+            return None
+
+        return result if isinstance(result, CachedResult) else None
+
+    def set(self, key: str, result: CachedResult) -> None:
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.directory / (key + self.suffix))
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+
+    def delete(self, key: str) -> None:
+        (self.directory / (key + self.suffix)).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*" + self.suffix):
+            path.unlink(missing_ok=True)
+
+
+def run_in_thread(function: Callable[[], None]) -> None:
+    threading.Thread(target=function, daemon=True).start()
+
+
+class ResultCache:
+    """
+    A cache of query results, with a TTL and stale-while-revalidate.
+
+    Entries younger than `ttl` seconds (or any age, if `None`) are fresh. Entries older
+    than that, but within `stale_ttl` seconds of expiring, are still returned while a
+    single background refresh (started with `submit`) replaces them. Older entries are
+    recomputed before returning.
+
+    Since entries can be shared between processes by the store, their age is measured
+    with a wall clock.
+    """
+
+    def __init__(
+        self,
+        store: ResultStore | None = None,
+        ttl: float | None = None,
+        stale_ttl: float = 0,
+        clock: Callable[[], float] = time.time,
+        submit: Callable[[Callable[[], None]], None] = run_in_thread,
+    ) -> None:
+        self.store: ResultStore = store if store is not None else MemoryResultStore()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.submit = submit
+        self.stats = ResultCacheStats()
+
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: str,
+        compute: Callable[[], tuple[tuple[str, ...], list[tuple[Any, ...]]]],
+    ) -> CachedResult:
+        """
+        Return the result for a key, calling `compute` to produce it if needed.
+        """
+        if (result := self.store.get(key)) is not None:
+            age = self.clock() - result.created
+            if self.ttl is None or age <= self.ttl:
+                self.stats.hits += 1
+                return result
+
+            if age <= self.ttl + self.stale_ttl:
+                self.stats.hits += 1
+                self.stats.stale_hits += 1
+                self.refresh(key, compute)
+                return result
+
+            self.store.delete(key)
+            self.stats.expirations += 1
+
+        self.stats.misses += 1
+        return self.compute(key, compute)
+
+    def compute(
+        self,
+        key: str,
+        compute: Callable[[], tuple[tuple[str, ...], list[tuple[Any, ...]]]],
+    ) -> CachedResult:
+        columns, rows = compute()
+        result = CachedResult(tuple(columns), tuple(rows), self.clock())
+        self.store.set(key, result)
+
+        return result
+
+    def refresh(
+        self,
+        key: str,
+        compute: Callable[[], tuple[tuple[str, ...], list[tuple[Any, ...]]]],
+    ) -> None:
+        """
+        Recompute an entry in the background, unless it's already being refreshed.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.stats.refreshes += 1
+
+        def run() -> None:
+            try:
+                self.compute(key, compute)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self.submit(run)
+        except BaseException:
+            with self._lock:
+                self._refreshing.discard(key)
+            raise
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        self.store.clear()
@@ -0,0 +1,409 @@
+import copyreg
+import io
+import pickle
+import zlib
+from collections.abc import Hashable, Iterable, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, TypeVar
+
+import sqlglot
+from sqlglot import exp
+
+from cantrip.models import Dimension, Metric, Relation, SemanticView
+
+T = TypeVar("T")
+
+# the FROM clause and JOINs shared by metrics that can be computed in a single query
+ContextKey = tuple[exp.From, tuple[exp.Join, ...]]
+
+# bumped whenever the structure of the catalog changes
+CATALOG_FORMAT = 3
+
+# table name to the joins to the tables it references, and their names
+JoinGraph = Mapping[str, tuple[tuple[str, exp.Join], ...]]
+
+
+@dataclass(frozen=True)
+class CompiledMetric:
+    """
+    A metric together with the pre-validated parts of its view.
+    """
+
+    metric: Metric
+    ast: exp.Select
+    expression: exp.Expression
+    context: ContextKey
+    where: exp.Expression | None = None
+
+
+def decode_bitset(bits: int, items: Sequence[T]) -> set[T]:
+    """
+    Return the items whose positions are set in a bitset.
+    """
+    decoded: set[T] = set()
+    while bits:
+        lowest = bits & -bits
+        decoded.add(items[lowest.bit_length() - 1])
+        bits ^= lowest
+
+    return decoded
+
+
+def build_join_graph(
+    dimension_joins: Mapping[Relation, Iterable[exp.Join]],
+) -> dict[str, tuple[tuple[str, exp.Join], ...]]:
+    """
+    Build the foreign key graph from the joins of each table.
+
+    Edges are sorted by the name of the referenced table, so that searches over the
+    graph are deterministic.
+    """
+    return {
+        table.name: tuple(
+            sorted(
+                ((join.this.name, join) for join in joins),
+                key=lambda edge: (edge[0], edge[1].sql()),
+            )
+        )
+        for table, joins in dimension_joins.items()
+    }
+
+
+def search_join_graph(
+    join_graph: JoinGraph,
+    tables: Iterable[str],
+) -> dict[str, tuple[str, exp.Join] | None]:
+    """
+    Find the shortest join path from a set of tables to every reachable table.
+
+    Returns each reachable table with the table it's joined from and the join, in the
+    order the tables were reached. The initial tables map to `None`.
+    """
+    parents: dict[str, tuple[str, exp.Join] | None] = {
+        table: None for table in sorted(tables)
+    }
+    queue = list(parents)
+    for table in queue:
+        for target, join in join_graph.get(table, ()):
+            if target not in parents:
+                parents[target] = (table, join)
+                queue.append(target)
+
+    return parents
+
+
+def resolve_view_tables(
+    dependencies: Mapping[Relation, Iterable[Relation]],
+) -> dict[Relation, frozenset[Relation]]:
+    """
+    Resolve each view to the base tables it reads from, through any number of views.
+
+    `dependencies` maps each view to the relations it reads from directly. Every view
+    is resolved once, so shared dependencies are only expanded a single time. Raises
+    `ValueError` if the views have a circular dependency.
+    """
+    resolved: dict[Relation, frozenset[Relation]] = {}
+
+    for root in dependencies:
+        # depth-first, keeping the path from the root to detect cycles
+        path: dict[Relation, None] = {root: None}
+        stack = [(root, iter(dependencies[root]))]
+        while stack:
+            view, children = stack[-1]
+            for child in children:
+                if child not in dependencies or child in resolved:
+                    continue
+                if child in path:
+                    cycle = [*list(path)[list(path).index(child) :], child]
+                    raise ValueError(
+                        "Views have a circular dependency: "
+                        + " -> ".join(relation.name for relation in cycle)
+                    )
+                path[child] = None
+                stack.append((child, iter(dependencies[child])))
+                break
+            else:
+                stack.pop()
+                del path[view]
+                resolved[view] = frozenset().union(
+                    *(
+                        resolved[child] if child in dependencies else {child}
+                        for child in dependencies[view]
+                    )
+                )
+
+    return resolved
+
+
+def get_reachable_dimensions(
+    dimensions_per_table: Mapping[Relation, Iterable[Dimension]],
+    join_graph: JoinGraph,
+) -> dict[Relation, frozenset[Dimension]]:
+    """
+    Extend the dimensions of each table with the ones from the tables it references.
+    """
+    tables_by_name = {table.name: table for table in dimensions_per_table}
+
+    return {
+        table: frozenset().union(
+            *(
+                dimensions_per_table[tables_by_name[name]]
+                for name in search_join_graph(join_graph, [table.name])
+                if name in tables_by_name
+            )
+        )
+        for table in dimensions_per_table
+    }
+
+
+@dataclass(frozen=True)
+class CompatibilityIndex:
+    """
+    A precomputed index of which metrics and dimensions can be combined.
+
+    Metrics and dimensions get integer IDs, and compatibility is stored as bitsets (plain
+    Python integers), so that finding the valid metrics for a set of dimensions (or the
+    other way around) is a few bitwise ANDs.
+    """
+
+    metrics: tuple[Metric, ...]
+    dimensions: tuple[Dimension, ...]
+    metric_ids: Mapping[Metric, int]
+    dimension_ids: Mapping[Dimension, int]
+
+    # per metric ID, the bitset of dimensions available in all of its tables
+    dimensions_per_metric: tuple[int, ...]
+    # per dimension ID, the bitset of metrics that can be grouped by it
+    metrics_per_dimension: tuple[int, ...]
+
+    @classmethod
+    def build(
+        cls,
+        metrics: Iterable[Metric],
+        dimensions: Iterable[Dimension],
+        dimensions_per_table: Mapping[Relation, Iterable[Dimension]],
+    ) -> "CompatibilityIndex":
+        """
+        Build the index from the catalog metadata.
+        """
+        metrics = tuple(sorted(metrics, key=lambda metric: metric.name))
+        dimensions = tuple(
+            sorted(
+                set(dimensions).union(*dimensions_per_table.values()),
+                key=lambda dimension: dimension.name,
+            )
+        )
+        metric_ids = {metric: i for i, metric in enumerate(metrics)}
+        dimension_ids = {dimension: i for i, dimension in enumerate(dimensions)}
+
+        all_dimensions = (1 << len(dimensions)) - 1
+        dimensions_per_table_bits = {
+            table: sum(1 << dimension_ids[dimension] for dimension in set(members))
+            for table, members in dimensions_per_table.items()
+        }
+
+        dimensions_per_metric = []
+        for metric in metrics:
+            bits = all_dimensions
+            for table in metric.tables:
+                bits &= dimensions_per_table_bits.get(table, 0)
+            dimensions_per_metric.append(bits)
+
+        metrics_per_dimension = [0] * len(dimensions)
+        for metric_id, bits in enumerate(dimensions_per_metric):
+            for dimension_id in range(len(dimensions)):
+                if bits >> dimension_id & 1:
+                    metrics_per_dimension[dimension_id] |= 1 << metric_id
+
+        return cls(
+            metrics=metrics,
+            dimensions=dimensions,
+            metric_ids=MappingProxyType(metric_ids),
+            dimension_ids=MappingProxyType(dimension_ids),
+            dimensions_per_metric=tuple(dimensions_per_metric),
+            metrics_per_dimension=tuple(metrics_per_dimension),
+        )
+
+    def get_valid_metrics(self, dimensions: Iterable[Dimension]) -> set[Metric]:
+        """
+        Return the metrics compatible with all the given dimensions.
+        """
+        bits = (1 << len(self.metrics)) - 1
+        for dimension in dimensions:
+            if (dimension_id := self.dimension_ids.get(dimension)) is None:
+                return set()
+            bits &= self.metrics_per_dimension[dimension_id]
+
+        return decode_bitset(bits, self.metrics)
+
+    def get_valid_dimensions(self, metrics: Iterable[Metric]) -> set[Dimension]:
+        """
+        Return the dimensions compatible with all the given metrics.
+        """
+        bits = (1 << len(self.dimensions)) - 1
+        for metric in metrics:
+            if (metric_id := self.metric_ids.get(metric)) is None:
+                return set()
+            bits &= self.dimensions_per_metric[metric_id]
+
+        return decode_bitset(bits, self.dimensions)
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """
+    An immutable snapshot of the metadata in a semantic layer.
+
+    The snapshot is tagged with the backend version token it was built from, so that it
+    can be reused until the schema changes. The parsed ASTs are shared between callers
+    and should be copied before being modified.
+    """
+
+    version: Hashable
+    views: Mapping[Relation, exp.Select]
+    # the relations each view reads from, directly and after resolving other views
+    view_dependencies: Mapping[Relation, frozenset[Relation]]
+    view_tables: Mapping[Relation, frozenset[Relation]]
+    metrics: frozenset[Metric]
+    compiled_metrics: Mapping[Metric, CompiledMetric]
+    dimensions: Mapping[SemanticView, frozenset[Dimension]]
+    dimensions_per_table: Mapping[
+        SemanticView,
+        Mapping[Relation, frozenset[Dimension]],
+    ]
+    dimension_joins: Mapping[Relation, frozenset[exp.Join]]
+    join_graph: JoinGraph
+    column_types: Mapping[Relation, Mapping[str, str]]
+    compatibility: Mapping[SemanticView, CompatibilityIndex]
+
+    def get_compatibility_index(
+        self,
+        semantic_view: SemanticView,
+    ) -> CompatibilityIndex:
+        """
+        Return the metric/dimension compatibility index for a semantic view.
+        """
+        if semantic_view not in self.compatibility:
+            raise ValueError(f"Unknown semantic view: {semantic_view.name}")
+
+        return self.compatibility[semantic_view]
+
+    def get_valid_metrics(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Metric]:
+        """
+        Return compatible metrics for the given dimensions.
+
+        Raises `ValueError` if any of the given metrics is not compatible.
+        """
+        index = self.get_compatibility_index(semantic_view)
+        valid = index.get_valid_metrics(dimensions)
+
+        if invalid := metrics - valid:
+            raise ValueError(
+                "Some given metrics are not valid for the given dimensions: "
+                + ", ".join(sorted(metric.name for metric in invalid))
+            )
+
+        return valid
+
+    def get_valid_dimensions(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Dimension]:
+        """
+        Return compatible dimensions for the given metrics.
+
+        Raises `ValueError` if any of the given dimensions is not compatible.
+        """
+        index = self.get_compatibility_index(semantic_view)
+        valid = index.get_valid_dimensions(metrics) & self.dimensions.get(
+            semantic_view,
+            frozenset(),
+        )
+
+        if invalid := dimensions - valid:
+            raise ValueError(
+                "Some given dimensions are not valid for the given metrics: "
+                + ", ".join(sorted(dimension.name for dimension in invalid))
+            )
+
+        return valid
+
+
+@dataclass
+class CatalogStats:
+    """
+    Counters for catalog lookups.
+
+    A hit is a lookup served from the current snapshot; a miss is a lookup that had to
+    build a snapshot; a rebuild is a miss that replaced an outdated snapshot.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    rebuilds: int = 0
+
+
+def freeze(mapping: dict[Any, Any]) -> MappingProxyType[Any, Any]:
+    return MappingProxyType(mapping)
+
+
+class CatalogPickler(pickle.Pickler):
+    """
+    A pickler that supports the read-only mappings used in the catalog.
+    """
+
+    dispatch_table = {
+        **copyreg.dispatch_table,
+        MappingProxyType: lambda mapping: (freeze, (dict(mapping),)),
+    }
+
+
+def dump_catalog(catalog: Catalog, path: str | Path) -> None:
+    """
+    Write a catalog snapshot to a file.
+
+    The compiled ASTs are stored as-is, so that loading the catalog doesn't require
+    parsing any SQL. The file is tied to the catalog format and to the version of
+    `sqlglot`, since the ASTs change between versions.
+    """
+    buffer = io.BytesIO()
+    CatalogPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(catalog)
+    payload = zlib.compress(buffer.getvalue(), 1)
+
+    with open(path, "wb") as file:
+        pickle.dump(
+            (CATALOG_FORMAT, sqlglot.__version__, payload),
+            file,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+
+def read_catalog(path: str | Path) -> Catalog:
+    """
+    Read a catalog snapshot written by `dump_catalog`.
+
+    Raises `ValueError` if the file was written by an incompatible version. The file is
+    unpickled, so it must come from a trusted source.
+    """
+    with open(path, "rb") as file:
+        format_, sqlglot_version, payload = pickle.load(file)
+
+    if format_ != CATALOG_FORMAT or sqlglot_version != sqlglot.__version__:
+        raise ValueError(
+            f"Incompatible catalog file: format {format_}, sqlglot {sqlglot_version}"
+        )
+
+    catalog = pickle.loads(zlib.decompress(payload))
+    if not isinstance(catalog, Catalog):
+        raise ValueError("Invalid catalog file")
+
+    return catalog
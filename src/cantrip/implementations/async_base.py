@@ -0,0 +1,310 @@
+import asyncio
+from collections.abc import Hashable
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from cantrip.cache import LRUCache
+from cantrip.catalog import Catalog, CatalogStats, dump_catalog
+from cantrip.implementations.base import BaseSemanticLayer
+from cantrip.instrumentation import Instrumentation
+from cantrip.models import (
+    Dimension,
+    Filter,
+    Metric,
+    Query,
+    SemanticView,
+    Sort,
+)
+from cantrip.results import AsyncBatchedResult, ColumnarResult, ColumnType
+
+T = TypeVar("T")
+
+
+class AsyncBaseSemanticLayer:
+    """
+    Asynchronous base semantic layer.
+
+    This wraps a synchronous semantic layer (`layer_class`) around an async SQLAlchemy
+    engine. The database-specific introspection from the synchronous layer is reused by
+    running it on async connections through `run_sync`, and independent introspection
+    queries are run concurrently when the catalog is built. Query generation doesn't
+    touch the database, and is delegated to the synchronous layer as-is.
+    """
+
+    layer_class: type[BaseSemanticLayer] = BaseSemanticLayer
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float | None = None,
+        instrumentation: Instrumentation | None = None,
+    ) -> None:
+        """
+        Initialize the semantic layer with an async DB engine.
+        """
+        self.engine = engine
+        self.layer = self.layer_class(
+            engine.sync_engine,
+            query_cache_size,
+            query_cache_ttl,
+            instrumentation=instrumentation,
+        )
+
+        self._catalog_lock = asyncio.Lock()
+
+    @property
+    def catalog_stats(self) -> CatalogStats:
+        return self.layer.catalog_stats
+
+    @property
+    def query_cache(self) -> LRUCache[Query]:
+        return self.layer.query_cache
+
+    @property
+    def instrumentation(self) -> Instrumentation:
+        return self.layer.instrumentation
+
+    async def run_sync(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Run a synchronous method of the layer on a new async connection.
+        """
+        async with self.engine.connect() as connection:
+            return await connection.run_sync(self._run_with_connection, function, *args)
+
+    def _run_with_connection(
+        self,
+        connection: Connection,
+        function: Callable[..., T],
+        *args: Any,
+    ) -> T:
+        with self.layer.use_connection(connection):
+            return function(*args)
+
+    async def execute(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Execute a SQL query and stream the results.
+        """
+        rows = 0
+        try:
+            with self.instrumentation.span("connect"):
+                connection = await self.engine.connect()
+            try:
+                with self.instrumentation.span("execute"):
+                    result = await connection.stream(text(sql), kwargs or {})
+                async for row in result:
+                    rows += 1
+                    yield row._asdict()
+            finally:
+                await connection.close()
+        finally:
+            self.instrumentation.count("rows_fetched", rows)
+
+    async def execute_batches(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+        batch_size: int = 10_000,
+    ) -> AsyncBatchedResult:
+        """
+        Execute a SQL query and stream the results in batches of tuples.
+        """
+        if batch_size <= 0:
+            raise ValueError("The batch size must be positive")
+
+        with self.instrumentation.span("connect"):
+            connection = await self.engine.connect()
+        try:
+            with self.instrumentation.span("execute"):
+                result = await connection.stream(text(sql), kwargs or {})
+        except Exception:
+            await connection.close()
+            raise
+
+        return AsyncBatchedResult(connection, result, batch_size, self.instrumentation)
+
+    async def execute_columnar(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+        types: dict[str, ColumnType] | None = None,
+        batch_size: int = 10_000,
+    ) -> ColumnarResult:
+        """
+        Execute a SQL query and return the results as typed columns.
+        """
+        async with await self.execute_batches(sql, kwargs, batch_size) as result:
+            return await result.to_columnar(types)
+
+    async def get_column_types(
+        self,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> dict[str, ColumnType]:
+        """
+        Return the result column types for a query, based on the catalog metadata.
+        """
+        catalog = await self.get_catalog()
+        return self.layer.get_column_types(metrics, dimensions, catalog)
+
+    async def get_version(self) -> Hashable | None:
+        """
+        Return a token that changes whenever the database schema changes.
+        """
+        return await self.run_sync(self.layer.get_version)
+
+    async def get_catalog(self) -> Catalog:
+        """
+        Return the catalog snapshot, rebuilding it if the schema has changed.
+        """
+        version = await self.get_version()
+
+        async with self._catalog_lock:
+            if (catalog := self.layer.lookup_catalog(version)) is None:
+                catalog = await self.build_catalog(version)
+                self.layer.replace_catalog(catalog)
+
+            return catalog
+
+    async def save_catalog(self, path: str | Path) -> None:
+        """
+        Write the catalog snapshot to a file, to be restored with `restore_catalog`.
+        """
+        dump_catalog(await self.get_catalog(), path)
+
+    def restore_catalog(self, path: str | Path) -> Catalog:
+        """
+        Replace the catalog snapshot with one saved by `save_catalog`.
+        """
+        return self.layer.restore_catalog(path)
+
+    def invalidate_catalog(self) -> None:
+        """
+        Discard the catalog snapshot, forcing it to be rebuilt on the next lookup.
+        """
+        self.layer.invalidate_catalog()
+
+    async def build_catalog(self, version: Hashable | None) -> Catalog:
+        """
+        Introspect the database concurrently and build a new catalog snapshot.
+
+        Layers reading the schema in a single pass (like SQLite) delegate the build to
+        the synchronous layer on a single connection instead, so that they get a
+        consistent snapshot, and can refresh the catalog incrementally.
+        """
+        if self.layer.single_pass_catalog:
+            return await self.run_sync(self.layer.build_catalog, version)
+
+        semantic_views = sorted(
+            await self.get_semantic_views(),
+            key=lambda semantic_view: semantic_view.name,
+        )
+
+        # the metadata is loaded concurrently, so there's a single span for it
+        with self.instrumentation.span("introspect"):
+            (
+                views,
+                dimension_joins,
+                column_types,
+                dimensions,
+                dimensions_per_table,
+            ) = await asyncio.gather(
+                self.run_sync(self.layer.load_views),
+                self.run_sync(self.layer.load_dimension_joins),
+                self.run_sync(self.layer.load_column_types),
+                asyncio.gather(
+                    *[
+                        self.run_sync(self.layer.load_dimensions, semantic_view)
+                        for semantic_view in semantic_views
+                    ]
+                ),
+                asyncio.gather(
+                    *[
+                        self.run_sync(
+                            self.layer.load_dimensions_per_table,
+                            semantic_view,
+                        )
+                        for semantic_view in semantic_views
+                    ]
+                ),
+            )
+
+        with self.instrumentation.span("compile"):
+            return self.layer.create_catalog(
+                version,
+                views=views,
+                dimensions=dict(zip(semantic_views, dimensions)),
+                dimensions_per_table=dict(zip(semantic_views, dimensions_per_table)),
+                dimension_joins=dimension_joins,
+                column_types=column_types,
+            )
+
+    async def get_semantic_views(self) -> set[SemanticView]:
+        return await self.run_sync(self.layer.get_semantic_views)
+
+    async def get_metrics(self, semantic_view: SemanticView) -> set[Metric]:
+        catalog = await self.get_catalog()
+        return set(catalog.metrics)
+
+    async def get_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
+        catalog = await self.get_catalog()
+        return set(catalog.dimensions.get(semantic_view, frozenset()))
+
+    async def get_valid_metrics(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Metric]:
+        catalog = await self.get_catalog()
+        return catalog.get_valid_metrics(semantic_view, metrics, dimensions)
+
+    async def get_valid_dimensions(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Dimension]:
+        catalog = await self.get_catalog()
+        return catalog.get_valid_dimensions(semantic_view, metrics, dimensions)
+
+    async def get_query(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
+    ) -> Query:
+        catalog = await self.get_catalog()
+        return self.layer.get_query_from_catalog(
+            catalog,
+            semantic_view,
+            metrics,
+            dimensions,
+            filters,
+            sort,
+            limit,
+            offset,
+            grouping_sets,
+            sample,
+        )
+
+    async def get_query_from_standard_sql(
+        self,
+        semantic_view: SemanticView,
+        sql: str,
+    ) -> Query:
+        return self.layer.get_query_from_standard_sql(semantic_view, sql)
@@ -0,0 +1,10 @@
+from cantrip.implementations.async_base import AsyncBaseSemanticLayer
+from cantrip.implementations.sqlite import SQLiteSemanticLayer
+
+
+class AsyncSQLiteSemanticLayer(AsyncBaseSemanticLayer):
+    """
+    Asynchronous SQLite semantic layer, for engines using `sqlite+aiosqlite://`.
+    """
+
+    layer_class = SQLiteSemanticLayer
@@ -1,268 +1,2406 @@
+import threading
 from collections import defaultdict
-from typing import Any, cast, Iterator
+from collections.abc import Hashable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import replace
+from functools import reduce
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Iterator
 
 import sqlglot
 from sqlalchemy import text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
 from sqlglot import exp
 from sqlglot.dialects.dialect import Dialect
-from sqlglot.optimizer.scope import traverse_scope
+from sqlglot.errors import ParseError
 
+from cantrip.cache import CachedResult, LRUCache, ResultCache, get_result_key
+from cantrip.catalog import (
+    Catalog,
+    CatalogStats,
+    CompatibilityIndex,
+    CompiledMetric,
+    ContextKey,
+    build_join_graph,
+    dump_catalog,
+    get_reachable_dimensions,
+    read_catalog,
+    resolve_view_tables,
+    search_join_graph,
+)
+from cantrip.instrumentation import Instrumentation, NoopInstrumentation
 from cantrip.models import (
     Dimension,
     Filter,
+    FilterTypeEnum,
     Metric,
     Query,
+    QueryRequest,
     Relation,
     SemanticView,
     Sort,
     SortDirectionEnum,
 )
+from cantrip.results import BatchedResult, ColumnarResult, ColumnType, hash_join
+from cantrip.rollups import Rollup, split_aggregates
+
+# joins that follow a foreign key and can be rewritten as `LEFT` joins, as (side, kind)
+FUSABLE_JOINS = {("", ""), ("", "INNER"), ("LEFT", ""), ("LEFT", "OUTER")}
+
+# the column telling apart the levels of a query with grouping sets
+GROUPING_ID_COLUMN = "__grouping_id"
+
+# the relation with the groups of all the contexts, when they're combined
+KEYS_ALIAS = "__keys"
+
+# the column tagging the rows of each request in a batch
+BATCH_COLUMN = "__request"
+
+# the suffix of the columns with the error of the metrics in sampled queries
+ERROR_SUFFIX = "__error"
+
+# z-score of the confidence intervals of sampled queries (95%)
+CONFIDENCE_Z = 1.96
+
+# a connection bound to the current context, used instead of the engine
+bound_connection: ContextVar[Connection | None] = ContextVar(
+    "bound_connection",
+    default=None,
+)
+
+QueryFingerprint = tuple[
+    SemanticView,
+    frozenset[Metric],
+    frozenset[Dimension],
+    frozenset[Filter],
+    tuple[tuple[Metric | Dimension, ...], SortDirectionEnum] | None,
+    int | None,
+    int | None,
+    frozenset[frozenset[Dimension]] | None,
+    float | None,
+]
+
+
+def get_query_fingerprint(
+    semantic_view: SemanticView,
+    metrics: set[Metric],
+    dimensions: set[Dimension],
+    filters: set[Filter],
+    sort: Sort | None = None,
+    limit: int | None = None,
+    offset: int | None = None,
+    grouping_sets: list[set[Dimension]] | None = None,
+    sample: float | None = None,
+) -> QueryFingerprint:
+    """
+    Return a canonical, hashable key for a query request.
+
+    The key is insensitive to the order of metrics, dimensions, filters and grouping
+    sets, but not to the order of the sort fields.
+    """
+    return (
+        semantic_view,
+        frozenset(metrics),
+        frozenset(dimensions),
+        frozenset(filters),
+        (sort.fields, sort.direction) if sort else None,
+        limit or None,
+        offset or None,
+        (
+            frozenset(frozenset(dimensions) for dimensions in grouping_sets)
+            if grouping_sets
+            else None
+        ),
+        sample,
+    )
+
+
+def scale_aggregates(expression: exp.Expression, rate: float) -> exp.Expression:
+    """
+    Scale the `SUM` and `COUNT` aggregates of an expression computed over a sample.
+    """
+    expression = expression.copy()
+    for aggregate in list(expression.find_all(exp.Sum, exp.Count)):
+        target = (
+            aggregate.parent if isinstance(aggregate.parent, exp.Filter) else aggregate
+        )
+        scaled = exp.paren(
+            exp.Div(this=target.copy(), expression=exp.Literal.number(rate)),
+            copy=False,
+        )
+        if target is expression:
+            return scaled
+        target.replace(scaled)
+
+    return expression
+
+
+def get_sampling_error(expression: exp.Expression, rate: float) -> exp.Expression:
+    """
+    Return the error of a metric estimated from a Bernoulli sample of the rows.
+
+    The error is the half-width of the confidence interval, from the variance of the
+    Horvitz-Thompson estimator for `SUM` and `COUNT`, and of the sample mean for `AVG`.
+    Other expressions have an unknown error (`NULL`).
+    """
+    aggregate = expression.this if isinstance(expression, exp.Filter) else expression
+
+    def wrap(node: exp.Expression) -> exp.Expression:
+        if isinstance(expression, exp.Filter):
+            return exp.Filter(this=node, expression=expression.expression.copy())
+        return node
+
+    def square(node: exp.Expression) -> exp.Expression:
+        return exp.Mul(this=exp.paren(node.copy()), expression=exp.paren(node.copy()))
+
+    if isinstance(aggregate, exp.Sum):
+        template = f"SQRT((1 - {rate!r}) * __squares) / {rate!r}"
+        placeholders = {"__squares": wrap(exp.Sum(this=square(aggregate.this)))}
+    elif isinstance(aggregate, exp.Count) and not isinstance(
+        aggregate.this,
+        exp.Distinct,
+    ):
+        template = f"SQRT((1 - {rate!r}) * __count) / {rate!r}"
+        placeholders = {"__count": wrap(aggregate.copy())}
+    elif isinstance(aggregate, exp.Avg):
+        template = f"SQRT((__squares - __mean * __mean) * (1 - {rate!r}) / __count)"
+        placeholders = {
+            "__squares": wrap(exp.Avg(this=square(aggregate.this))),
+            "__mean": wrap(aggregate.copy()),
+            "__count": wrap(exp.Count(this=aggregate.this.copy())),
+        }
+    else:
+        return exp.Null()
+
+    error = sqlglot.parse_one(f"{CONFIDENCE_Z} * {template}")
+    for column in list(error.find_all(exp.Column)):
+        column.replace(placeholders[column.name].copy())
+
+    return error
+
+
+def sort_rows(rows: list[dict[str, Any]], sort: Sort) -> None:
+    """
+    Sort result rows in place, with nulls last in both directions, like `paginate`.
+    """
+    descending = sort.direction == SortDirectionEnum.DESC
+    rows.sort(
+        key=lambda row: [
+            ((row[field.name] is None) != descending, row[field.name])
+            for field in sort.fields
+        ],
+        reverse=descending,
+    )
+
+
+def get_grouping_id(dimensions: list[Dimension], level: frozenset[Dimension]) -> int:
+    """
+    Return the grouping ID of a level, with a bit set for each dimension not in it.
+    """
+    return sum(
+        1 << (len(dimensions) - 1 - i)
+        for i, dimension in enumerate(dimensions)
+        if dimension not in level
+    )
+
+
+class BaseSemanticLayer:
+    """
+    Base semantic layer.
+
+    This class provides a reference implementation of a semantic layer. In this
+    implementation, metrics are defined as `VIEW`s with a single aggregated expression,
+    while dimensions are inferred from the database schema and foreign keys.
+
+    The implementation is based on `sqlot`, and should be extended for different
+    databases by overriding the methods that interact with the database (eg, fetching the
+    list of `VIEW`s).
+
+    Metadata is read from the database through the `load_*` methods and kept in an
+    immutable `Catalog` snapshot, which is only rebuilt when the version token returned
+    by `get_version` changes.
+    """
+
+    dialect: Dialect | None = None
+
+    supports_filter_clause: bool = False
+    supports_cte: bool = True
+    supports_grouping_sets: bool = True
+    supports_approx_distinct: bool = True
+
+    # relative standard error of `APPROX_DISTINCT`
+    approx_distinct_error: float = 0.023
+
+    # whether `build_catalog` reads the schema in a single pass, instead of running an
+    # independent query in each of the `load_*` methods
+    single_pass_catalog: bool = False
+
+    def __init__(
+        self,
+        engine: Engine,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float | None = None,
+        result_cache: ResultCache | None = None,
+        instrumentation: Instrumentation | None = None,
+    ) -> None:
+        """
+        Initialize the semantic layer with DB engine.
+
+        Generated queries are kept in an LRU cache with `query_cache_size` entries, each
+        valid for `query_cache_ttl` seconds (forever if `None`). Results fetched with
+        `execute_cached` are kept in `result_cache` (in memory, by default). Spans and
+        counters for each phase are sent to `instrumentation`.
+        """
+        self.engine = engine
+        self.instrumentation: Instrumentation = (
+            instrumentation if instrumentation is not None else NoopInstrumentation()
+        )
+        self.default_schema = self.get_default_schema()
+        self.default_catalog = self.get_default_catalog()
+
+        self.catalog_stats = CatalogStats()
+        self._catalog: Catalog | None = None
+        self._catalog_lock = threading.Lock()
+
+        self.query_cache: LRUCache[Query] = LRUCache(query_cache_size, query_cache_ttl)
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+
+        self.rollups: dict[str, Rollup] = {}
+        self.rollup_sizes: dict[str, int] = {}
+
+    def get_default_schema(self) -> str | None:
+        return None
+
+    def get_default_catalog(self) -> str | None:
+        return None
+
+    @contextmanager
+    def connect(self) -> Iterator[Connection]:
+        """
+        Return a connection to the database.
+
+        If a connection was bound with `use_connection` it's reused, otherwise a new one
+        is checked out from the engine.
+        """
+        if (connection := bound_connection.get()) is not None:
+            yield connection
+            return
+
+        with self.instrumentation.span("connect"):
+            connection = self.engine.connect()
+
+        with connection:
+            yield connection
+
+    @contextmanager
+    def use_connection(self, connection: Connection) -> Iterator[None]:
+        """
+        Bind a connection to the current context, to be used by `execute`.
+        """
+        token = bound_connection.set(connection)
+        try:
+            yield
+        finally:
+            bound_connection.reset(token)
+
+    def execute(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Execute a SQL query and return the results.
+        """
+        rows = 0
+        try:
+            with self.connect() as connection:
+                with self.instrumentation.span("execute"):
+                    result = connection.execute(text(sql), kwargs or {})
+                for row in result:
+                    rows += 1
+                    yield row._asdict()
+        finally:
+            self.instrumentation.count("rows_fetched", rows)
+
+    def execute_batches(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+        batch_size: int = 10_000,
+    ) -> BatchedResult:
+        """
+        Execute a SQL query and stream the results in batches of tuples.
+
+        Server-side cursors are used when the driver supports them, so that memory usage
+        stays flat regardless of the size of the result.
+        """
+        if batch_size <= 0:
+            raise ValueError("The batch size must be positive")
+
+        with self.instrumentation.span("connect"):
+            connection = self.engine.connect()
+        try:
+            if self.engine.dialect.supports_server_side_cursors:
+                connection = connection.execution_options(
+                    stream_results=True,
+                    max_row_buffer=batch_size,
+                )
+            with self.instrumentation.span("execute"):
+                result = connection.execute(text(sql), kwargs or {})
+        except Exception:
+            connection.close()
+            raise
+
+        return BatchedResult(connection, result, batch_size, self.instrumentation)
+
+    def execute_columnar(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+        types: dict[str, ColumnType] | None = None,
+        batch_size: int = 10_000,
+    ) -> ColumnarResult:
+        """
+        Execute a SQL query and return the results as typed columns.
+
+        The column types can be computed from the requested metrics and dimensions with
+        `get_column_types`; columns without a type have it inferred from their values.
+        """
+        with self.execute_batches(sql, kwargs, batch_size) as result:
+            return result.to_columnar(types)
+
+    def execute_cached(
+        self,
+        sql: str,
+        kwargs: dict[str, Any] | None = None,
+        data_version: Hashable | None = None,
+    ) -> CachedResult:
+        """
+        Execute a SQL query, reusing a cached result if the data hasn't changed.
+
+        Results are keyed by the SQL, its parameters and a data version token: the given
+        `data_version`, or the one returned by `get_data_version`. Backends that can't
+        detect data changes should be used with a user-supplied token, or with a TTL in
+        the result cache.
+        """
+        if data_version is None:
+            data_version = self.get_data_version()
+
+        misses = 0
+
+        def compute() -> tuple[tuple[str, ...], list[tuple[Any, ...]]]:
+            nonlocal misses
+            misses += 1
+            with self.execute_batches(sql, kwargs) as result:
+                return result.columns, [row for batch in result for row in batch]
+
+        cached = self.result_cache.get(
+            get_result_key(sql, kwargs, data_version),
+            compute,
+        )
+        self.instrumentation.count(
+            "result_cache.misses" if misses else "result_cache.hits"
+        )
+
+        return cached
+
+    def execute_parallel(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        max_workers: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Execute a semantic query running each context in parallel.
+
+        Instead of combining the contexts in a single statement, each context query is
+        run on its own connection in a thread pool, and the partial results are merged
+        with a hash join on the dimensions, with the same outer join semantics as
+        `combine_context_queries`. Sorting and pagination are then done in Python, so
+        the latency is bound by the slowest context.
+        """
+        if not metrics:
+            raise ValueError("At least one metric is required for parallel execution")
+
+        catalog = self.get_catalog()
+        contexts = self.build_context_queries(catalog, metrics, dimensions, filters)
+        having, filtered = self.apply_having_filters(contexts, filters)
+        if having:
+            raise ValueError(
+                "HAVING filters can't reference metrics from different contexts in "
+                "parallel execution"
+            )
+
+        def run(query: exp.Select) -> tuple[tuple[str, ...], list[tuple[Any, ...]]]:
+            with self.execute_batches(query.sql(dialect=self.dialect)) as result:
+                return result.columns, [row for batch in result for row in batch]
+
+        with ThreadPoolExecutor(max_workers or len(contexts)) as executor:
+            partials = list(executor.map(run, [query for _, query in contexts]))
+
+        keys = [
+            dimension.name for dimension in sorted(dimensions, key=lambda d: d.name)
+        ]
+        columns, rows = (
+            partials[0] if len(partials) == 1 else hash_join(partials, keys, filtered)
+        )
+
+        results = [dict(zip(columns, row)) for row in rows]
+        if sort:
+            sort_rows(results, sort)
+
+        start = offset or 0
+        end = start + limit if limit else None
+
+        return results[start:end]
+
+    def get_column_types(
+        self,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        catalog: Catalog | None = None,
+    ) -> dict[str, ColumnType]:
+        """
+        Return the result column types for a query, based on the catalog metadata.
+        """
+        catalog = catalog or self.get_catalog()
+        types: dict[str, ColumnType] = {}
+
+        for metric in metrics:
+            compiled = catalog.compiled_metrics.get(metric)
+            if compiled is None:
+                continue
+            if isinstance(compiled.expression, exp.Count):
+                types[metric.name] = ColumnType.INTEGER
+            elif not isinstance(compiled.expression, (exp.Min, exp.Max)):
+                types[metric.name] = ColumnType.REAL
+
+        for dimension in dimensions:
+            declared = catalog.column_types.get(dimension.table, {}).get(
+                dimension.column
+            )
+            if declared and (type_ := self.get_column_type(declared)):
+                types[dimension.name] = type_
+
+        return types
+
+    def get_column_type(self, declared: str) -> ColumnType | None:
+        """
+        Map a declared column type to a result column type.
+        """
+        try:
+            data_type = exp.DataType.build(declared, dialect=self.dialect)
+        except ParseError:
+            return None
+
+        if data_type.is_type(*exp.DataType.INTEGER_TYPES):
+            return ColumnType.INTEGER
+        if data_type.is_type(*exp.DataType.REAL_TYPES):
+            return ColumnType.REAL
+        if data_type.is_type(*exp.DataType.TEXT_TYPES):
+            return ColumnType.TEXT
+
+        return None
+
+    def get_version(self) -> Hashable | None:
+        """
+        Return a token that changes whenever the database schema changes.
+
+        When the backend has no way of detecting schema changes this returns `None`, and
+        the catalog is built once and kept until `invalidate_catalog` is called.
+        """
+        return None
+
+    def get_data_version(self) -> Hashable | None:
+        """
+        Return a token that changes whenever the data in the database changes.
+
+        This is used to key the result cache; `None` means the backend can't detect
+        changes, and cached results are only invalidated by their TTL.
+        """
+        return None
+
+    def get_catalog(self) -> Catalog:
+        """
+        Return the catalog snapshot, rebuilding it if the schema has changed.
+        """
+        version = self.get_version()
+
+        with self._catalog_lock:
+            if (catalog := self.lookup_catalog(version)) is None:
+                catalog = self.build_catalog(version)
+                self.replace_catalog(catalog)
+
+            return catalog
+
+    def lookup_catalog(self, version: Hashable | None) -> Catalog | None:
+        """
+        Return the current catalog snapshot if it matches the version.
+
+        This only updates the counters; callers are responsible for locking.
+        """
+        catalog = self._catalog
+        if catalog is not None and catalog.version == version:
+            self.catalog_stats.hits += 1
+            self.instrumentation.count("catalog.hits")
+            return catalog
+
+        self.catalog_stats.misses += 1
+        self.instrumentation.count("catalog.misses")
+        return None
+
+    def replace_catalog(self, catalog: Catalog) -> None:
+        """
+        Replace the current catalog snapshot, discarding any derived caches.
+        """
+        if self._catalog is not None:
+            self.catalog_stats.rebuilds += 1
+
+        self._catalog = catalog
+        self.query_cache.clear()
+
+    def save_catalog(self, path: str | Path) -> None:
+        """
+        Write the catalog snapshot to a file, to be restored with `restore_catalog`.
+        """
+        dump_catalog(self.get_catalog(), path)
+
+    def restore_catalog(self, path: str | Path) -> Catalog:
+        """
+        Replace the catalog snapshot with one saved by `save_catalog`.
+
+        This skips introspecting the database and parsing the views, which is useful for
+        fast cold starts. The snapshot is still tagged with its version, so it's rebuilt
+        on the next lookup if the schema has changed since it was saved.
+        """
+        catalog = read_catalog(path)
+        with self._catalog_lock:
+            self.replace_catalog(catalog)
+
+        return catalog
+
+    def invalidate_catalog(self) -> None:
+        """
+        Discard the catalog snapshot, forcing it to be rebuilt on the next lookup.
+        """
+        with self._catalog_lock:
+            self._catalog = None
+            self.query_cache.clear()
+
+    def build_catalog(self, version: Hashable | None) -> Catalog:
+        """
+        Introspect the database and build a new catalog snapshot.
+        """
+        span = self.instrumentation.span
+        semantic_views = self.get_semantic_views()
+
+        with span("introspect.views"):
+            views = self.load_views()
+        with span("introspect.dimensions"):
+            dimensions = {
+                semantic_view: self.load_dimensions(semantic_view)
+                for semantic_view in semantic_views
+            }
+        with span("introspect.dimensions_per_table"):
+            dimensions_per_table = {
+                semantic_view: self.load_dimensions_per_table(semantic_view)
+                for semantic_view in semantic_views
+            }
+        with span("introspect.dimension_joins"):
+            dimension_joins = self.load_dimension_joins()
+        with span("introspect.column_types"):
+            column_types = self.load_column_types()
+
+        with span("compile"):
+            return self.create_catalog(
+                version,
+                views=views,
+                dimensions=dimensions,
+                dimensions_per_table=dimensions_per_table,
+                dimension_joins=dimension_joins,
+                column_types=column_types,
+            )
+
+    def create_catalog(
+        self,
+        version: Hashable | None,
+        views: dict[Relation, exp.Select],
+        dimensions: dict[SemanticView, set[Dimension]],
+        dimensions_per_table: dict[SemanticView, dict[Relation, set[Dimension]]],
+        dimension_joins: dict[Relation, set[exp.Join]],
+        column_types: dict[Relation, dict[str, str]],
+    ) -> Catalog:
+        """
+        Build a catalog snapshot from the introspected metadata.
+
+        This doesn't touch the database, so the metadata can be loaded concurrently.
+        """
+        # reuse the metrics of the current snapshot when their views haven't changed
+        view_dependencies = self.get_view_dependencies(views, self._catalog)
+        view_tables = resolve_view_tables(view_dependencies)
+        compiled_metrics = self.load_metrics(views, view_tables, self._catalog)
+
+        frozen_dimensions = {
+            semantic_view: frozenset(members)
+            for semantic_view, members in dimensions.items()
+        }
+        # dimensions can be reached through any number of joins
+        join_graph = build_join_graph(dimension_joins)
+        frozen_dimensions_per_table = {
+            semantic_view: MappingProxyType(
+                get_reachable_dimensions(tables, join_graph)
+            )
+            for semantic_view, tables in dimensions_per_table.items()
+        }
+
+        return Catalog(
+            version=version,
+            views=MappingProxyType(views),
+            view_dependencies=MappingProxyType(view_dependencies),
+            view_tables=MappingProxyType(view_tables),
+            metrics=frozenset(compiled_metrics),
+            compiled_metrics=MappingProxyType(compiled_metrics),
+            dimensions=MappingProxyType(frozen_dimensions),
+            dimensions_per_table=MappingProxyType(frozen_dimensions_per_table),
+            dimension_joins=MappingProxyType(
+                {table: frozenset(joins) for table, joins in dimension_joins.items()}
+            ),
+            join_graph=MappingProxyType(join_graph),
+            column_types=MappingProxyType(
+                {
+                    table: MappingProxyType(types)
+                    for table, types in column_types.items()
+                }
+            ),
+            compatibility=self.build_compatibility(
+                compiled_metrics,
+                frozen_dimensions,
+                frozen_dimensions_per_table,
+            ),
+        )
+
+    def update_catalog(
+        self,
+        catalog: Catalog,
+        version: Hashable | None,
+        views: dict[Relation, exp.Select],
+    ) -> Catalog:
+        """
+        Build a catalog snapshot from an existing one, when only the views changed.
+
+        The dimensions, joins and column types are shared with the existing snapshot,
+        and only the metrics of views that were added or changed are compiled.
+        """
+        view_dependencies = self.get_view_dependencies(views, catalog)
+        view_tables = resolve_view_tables(view_dependencies)
+        compiled_metrics = self.load_metrics(views, view_tables, catalog)
+
+        return replace(
+            catalog,
+            version=version,
+            views=MappingProxyType(views),
+            view_dependencies=MappingProxyType(view_dependencies),
+            view_tables=MappingProxyType(view_tables),
+            metrics=frozenset(compiled_metrics),
+            compiled_metrics=MappingProxyType(compiled_metrics),
+            compatibility=self.build_compatibility(
+                compiled_metrics,
+                catalog.dimensions,
+                catalog.dimensions_per_table,
+            ),
+        )
+
+    def build_compatibility(
+        self,
+        compiled_metrics: Mapping[Metric, CompiledMetric],
+        dimensions: Mapping[SemanticView, frozenset[Dimension]],
+        dimensions_per_table: Mapping[
+            SemanticView,
+            Mapping[Relation, frozenset[Dimension]],
+        ],
+    ) -> Mapping[SemanticView, CompatibilityIndex]:
+        """
+        Build the compatibility index of each semantic view.
+        """
+        return MappingProxyType(
+            {
+                semantic_view: CompatibilityIndex.build(
+                    compiled_metrics,
+                    dimensions.get(semantic_view, frozenset()),
+                    dimensions_per_table.get(semantic_view, {}),
+                )
+                for semantic_view in dimensions.keys() | dimensions_per_table.keys()
+            }
+        )
+
+    def get_semantic_views(self) -> set[SemanticView]:
+        raise NotImplementedError()
+
+    def get_metrics(self, semantic_view: SemanticView) -> set[Metric]:
+        return set(self.get_catalog().metrics)
+
+    def get_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
+        return set(self.get_catalog().dimensions.get(semantic_view, frozenset()))
+
+    def get_compatibility_index(
+        self,
+        semantic_view: SemanticView,
+    ) -> CompatibilityIndex:
+        """
+        Return the metric/dimension compatibility index for a semantic view.
+        """
+        return self.get_catalog().get_compatibility_index(semantic_view)
+
+    def get_valid_metrics(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Metric]:
+        return self.get_catalog().get_valid_metrics(semantic_view, metrics, dimensions)
+
+    def get_valid_dimensions(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Dimension]:
+        return self.get_catalog().get_valid_dimensions(
+            semantic_view,
+            metrics,
+            dimensions,
+        )
+
+    def get_query(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
+    ) -> Query:
+        return self.get_query_from_catalog(
+            self.get_catalog(),
+            semantic_view,
+            metrics,
+            dimensions,
+            filters,
+            sort,
+            limit,
+            offset,
+            grouping_sets,
+            sample,
+        )
+
+    def get_query_from_catalog(
+        self,
+        catalog: Catalog,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
+    ) -> Query:
+        """
+        Build a SQL query from a given catalog snapshot, using the query cache.
+        """
+        if grouping_sets is not None:
+            self.validate_grouping_sets(dimensions, grouping_sets)
+
+        key = (
+            catalog.version,
+            get_query_fingerprint(
+                semantic_view,
+                metrics,
+                dimensions,
+                filters,
+                sort,
+                limit,
+                offset,
+                grouping_sets,
+                sample,
+            ),
+        )
+        if query := self.query_cache.get(key):
+            self.instrumentation.count("query_cache.hits")
+            return query
+
+        self.instrumentation.count("query_cache.misses")
+        query = self.build_query(
+            catalog,
+            semantic_view,
+            metrics,
+            dimensions,
+            filters,
+            sort,
+            limit,
+            offset,
+            grouping_sets,
+            sample,
+        )
+        self.query_cache.set(key, query)
+
+        return query
+
+    def validate_grouping_sets(
+        self,
+        dimensions: set[Dimension],
+        grouping_sets: list[set[Dimension]],
+    ) -> None:
+        """
+        Check that grouping sets are not empty, and only have the selected dimensions.
+        """
+        if not grouping_sets:
+            raise ValueError("At least one grouping set is required")
+
+        if unknown := {
+            dimension.name
+            for level in grouping_sets
+            for dimension in level
+            if dimension not in dimensions
+        }:
+            raise ValueError(
+                "Grouping sets can only reference the selected dimensions: "
+                + ", ".join(sorted(unknown))
+            )
+
+    def build_query(
+        self,
+        catalog: Catalog,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
+    ) -> Query:
+        """
+        Build a SQL query from the catalog, bypassing the query cache.
+
+        With `grouping_sets` the metrics are computed for each subset of the dimensions,
+        in a single query with a `__grouping_id` column telling the levels apart, like
+        the `GROUPING` function: bit `i` (starting from the most significant) is set if
+        the `i`-th dimension, sorted by name, is aggregated away. Dimensions not in a
+        level are `NULL`.
+
+        With `sample` (a fraction between 0 and 1) the metrics are estimated from a
+        deterministic sample of the rows, and each one has a `<metric>__error` column
+        with the half-width of its 95% confidence interval. See `sample_context_queries`
+        for how each metric is estimated.
+        """
+        if sample is not None and not 0 < sample <= 1:
+            raise ValueError(f"Sample rate must be between 0 and 1: {sample}")
+        if sample is not None and grouping_sets is not None:
+            raise ValueError("Grouping sets can't be computed from a sample")
+
+        # TODO: validate metrics and dimensions
+        with self.instrumentation.span("generate"):
+            query: exp.Query
+            if grouping_sets is not None:
+                query = self.build_grouping_sets_query(
+                    catalog,
+                    metrics,
+                    dimensions,
+                    filters,
+                    grouping_sets,
+                )
+            else:
+                contexts = self.build_context_queries(
+                    catalog,
+                    metrics,
+                    dimensions,
+                    filters,
+                )
+                if sample is not None:
+                    self.sample_context_queries(catalog, contexts, sample)
+                having, filtered = self.apply_having_filters(contexts, filters)
+                query = self.combine_context_queries(
+                    contexts,
+                    dimensions,
+                    having,
+                    errors=sample is not None,
+                    filtered=filtered,
+                )
+            query = self.paginate(query, sort, limit, offset)
+
+        with self.instrumentation.span("render"):
+            return Query(sql=query.sql(dialect=self.dialect))
+
+    def paginate(
+        self,
+        query: exp.Query,
+        sort: Sort | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+    ) -> exp.Query:
+        """
+        Sort and paginate the results of a query.
+
+        Nulls are sorted last in both directions, regardless of the database default.
+        """
+        if sort:
+            query.args["order"] = exp.Order(
+                expressions=[
+                    exp.Ordered(
+                        this=exp.column(field.name),
+                        desc=sort.direction == SortDirectionEnum.DESC,
+                        nulls_first=False,
+                    )
+                    for field in sort.fields
+                ]
+            )
+
+        if offset:
+            query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
+
+        return query
+
+    def build_grouping_sets_query(
+        self,
+        catalog: Catalog,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        grouping_sets: list[set[Dimension]],
+    ) -> exp.Query:
+        """
+        Build a query computing the metrics at several levels of the dimensions.
+
+        Dialects with `GROUPING SETS` compute every level in each context query. Other
+        dialects combine one query per level with `UNION ALL`; when the metrics can be
+        re-aggregated the levels read from a single shared scan of each context, at the
+        grain of all the dimensions.
+        """
+        dimensions_by_name = sorted(dimensions, key=lambda dim: dim.name)
+        levels = sorted(
+            {frozenset(level) for level in grouping_sets},
+            key=lambda level: get_grouping_id(dimensions_by_name, level),
+            reverse=True,
+        )
+
+        if self.supports_grouping_sets:
+            contexts = self.build_context_queries(
+                catalog,
+                metrics,
+                dimensions,
+                filters,
+            )
+            for _, query in contexts:
+                keys = query.args["group"].expressions if dimensions else []
+                query.args["group"] = exp.Group(
+                    grouping_sets=[
+                        exp.GroupingSets(
+                            expressions=[
+                                exp.Tuple(
+                                    expressions=[
+                                        key.copy()
+                                        for dimension, key in zip(
+                                            dimensions_by_name,
+                                            keys,
+                                        )
+                                        if dimension in level
+                                    ]
+                                )
+                                for level in levels
+                            ]
+                        )
+                    ]
+                )
+                query.expressions.append(
+                    exp.alias_(
+                        (
+                            exp.Anonymous(
+                                this="GROUPING",
+                                expressions=[key.copy() for key in keys],
+                            )
+                            if keys
+                            else exp.Literal.number(0)
+                        ),
+                        GROUPING_ID_COLUMN,
+                    )
+                )
+
+            having, filtered = self.apply_having_filters(contexts, filters)
+            return self.combine_context_queries(
+                contexts,
+                dimensions,
+                having,
+                grouping=True,
+                filtered=filtered,
+            )
+
+        predicates = self.get_filter_expressions(filters, FilterTypeEnum.WHERE)
+        scans = (
+            None
+            if self.get_filter_expressions(filters, FilterTypeEnum.HAVING)
+            else self.build_scans(catalog, [(metrics, dimensions)], predicates)
+        )
+
+        branches: list[tuple[exp.Expression, exp.Select]] = []
+        for level in levels:
+            if scans is not None:
+                query = self.read_scans(catalog, scans, metrics, set(level))
+            else:
+                contexts = self.build_context_queries(
+                    catalog,
+                    metrics,
+                    set(level),
+                    filters,
+                )
+                having, filtered = self.apply_having_filters(contexts, filters)
+                query = self.combine_context_queries(
+                    contexts,
+                    set(level),
+                    having,
+                    filtered=filtered,
+                )
+
+            branches.append(
+                (
+                    exp.Literal.number(get_grouping_id(dimensions_by_name, level)),
+                    query,
+                )
+            )
+
+        names = {dimension.name for dimension in dimensions}
+        columns = [
+            name for name in branches[0][1].named_selects if name not in names
+        ] + [dimension.name for dimension in dimensions_by_name]
+
+        return self.union_branches(branches, GROUPING_ID_COLUMN, columns, scans)
+
+    def execute_batch(self, requests: list[QueryRequest]) -> list[list[dict[str, Any]]]:
+        """
+        Execute many semantic queries at once, eg, for all the charts in a dashboard.
+
+        The requests share a single catalog snapshot. Requests with the same semantic
+        view and filters are answered by a single statement, where each context is
+        scanned once at the combined grain of the requests, and each request
+        re-aggregates the scan by its own dimensions. Requests that can't share a scan
+        (with `HAVING` filters, or metrics that can't be re-aggregated) run on their
+        own. Returns the rows of each request, in order.
+
+        Since `UNION ALL` doesn't preserve the order of its branches, the rows of each
+        request are sorted again after being split.
+        """
+        catalog = self.get_catalog()
+
+        groups: dict[
+            tuple[SemanticView, frozenset[Filter]],
+            list[QueryRequest],
+        ] = defaultdict(list)
+        for request in dict.fromkeys(requests):
+            groups[(request.semantic_view, request.filters)].append(request)
+
+        results: dict[QueryRequest, list[dict[str, Any]]] = {}
+        for group in groups.values():
+            query = self.build_batch_query(catalog, group) if len(group) > 1 else None
+            if query is None:
+                for request in group:
+                    query = self.get_query_from_catalog(
+                        catalog,
+                        request.semantic_view,
+                        set(request.metrics),
+                        set(request.dimensions),
+                        set(request.filters),
+                        request.sort,
+                        request.limit,
+                        request.offset,
+                    )
+                    results[request] = list(self.execute(query.sql))
+                continue
+
+            rows: dict[int, list[dict[str, Any]]] = defaultdict(list)
+            for row in self.execute(query.sql):
+                rows[row.pop(BATCH_COLUMN)].append(row)
+            for i, request in enumerate(group):
+                columns = self.get_batch_columns(request)
+                results[request] = [
+                    {column: row[column] for column in columns} for row in rows[i]
+                ]
+                if request.sort:
+                    sort_rows(results[request], request.sort)
+
+        return [results[request] for request in requests]
+
+    def get_batch_columns(self, request: QueryRequest) -> list[str]:
+        """
+        Return the columns of a request, in the order they're selected.
+        """
+        return [
+            field.name
+            for fields in (request.metrics, request.dimensions)
+            for field in sorted(fields, key=lambda field: field.name)
+        ]
+
+    def build_batch_query(
+        self,
+        catalog: Catalog,
+        requests: list[QueryRequest],
+    ) -> Query | None:
+        """
+        Build a single query answering requests with the same view and filters.
+
+        Each context is pre-aggregated once in a CTE, by all the dimensions requested
+        with it, and each request reads from the CTEs of its contexts. The results are
+        combined with `UNION ALL`, tagged by the position of the request in a
+        `__request` column, and padded with `NULL`s for the columns of other requests.
+
+        Returns `None` if the requests can't share a scan.
+        """
+        filters = requests[0].filters
+        if any(filter_.type == FilterTypeEnum.HAVING for filter_ in filters):
+            return None
+        predicates = self.get_filter_expressions(filters, FilterTypeEnum.WHERE)
+
+        with self.instrumentation.span("generate"):
+            scans = self.build_scans(
+                catalog,
+                [
+                    (set(request.metrics), set(request.dimensions))
+                    for request in requests
+                ],
+                predicates,
+            )
+            if scans is None:
+                return None
+
+            branches = [
+                (
+                    exp.Literal.number(i),
+                    self.paginate(
+                        self.read_scans(
+                            catalog,
+                            scans,
+                            set(request.metrics),
+                            set(request.dimensions),
+                        ),
+                        request.sort,
+                        request.limit,
+                        request.offset,
+                    ),
+                )
+                for i, request in enumerate(requests)
+            ]
+            columns = list(
+                dict.fromkeys(
+                    column
+                    for request in requests
+                    for column in self.get_batch_columns(request)
+                )
+            )
+            batch = self.union_branches(branches, BATCH_COLUMN, columns, scans)
+
+        with self.instrumentation.span("render"):
+            return Query(sql=batch.sql(dialect=self.dialect))
+
+    def build_scans(
+        self,
+        catalog: Catalog,
+        requests: list[tuple[set[Metric], set[Dimension]]],
+        predicates: list[exp.Expression],
+    ) -> dict[ContextKey, Rollup] | None:
+        """
+        Build one shared scan for each context used by a list of (metrics, dimensions).
+
+        Each scan computes the partial aggregates of the metrics at the combined grain
+        of the dimensions requested with its context, filtered by the `WHERE`
+        predicates, so that it can be re-aggregated like a rollup. Returns `None` if a
+        metric can't be re-aggregated, or if a predicate can't be applied to any scan.
+        """
+        contexts: dict[ContextKey, dict[Metric, CompiledMetric]] = defaultdict(dict)
+        grains: dict[ContextKey, set[Dimension]] = defaultdict(set)
+        for metrics, dimensions in requests:
+            for context, compiled_metrics in self.get_contexts(
+                catalog,
+                metrics,
+            ).items():
+                contexts[context].update(
+                    (compiled.metric, compiled) for compiled in compiled_metrics
+                )
+                grains[context].update(dimensions)
+
+        scans: dict[ContextKey, Rollup] = {}
+        pushed: set[int] = set()
+        for i, (context, compiled_metrics) in enumerate(contexts.items()):
+            context_predicates = self.get_context_predicates(
+                catalog,
+                context,
+                predicates,
+            )
+            pushed.update(j for j, _ in context_predicates)
+            try:
+                query, partials = self.build_partial_query(
+                    catalog,
+                    context,
+                    sorted(
+                        compiled_metrics.values(),
+                        key=lambda compiled: compiled.metric.name,
+                    ),
+                    grains[context],
+                    [predicate for _, predicate in context_predicates],
+                )
+            except ValueError:
+                return None
+            scans[context] = Rollup(
+                table=Relation(f"__scan_{i}"),
+                context=context,
+                dimensions=frozenset(grains[context]),
+                metrics=MappingProxyType(partials),
+                query=query,
+            )
+
+        if len(pushed) < len(predicates):
+            return None
+
+        return scans
+
+    def read_scans(
+        self,
+        catalog: Catalog,
+        scans: dict[ContextKey, Rollup],
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> exp.Select:
+        """
+        Build a query computing metrics by dimensions from the shared scans.
+        """
+        return self.combine_context_queries(
+            [
+                (
+                    compiled_metrics,
+                    self.build_rollup_query(
+                        scans[context],
+                        compiled_metrics,
+                        dimensions,
+                    ),
+                )
+                for context, compiled_metrics in self.get_contexts(
+                    catalog,
+                    metrics,
+                ).items()
+            ],
+            dimensions,
+        )
+
+    def union_branches(
+        self,
+        branches: list[tuple[exp.Expression, exp.Select]],
+        tag: str,
+        columns: list[str],
+        scans: dict[ContextKey, Rollup] | None = None,
+    ) -> exp.Query:
+        """
+        Combine queries with `UNION ALL`, tagging the rows of each one.
+
+        Each branch selects its tag followed by `columns`, padded with `NULL` for the
+        columns that its query doesn't have. Shared scans are added as CTEs.
+        """
+        selects = []
+        for value, query in branches:
+            selected = set(query.named_selects)
+            selects.append(
+                exp.select(
+                    *[
+                        (
+                            exp.column(column, "branch")
+                            if column in selected
+                            else exp.alias_(exp.Null(), column)
+                        )
+                        for column in columns
+                    ],
+                    exp.alias_(value, tag),
+                ).from_(query.subquery("branch"), copy=False)
+            )
+
+        union: exp.Query = reduce(
+            lambda left, right: exp.union(left, right, distinct=False),
+            selects,
+        )
+        for scan in (scans or {}).values():
+            union = union.with_(scan.table.name, as_=scan.query, copy=False)
+
+        return union
+
+    def get_contexts(
+        self,
+        catalog: Catalog,
+        metrics: set[Metric],
+    ) -> dict[ContextKey, list[CompiledMetric]]:
+        """
+        Group metrics by their context -- FROM/JOINs.
+        """
+        contexts: dict[ContextKey, list[CompiledMetric]] = defaultdict(list)
+        for metric in sorted(metrics, key=lambda metric: metric.name):
+            compiled = catalog.compiled_metrics.get(metric)
+            if compiled is None:
+                raise ValueError(f"Unknown metric: {metric.name}")
+            contexts[compiled.context].append(compiled)
+
+        return contexts
+
+    def build_context_queries(
+        self,
+        catalog: Catalog,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter] | None = None,
+    ) -> list[tuple[list[CompiledMetric], exp.Select]]:
+        """
+        Build one aggregation query for each context needed by the metrics.
+
+        Each query selects its metrics (aliased by name) followed by the dimensions
+        (aliased by their full name), grouped by the dimensions. `WHERE` filters are
+        pushed into every context that has all the tables they reference, so that each
+        scan is pruned at the source.
+        """
+        predicates = self.get_filter_expressions(filters, FilterTypeEnum.WHERE)
+        pushed: set[int] = set()
+
+        queries: list[tuple[list[CompiledMetric], exp.Select]] = []
+        contexts: dict[ContextKey, list[CompiledMetric]] = {}
+        for context, compiled_metrics in self.get_contexts(catalog, metrics).items():
+            # rollups don't have the columns needed to filter the rows
+            if not self.get_context_predicates(catalog, context, predicates) and (
+                rollup := self.find_rollup(context, compiled_metrics, dimensions)
+            ):
+                query = self.build_rollup_query(rollup, compiled_metrics, dimensions)
+                queries.append((compiled_metrics, query))
+            else:
+                contexts[context] = compiled_metrics
+
+        for (from_, joins), (compiled_metrics, existence) in self.fuse_contexts(
+            catalog,
+            contexts,
+        ).items():
+            required = {dimension.table.name for dimension in dimensions}
+            context_predicates = []
+            for i, predicate in self.get_context_predicates(
+                catalog,
+                (from_, joins),
+                predicates,
+            ):
+                context_predicates.append(predicate)
+                required.update(
+                    self.get_filter_tables(catalog, (from_, joins), predicate)
+                )
+                pushed.add(i)
+
+            wheres = {compiled.where for compiled in compiled_metrics}
+            if len(wheres) == 1:
+                expressions = [
+                    exp.alias_(compiled.expression.copy(), compiled.metric.name)
+                    for compiled in compiled_metrics
+                ]
+                where = wheres.pop()
+            else:
+                expressions = [
+                    exp.alias_(
+                        self.get_metric_as_expression(compiled),
+                        compiled.metric.name,
+                    )
+                    for compiled in compiled_metrics
+                ]
+                where = None
+
+            joins = self.prune_joins(catalog, compiled_metrics, joins, required)
+            query = exp.Select(
+                **{
+                    "expressions": expressions,
+                    "from": from_.copy(),
+                    "joins": [join.copy() for join in joins]
+                    + self.plan_joins(
+                        catalog,
+                        {from_.this.name, *(join.this.name for join in joins)},
+                        required,
+                    ),
+                }
+            )
+            conditions = [where] if where else []
+            conditions.extend(context_predicates)
+            if conditions:
+                query = query.where(
+                    *[condition.copy() for condition in conditions],
+                    copy=False,
+                )
+
+            # select and group by dimensions
+            if dimensions:
+                group = query.args.setdefault("group", exp.Group())
+                for dimension in sorted(dimensions, key=lambda dim: dim.name):
+                    column = exp.column(dimension.column, dimension.table.name)
+                    query.expressions.append(exp.alias_(column, dimension.name))
+                    group.append("expressions", column.copy())
+
+                # keep only the groups that any of the fused contexts would have
+                if existence:
+                    query = query.having(
+                        exp.or_(
+                            *[
+                                exp.GT(
+                                    this=exp.Sum(
+                                        this=exp.Case(
+                                            ifs=[
+                                                exp.If(
+                                                    this=condition.copy(),
+                                                    true=exp.Literal.number(1),
+                                                )
+                                            ],
+                                            default=exp.Literal.number(0),
+                                        )
+                                    ),
+                                    expression=exp.Literal.number(0),
+                                )
+                                for condition in existence
+                            ]
+                        ),
+                        copy=False,
+                    )
+
+            queries.append((compiled_metrics, query))
+
+        if unused := [
+            predicate.sql(dialect=self.dialect)
+            for i, predicate in enumerate(predicates)
+            if i not in pushed
+        ]:
+            raise ValueError(
+                "Some filters reference tables not used by the metrics: "
+                + ", ".join(unused)
+            )
+
+        return queries
+
+    def sample_context_queries(
+        self,
+        catalog: Catalog,
+        contexts: list[tuple[list[CompiledMetric], exp.Select]],
+        rate: float,
+    ) -> None:
+        """
+        Estimate the metrics of the context queries from a sample of their rows.
+
+        `SUM` and `COUNT` are scaled by the sampling rate, while `AVG`, `MIN` and `MAX`
+        are read from the sample as is. Distinct counts can't be scaled, so contexts
+        with them read all the rows, using a sketch (`APPROX_DISTINCT`) when the
+        database supports it. Contexts answered by a rollup are already cheap, and are
+        computed exactly.
+
+        An error column is added to each query, after the dimensions.
+        """
+        rollups = {rollup.table.name for rollup in self.rollups.values()}
+        for compiled_metrics, query in contexts:
+            metrics = query.expressions[: len(compiled_metrics)]
+            distinct = any(
+                isinstance(count.this, exp.Distinct)
+                for metric in metrics
+                for count in metric.find_all(exp.Count)
+            )
+
+            errors: list[exp.Expression]
+            if (
+                query.args["from"].this.name in rollups
+                or distinct
+                or not self.sample_query(catalog, query, rate)
+            ):
+                errors = [self.approximate_distinct(metric) for metric in metrics]
+            else:
+                errors = [get_sampling_error(metric.this, rate) for metric in metrics]
+                for metric in metrics:
+                    metric.set("this", scale_aggregates(metric.this, rate))
+
+            query.expressions.extend(
+                exp.alias_(error, compiled.metric.name + ERROR_SUFFIX)
+                for compiled, error in zip(compiled_metrics, errors)
+            )
+
+    def approximate_distinct(self, metric: exp.Alias) -> exp.Expression:
+        """
+        Replace exact distinct counts in a metric with a sketch, returning its error.
+
+        The error is only known for metrics that are a single distinct count; metrics
+        without sketches are exact.
+        """
+        if not self.supports_approx_distinct:
+            return exp.Literal.number(0)
+
+        counts = [
+            count
+            for count in metric.find_all(exp.Count)
+            if isinstance(count.this, exp.Distinct) and len(count.this.expressions) == 1
+        ]
+        if not counts:
+            return exp.Literal.number(0)
+
+        for count in counts:
+            sketch = exp.ApproxDistinct(this=count.this.expressions[0].copy())
+            if count is metric.this:
+                metric.set("this", sketch)
+            else:
+                count.replace(sketch)
+
+        if not isinstance(metric.this, exp.ApproxDistinct):
+            return exp.Null()
+
+        return exp.Mul(
+            this=exp.Literal.number(CONFIDENCE_Z * self.approx_distinct_error),
+            expression=metric.this.copy(),
+        )
+
+    def sample_query(self, catalog: Catalog, query: exp.Select, rate: float) -> bool:
+        """
+        Restrict a context query to a deterministic sample of the rows of its table.
+
+        This uses `TABLESAMPLE` with a fixed seed, and should be overridden for
+        databases without it. Returns false if the table can't be sampled, in which case
+        the metrics are computed from all the rows.
+        """
+        table = query.args["from"].this
+        if not isinstance(table, exp.Table):
+            return False
+
+        table.set(
+            "sample",
+            exp.TableSample(
+                method=exp.var("BERNOULLI"),
+                percent=exp.Literal.number(f"{rate * 100:g}"),
+                seed=exp.Literal.number(0),
+            ),
+        )
+
+        return True
+
+    def get_context_predicates(
+        self,
+        catalog: Catalog,
+        context: ContextKey,
+        predicates: list[exp.Expression],
+    ) -> list[tuple[int, exp.Expression]]:
+        """
+        Return the predicates (and their positions) that can be pushed into a context.
+
+        A predicate can be pushed when every table it references is reachable from the
+        tables of the context through the foreign key graph.
+        """
+        from_, joins = context
+        tables = {from_.this.name, *(join.this.name for join in joins)}
+        reachable = search_join_graph(catalog.join_graph, tables)
+
+        return [
+            (i, predicate)
+            for i, predicate in enumerate(predicates)
+            if self.get_filter_tables(catalog, context, predicate) <= reachable.keys()
+        ]
+
+    def fuse_contexts(
+        self,
+        catalog: Catalog,
+        contexts: dict[ContextKey, list[CompiledMetric]],
+    ) -> dict[ContextKey, tuple[list[CompiledMetric], list[exp.Expression]]]:
+        """
+        Merge contexts over the same table into a single scan, when it's safe.
+
+        Contexts can be merged when all their joins follow foreign keys, since those
+        joins are to-one: as `LEFT` joins they can't change the number of rows, and an
+        inner join is the same as a `LEFT` join plus a condition that the referenced row
+        exists. The joins are unified as `LEFT` joins, and the conditions are added to
+        the `WHERE` of each metric, which then becomes a `FILTER` clause.
+
+        Each context is returned with its metrics and the conditions matching the rows
+        of the original contexts, so that the fused scan only has the groups that at
+        least one of them would have. There are no conditions when one of the original
+        contexts has every row.
+        """
+        foreign_keys = {
+            (target, join.args["on"])
+            for edges in catalog.join_graph.values()
+            for target, join in edges
+        }
+
+        groups: dict[exp.From, list[ContextKey]] = defaultdict(list)
+        for context in contexts:
+            groups[context[0]].append(context)
+
+        output: dict[ContextKey, tuple[list[CompiledMetric], list[exp.Expression]]] = {}
+        for from_, members in groups.items():
+            candidates = [
+                (from_, joins)
+                for _, joins in members
+                if all(
+                    (join.this.name, join.args.get("on")) in foreign_keys
+                    and (join.side, join.kind) in FUSABLE_JOINS
+                    and not join.this.alias
+                    for join in joins
+                )
+            ]
+
+            # members can't disagree on how a table is joined
+            targets: dict[str, exp.Join] = {}
+            for _, joins in candidates:
+                for join in joins:
+                    targets.setdefault(join.this.name, join)
+            if any(
+                targets[join.this.name].args["on"] != join.args["on"]
+                for _, joins in candidates
+                for join in joins
+            ):
+                candidates = []
+
+            fused_joins = tuple(
+                exp.Join(this=join.this.copy(), on=join.args["on"].copy(), side="LEFT")
+                for join in targets.values()
+            )
+            fused: dict[
+                ContextKey,
+                tuple[list[CompiledMetric], exp.Expression | None],
+            ] = {}
+            if len(candidates) > 1:
+                for context in candidates:
+                    if (
+                        result := self.fuse_metrics(
+                            from_,
+                            fused_joins,
+                            context,
+                            contexts[context],
+                        )
+                    ) is not None:
+                        fused[context] = result
+
+            if len(fused) > 1:
+                output[(from_, fused_joins)] = (
+                    sorted(
+                        (
+                            compiled
+                            for compiled_metrics, _ in fused.values()
+                            for compiled in compiled_metrics
+                        ),
+                        key=lambda compiled: compiled.metric.name,
+                    ),
+                    (
+                        []
+                        if any(condition is None for _, condition in fused.values())
+                        else [
+                            condition
+                            for _, condition in fused.values()
+                            if condition is not None
+                        ]
+                    ),
+                )
+            for context in members:
+                if len(fused) < 2 or context not in fused:
+                    output[context] = (contexts[context], [])
+
+        return output
+
+    def fuse_metrics(
+        self,
+        from_: exp.From,
+        fused_joins: tuple[exp.Join, ...],
+        context: ContextKey,
+        compiled_metrics: list[CompiledMetric],
+    ) -> tuple[list[CompiledMetric], exp.Expression | None] | None:
+        """
+        Rewrite the metrics of a context so they can be computed with the fused joins.
+
+        Returns the rewritten metrics together with the condition matching the rows of
+        the original context, or `None` if the metrics can't be moved to the fused
+        context.
+        """
+        _, joins = context
+        conditions = [
+            exp.Is(this=column.copy(), expression=exp.Null()).not_()
+            for join in joins
+            if join.side != "LEFT"
+            for column in join.args["on"].find_all(exp.Column)
+            if column.table == join.this.name
+        ]
+
+        output: list[CompiledMetric] = []
+        for compiled in compiled_metrics:
+            expression = compiled.expression
+            where = compiled.where
+            columns = [
+                column
+                for part in (expression, where)
+                for column in (part.find_all(exp.Column) if part else [])
+            ]
+            if any(not column.table for column in columns):
+                # unqualified columns could become ambiguous with the new joins
+                if joins:
+                    return None
+                expression, where = (
+                    self.qualify_columns(part, from_.this.alias_or_name)
+                    for part in (expression, where)
+                )
+
+            if conditions:
+                where = exp.and_(
+                    *([where] if where else []),
+                    *conditions,
+                    copy=True,
+                )
+            fused = replace(
+                compiled,
+                expression=expression,
+                context=(from_, fused_joins),
+                where=where,
+            )
+
+            # make sure the metric can be filtered, if needed
+            if fused.where:
+                try:
+                    self.get_metric_as_expression(fused)
+                except ValueError:
+                    return None
+
+            output.append(fused)
+
+        # without a shared `WHERE` the context has every row, except for the joins
+        wheres = {compiled.where for compiled in compiled_metrics}
+        if len(wheres) == 1:
+            return output, output[0].where
+
+        return output, exp.and_(*conditions) if conditions else None
+
+    def qualify_columns(
+        self,
+        expression: exp.Expression | None,
+        table: str,
+    ) -> exp.Expression | None:
+        """
+        Qualify the unqualified columns of an expression with a table.
+        """
+        if expression is None:
+            return None
+
+        expression = expression.copy()
+        for column in expression.find_all(exp.Column):
+            if not column.table:
+                column.set("table", exp.to_identifier(table))
+
+        return expression
+
+    def plan_joins(
+        self,
+        catalog: Catalog,
+        tables: set[str],
+        required: set[str],
+    ) -> list[exp.Join]:
+        """
+        Return the joins needed to reach the required tables from the given ones.
+
+        Each table is reached through the shortest path in the foreign key graph, and
+        only the joins along those paths are returned, in a valid order. The joins are
+        `LEFT` joins, so that adding a dimension doesn't change the metric totals.
+        """
+        if required <= tables:
+            return []
+
+        parents = search_join_graph(catalog.join_graph, tables)
+        if unreachable := required - parents.keys():
+            raise ValueError(
+                f"Tables can't be joined to {', '.join(sorted(tables))}: "
+                + ", ".join(sorted(unreachable))
+            )
+
+        needed: set[str] = set()
+        for table in required:
+            while (parent := parents[table]) is not None and table not in needed:
+                needed.add(table)
+                table = parent[0]
+
+        joins: list[exp.Join] = []
+        for table, parent in parents.items():
+            if parent is not None and table in needed:
+                join = parent[1].copy()
+                join.set("side", "LEFT")
+                joins.append(join)
+
+        return joins
+
+    def prune_joins(
+        self,
+        catalog: Catalog,
+        compiled_metrics: list[CompiledMetric],
+        joins: tuple[exp.Join, ...],
+        required: set[str],
+    ) -> list[exp.Join]:
+        """
+        Remove the joins of a context that don't affect the requested metrics.
+
+        Only `LEFT` joins along a foreign key are removed, since they can't change the
+        number of rows, and only when no metric, dimension, filter or other join
+        references their table.
+        """
+        referenced = set(required)
+        for compiled in compiled_metrics:
+            for expression in (compiled.expression, compiled.where):
+                for column in expression.find_all(exp.Column) if expression else []:
+                    # unqualified columns could come from any table
+                    if not column.table:
+                        return list(joins)
+                    referenced.add(column.table)
 
+        foreign_keys = {
+            (target, join.args["on"])
+            for edges in catalog.join_graph.values()
+            for target, join in edges
+        }
 
-class BaseSemanticLayer:
-    """
-    Base semantic layer.
+        kept: list[exp.Join] = []
+        for join in reversed(joins):
+            if (
+                join.this.name in referenced
+                or join.side != "LEFT"
+                or join.kind
+                or (join.this.name, join.args.get("on")) not in foreign_keys
+            ):
+                kept.append(join)
+                referenced.update(column.table for column in join.find_all(exp.Column))
 
-    This class provides a reference implementation of a semantic layer. In this
-    implementation, metrics are defined as `VIEW`s with a single aggregated expression,
-    while dimensions are inferred from the database schema and foreign keys.
+        return kept[::-1]
 
-    The implementation is based on `sqlot`, and should be extended for different
-    databases by overriding the methods that interact with the database (eg, fetching the
-    list of `VIEW`s).
-    """
+    def get_filter_expressions(
+        self,
+        filters: set[Filter] | None,
+        type_: FilterTypeEnum,
+    ) -> list[exp.Expression]:
+        """
+        Parse the filters of a given type, in a deterministic order.
+        """
+        return [
+            sqlglot.parse_one(filter_.expression, dialect=self.dialect)
+            for filter_ in sorted(filters or set(), key=lambda f: f.expression)
+            if filter_.type == type_
+        ]
 
-    dialect: Dialect | None = None
+    def get_filter_tables(
+        self,
+        catalog: Catalog,
+        context: ContextKey,
+        predicate: exp.Expression,
+    ) -> set[str]:
+        """
+        Return the names of the tables referenced by a filter, in a given context.
 
-    supports_filter_clause: bool = False
-    supports_cte: bool = True
+        Unqualified columns are resolved to the table that has them among the tables
+        reachable from the context; if none of them has the column, one of the tables
+        that do is returned, so that the filter is not pushed into the context. Raises
+        `ValueError` if a column is not in any table, or if it's ambiguous.
+        """
+        from_, joins = context
+        reachable = search_join_graph(
+            catalog.join_graph,
+            {from_.this.name, *(join.this.name for join in joins)},
+        )
+
+        tables: set[str] = set()
+        for column in predicate.find_all(exp.Column):
+            if column.table:
+                tables.add(column.table)
+                continue
+
+            owners = sorted(
+                relation.name
+                for relation, columns in catalog.column_types.items()
+                if column.name in columns
+            )
+            if not owners:
+                raise ValueError(
+                    "Filters reference columns not in any table: "
+                    + predicate.sql(dialect=self.dialect)
+                )
+            candidates = [owner for owner in owners if owner in reachable]
+            if len(candidates) > 1:
+                raise ValueError(
+                    "Filters reference ambiguous columns: "
+                    + predicate.sql(dialect=self.dialect)
+                )
+            tables.add(candidates[0] if candidates else owners[0])
+
+        return tables
 
-    def __init__(self, engine: Engine) -> None:
+    def get_column_name(self, column: exp.Column) -> str:
         """
-        Initialize the semantic layer with DB engine.
+        Return the name of a column as used in the metric and dimension aliases.
         """
-        self.engine = engine
-        self.default_schema = self.get_default_schema()
-        self.default_catalog = self.get_default_catalog()
+        if column.table:
+            return f"{self.quote(column.table)}.{self.quote(column.name)}"
 
-    def get_default_schema(self) -> str | None:
-        return None
-
-    def get_default_catalog(self) -> str | None:
-        return None
+        return column.name
 
-    def execute(
+    def resolve_columns(
         self,
-        sql: str,
-        kwargs: Any,
-    ) -> Iterator[dict[str, Any]]:
+        predicate: exp.Expression,
+        columns: dict[str, exp.Expression],
+    ) -> exp.Expression | None:
         """
-        Execute a SQL query and return the results.
+        Replace the columns of a filter, returning `None` if any of them is unknown.
         """
-        with self.engine.connect() as connection:
-            for row in connection.execute(text(sql), **kwargs):
-                yield dict(row)
+        names = {
+            self.get_column_name(column) for column in predicate.find_all(exp.Column)
+        }
+        if not names <= columns.keys():
+            return None
 
-    def get_semantic_views(self) -> set[SemanticView]:
-        raise NotImplementedError()
+        return predicate.copy().transform(
+            lambda node: (
+                columns[self.get_column_name(node)].copy()
+                if isinstance(node, exp.Column)
+                else node
+            ),
+            copy=False,
+        )
 
-    def get_metrics(self, semantic_view: SemanticView) -> set[Metric]:
-        metrics: set[Metric] = set()
+    def apply_having_filters(
+        self,
+        contexts: list[tuple[list[CompiledMetric], exp.Select]],
+        filters: set[Filter] | None,
+    ) -> tuple[list[exp.Expression], set[int]]:
+        """
+        Apply the `HAVING` filters to the context queries.
 
-        for ast in self.get_views().values():
-            if metric := self.get_metric_from_view(ast):
-                metrics.add(metric)
+        A filter that only references the dimensions is applied to every context query,
+        since it only depends on the group. A filter that references the metrics of a
+        single context, and the dimensions, is applied to its query after aggregation;
+        as long as the combined query only keeps the groups of that context, this is
+        equivalent to filtering the final result. Returns the remaining filters, to be
+        applied once the contexts are combined, and the positions of the contexts
+        filtered by their metrics.
+        """
+        remaining: list[exp.Expression] = []
+        filtered: set[int] = set()
+        for predicate in self.get_filter_expressions(filters, FilterTypeEnum.HAVING):
+            resolved_by_context: list[exp.Expression | None] = []
+            for compiled_metrics, query in contexts:
+                names = {compiled.metric.name for compiled in compiled_metrics}
+                columns = {
+                    expression.alias: expression.this
+                    for expression in query.expressions
+                    if isinstance(expression, exp.Alias)
+                    and expression.alias not in names
+                }
+                resolved_by_context.append(self.resolve_columns(predicate, columns))
 
-        return metrics
+            if all(resolved is not None for resolved in resolved_by_context):
+                for (_, query), resolved in zip(contexts, resolved_by_context):
+                    query.having(resolved, copy=False)
+                continue
 
-    def get_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
-        raise NotImplementedError()
+            for i, (_, query) in enumerate(contexts):
+                columns = {
+                    expression.alias: expression.this
+                    for expression in query.expressions
+                    if isinstance(expression, exp.Alias)
+                }
+                if (resolved := self.resolve_columns(predicate, columns)) is not None:
+                    query.having(resolved, copy=False)
+                    filtered.add(i)
+                    break
+            else:
+                remaining.append(predicate)
 
-    def get_valid_metrics(
+        return remaining, filtered
+
+    def combine_context_queries(
         self,
-        semantic_view: SemanticView,
-        metrics: set[Metric],
+        contexts: list[tuple[list[CompiledMetric], exp.Select]],
         dimensions: set[Dimension],
-    ) -> set[Metric]:
-        dimensions_per_table = self.get_dimensions_per_table(semantic_view)
+        having: list[exp.Expression] | None = None,
+        grouping: bool = False,
+        errors: bool = False,
+        filtered: set[int] | None = None,
+    ) -> exp.Select:
+        """
+        Combine the per-context queries into a single query.
 
-        valid = {
-            metric
-            for metric in self.get_metrics(semantic_view)
-            if all(
-                dimension in dimensions_per_table.get(table, set())
-                for table in metric.tables
-                for dimension in dimensions
-            )
-        }
+        Contexts are outer joined on the dimensions, or cross joined when there are
+        none: the groups of all the contexts are collected in a `__keys` relation, and
+        each context is joined to it, so that a group missing from a context has `NULL`
+        metrics instead of being dropped. Since dimensions can be `NULL` they are
+        compared with `IS NOT DISTINCT FROM`. Contexts in `filtered` had `HAVING`
+        filters applied, and are inner joined so that only their groups are kept.
 
-        if invalid := metrics - valid:
-            raise ValueError(
-                "Some given metrics are not valid for the given dimensions: "
-                ", ".join(metric.name for metric in invalid)
+        `HAVING` filters spanning multiple contexts are applied to the combined result.
+        With `grouping` the contexts have a grouping ID column, and are also joined on
+        it. With `errors` the contexts have an error column for each metric, after the
+        dimensions.
+        """
+        if len(contexts) == 1 and not having:
+            return contexts[0][1]
+
+        filtered = filtered or set()
+        dimensions_by_name = sorted(dimensions, key=lambda dim: dim.name)
+        aliases = [f"context_{i}" for i in range(len(contexts))]
+        keys = [dimension.name for dimension in dimensions_by_name]
+        if grouping:
+            keys.append(GROUPING_ID_COLUMN)
+        # the relation with the groups, either the keys or the only context
+        base = KEYS_ALIAS if keys and len(contexts) > 1 else aliases[0]
+
+        expressions = [
+            exp.alias_(
+                exp.column(compiled.metric.name, alias),
+                compiled.metric.name,
+            )
+            for alias, (compiled_metrics, _) in zip(aliases, contexts)
+            for compiled in compiled_metrics
+        ]
+        expressions.extend(
+            exp.alias_(exp.column(dimension.name, base), dimension.name)
+            for dimension in dimensions_by_name
+        )
+        if errors:
+            expressions.extend(
+                exp.alias_(
+                    exp.column(compiled.metric.name + ERROR_SUFFIX, alias),
+                    compiled.metric.name + ERROR_SUFFIX,
+                )
+                for alias, (compiled_metrics, _) in zip(aliases, contexts)
+                for compiled in compiled_metrics
+            )
+        if grouping:
+            expressions.append(
+                exp.alias_(exp.column(GROUPING_ID_COLUMN, base), GROUPING_ID_COLUMN)
             )
 
-        return valid
+        sources: list[exp.Expression]
+        if self.supports_cte:
+            sources = [exp.Table(this=exp.to_identifier(alias)) for alias in aliases]
+        else:
+            sources = [
+                exp.Subquery(this=query, alias=exp.TableAlias(this=alias))
+                for alias, (_, query) in zip(aliases, contexts)
+            ]
 
-    def get_valid_dimensions(
-        self,
-        semantic_view: SemanticView,
-        metrics: set[Metric],
-        dimensions: set[Dimension],
-    ) -> set[Dimension]:
-        dimensions_per_table = self.get_dimensions_per_table(semantic_view)
+        ctes = list(zip(aliases, (query for _, query in contexts)))
+        if base == KEYS_ALIAS:
+            groups = reduce(
+                lambda left, right: exp.union(left, right, distinct=True, copy=False),
+                [
+                    exp.Select(
+                        **{
+                            "expressions": [exp.column(key) for key in keys],
+                            "from": exp.From(
+                                this=(
+                                    source.copy()
+                                    if self.supports_cte
+                                    else exp.Subquery(
+                                        this=query.copy(),
+                                        alias=exp.TableAlias(this=alias),
+                                    )
+                                )
+                            ),
+                        }
+                    )
+                    for alias, source, (_, query) in zip(aliases, sources, contexts)
+                ],
+            )
+            if self.supports_cte:
+                ctes.append((KEYS_ALIAS, groups))
+                from_: exp.Expression = exp.Table(this=exp.to_identifier(KEYS_ALIAS))
+            else:
+                from_ = exp.Subquery(this=groups, alias=exp.TableAlias(this=KEYS_ALIAS))
+            joined = list(zip(aliases, sources))
+        else:
+            from_ = sources[0]
+            joined = list(zip(aliases[1:], sources[1:]))
 
-        valid = {
-            dimension
-            for dimension in self.get_dimensions(semantic_view)
-            if all(
-                dimension in dimensions_per_table.get(table, set())
-                for metric in metrics
-                for table in metric.tables
+        joins = [
+            (
+                exp.Join(
+                    this=source,
+                    on=exp.and_(
+                        *[
+                            exp.NullSafeEQ(
+                                this=exp.column(key, base),
+                                expression=exp.column(key, alias),
+                            )
+                            for key in keys
+                        ]
+                    ),
+                    side="" if aliases.index(alias) in filtered else "LEFT",
+                )
+                if keys
+                else exp.Join(this=source, kind="CROSS")
             )
-        }
+            for alias, source in joined
+        ]
 
-        if invalid := dimensions - valid:
-            raise ValueError(
-                "Some given dimensions are not valid for the given metrics: "
-                ", ".join(dimension.name for dimension in invalid)
+        query = exp.Select(
+            **{
+                "expressions": expressions,
+                "from": exp.From(this=from_),
+                "joins": joins,
+            }
+        )
+        if having:
+            columns: dict[str, exp.Expression] = {
+                dimension.name: exp.column(dimension.name, base)
+                for dimension in dimensions_by_name
+            }
+            for alias, (compiled_metrics, _) in zip(aliases, contexts):
+                for compiled in compiled_metrics:
+                    columns[compiled.metric.name] = exp.column(
+                        compiled.metric.name,
+                        alias,
+                    )
+
+            for predicate in having:
+                if (resolved := self.resolve_columns(predicate, columns)) is None:
+                    raise ValueError(
+                        "HAVING filters can only reference the selected metrics and "
+                        "dimensions: " + predicate.sql(dialect=self.dialect)
+                    )
+                query = query.where(resolved, copy=False)
+
+        if self.supports_cte:
+            query.args["with"] = exp.With(
+                expressions=[
+                    exp.CTE(this=cte, alias=exp.TableAlias(this=alias))
+                    for alias, cte in ctes
+                ]
             )
 
-        return valid
+        return query
 
-    def get_query(
+    def add_rollup(
         self,
-        semantic_view: SemanticView,
+        name: str,
         metrics: set[Metric],
         dimensions: set[Dimension],
-        filters: set[Filter],
-        sort: Sort | None = None,
-        limit: int | None = None,
-        offset: int | None = None,
-    ) -> Query:
-        # TODO: validate metrics and dimensions
+        build: bool = True,
+    ) -> Rollup:
+        """
+        Declare a rollup table pre-aggregating metrics by a set of dimensions.
 
-        contexts: dict[
-            tuple[exp.From, list[exp.Join]],
-            set[exp.Select],
-        ] = defaultdict(set)
+        All the metrics must share the same context, and be re-aggregatable (`SUM`,
+        `COUNT`, `MIN`, `MAX` or `AVG`). The table is created unless `build` is false, in
+        which case it must already exist. Once declared, `get_query` will read from the
+        smallest rollup that can answer a request; rollups are not updated when the data
+        changes, and should be rebuilt with `refresh_rollup`.
+        """
+        catalog = self.get_catalog()
+        contexts = self.get_contexts(catalog, metrics)
+        if len(contexts) != 1:
+            raise ValueError("All the metrics in a rollup must share the same context")
+        ((context, compiled_metrics),) = contexts.items()
 
-        # group metrics by context -- FROM/JOINs
-        for metric in metrics:
-            ast = sqlglot.parse_one(metric.sql)
-            if not self.is_valid_metric(ast):
-                raise ValueError(f"Invalid metric SQL: {metric.sql}")
-
-            context = (ast.args["from"], ast.args.get("joins", []))
-            contexts[context].add(cast(exp.Select, ast))
-
-        # build queries for each context
-        queries: list[exp.Select] = []
-        for context, metrics in contexts.items():
-            predicates = {ast.args["where"] for ast in metrics if "where" in ast.args}
-            if len(predicates) <= 1:
-                expressions = [ast.expressions[0] for ast in metrics if ast.expressions]
-                where = predicates.pop() if predicates else None
-            else:
-                expressions = [
-                    self.get_metric_as_expression(metric) for metric in metrics
-                ]
-                where = None
+        query, rollup_metrics = self.build_partial_query(
+            catalog,
+            context,
+            compiled_metrics,
+            dimensions,
+        )
 
-            query = exp.Select(
-                **{
-                    "expressions": expressions,
-                    "from": context[0],
-                    "joins": context[1],
-                    "where": where,
-                }
+        rollup = Rollup(
+            table=Relation(name, self.default_schema, self.default_catalog),
+            context=context,
+            dimensions=frozenset(dimensions),
+            metrics=MappingProxyType(rollup_metrics),
+            query=query,
+        )
+        self.rollups[name] = rollup
+
+        if build:
+            self.build_rollup(rollup)
+        else:
+            self.rollup_sizes[name] = self.get_rollup_size(rollup)
+            self.query_cache.clear()
+
+        return rollup
+
+    def build_partial_query(
+        self,
+        catalog: Catalog,
+        context: ContextKey,
+        compiled_metrics: list[CompiledMetric],
+        dimensions: set[Dimension],
+        predicates: list[exp.Expression] | None = None,
+    ) -> tuple[exp.Select, dict[Metric, exp.Expression]]:
+        """
+        Build a query computing partial aggregates of metrics sharing a context.
+
+        Returns the query, grouped by the dimensions (aliased by their full name), and
+        the expressions that combine the partial aggregates of each metric. Raises
+        `ValueError` if a metric can't be re-aggregated.
+        """
+        dimensions_by_name = sorted(dimensions, key=lambda dim: dim.name)
+        expressions: list[exp.Expression] = [
+            exp.alias_(
+                exp.column(dimension.column, dimension.table.name),
+                dimension.name,
+            )
+            for dimension in dimensions_by_name
+        ]
+        metrics: dict[Metric, exp.Expression] = {}
+        for compiled in compiled_metrics:
+            components, expression = split_aggregates(
+                self.get_metric_as_expression(compiled),
+                compiled.metric.name,
             )
+            expressions.extend(components)
+            metrics[compiled.metric] = expression
 
-            # select and group by dimensions
-            group = query.args.setdefault("group", exp.Group())
-            for dimension in dimensions:
-                column = exp.Column(
-                    this=exp.Identifier(
-                        this=dimension.column,
-                        table=dimension.table,
-                    )
-                )
-                query.expressions.append(column)
-                group.expressions.append(column)
-
-            # and perform necessary joins
-            fact_tables = {table for metric in metrics for table in metric.tables}
-
-            queries.append(query)
-
-        # combine context queries
-        if len(queries) == 1:
-            query = queries[0]
-        elif self.supports_cte:
-            expressions = [
-                exp.Alias(
-                    this=exp.Column(
-                        this=exp.Identifier(this=metric.name),
-                        table=exp.Identifier(this=f"context_{i}"),
-                    ),
-                    alias=exp.Identifier(this=metric.name),
-                )
-                for i, metric in enumerate(metrics)
-            ]
-            with_ = [
-                exp.CTE(this=query, alias=f"context_{i}")
-                for i, query in enumerate(queries)
-            ]
-            from_ = exp.From(this=exp.Table(this=exp.Identifier(this="context_0")))
-            joins = [
-                exp.Join(
-                    this=exp.Table(
-                        this=exp.Identifier(this=f"context_{i}", kind="CROSS")
-                    )
-                )
-                for i in range(1, len(queries))
-            ]
-            query = exp.Select(
-                **{
-                    "expressions": expressions,
-                    "from": from_,
-                    "joins": joins,
-                    "with": with_,
-                }
+        predicates = predicates or []
+        required = {dimension.table.name for dimension in dimensions}
+        for predicate in predicates:
+            required.update(self.get_filter_tables(catalog, context, predicate))
+
+        from_, joins = context
+        query = exp.Select(
+            **{
+                "expressions": expressions,
+                "from": from_.copy(),
+                "joins": [join.copy() for join in joins]
+                + self.plan_joins(
+                    catalog,
+                    {from_.this.name, *(join.this.name for join in joins)},
+                    required,
+                ),
+            }
+        )
+        if predicates:
+            query = query.where(
+                *[predicate.copy() for predicate in predicates],
+                copy=False,
             )
-        else:
-            # TODO: handle dimensions
-            query = exp.Select(
+        if dimensions:
+            query.args["group"] = exp.Group(
                 expressions=[
-                    exp.Alias(
-                        this=exp.Subquery(
-                            this=query,
-                            alias=exp.Identifier(this=metric.name),
-                        )
-                    )
-                    for metric in metrics
+                    exp.column(dimension.column, dimension.table.name)
+                    for dimension in dimensions_by_name
                 ]
             )
 
-        # filters: set[Filter],
+        return query, metrics
 
-        if sort:
-            order = [
-                exp.Ordered(
-                    this=exp.Column(this=exp.Identifier(this=field.name)),
+    def build_rollup(self, rollup: Rollup) -> None:
+        """
+        (Re)create the table for a rollup.
+        """
+        table = exp.Table(this=exp.to_identifier(rollup.table.name))
+        drop = exp.Drop(this=table, kind="TABLE", exists=True)
+        create = exp.Create(this=table.copy(), kind="TABLE", expression=rollup.query)
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(drop.sql(dialect=self.dialect))
+            connection.exec_driver_sql(create.sql(dialect=self.dialect))
+
+        self.rollup_sizes[rollup.table.name] = self.get_rollup_size(rollup)
+        self.query_cache.clear()
+
+    def refresh_rollup(self, name: str) -> None:
+        """
+        Rebuild a rollup with the current data.
+        """
+        self.build_rollup(self.rollups[name])
+
+    def drop_rollup(self, name: str) -> None:
+        """
+        Drop a rollup table and stop routing queries to it.
+        """
+        rollup = self.rollups.pop(name)
+        self.rollup_sizes.pop(name, None)
+        self.query_cache.clear()
+
+        table = exp.Table(this=exp.to_identifier(rollup.table.name))
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                exp.Drop(this=table, kind="TABLE", exists=True).sql(
+                    dialect=self.dialect,
                 )
-                for field in sort.fields
-            ]
-            order[-1].desc(sort.direction == SortDirectionEnum.DESC)
-            query.args["order"] = exp.Order(expressions=order)
+            )
 
-        if offset:
-            query = query.offset(offset)
-        if limit:
-            query = query.limit(limit)
+    def get_rollup_size(self, rollup: Rollup) -> int:
+        """
+        Return the number of rows in a rollup table.
+        """
+        query = exp.select(exp.alias_(exp.Count(this=exp.Star()), "size")).from_(
+            exp.Table(this=exp.to_identifier(rollup.table.name))
+        )
+        rows = list(self.execute(query.sql(dialect=self.dialect)))
+        return rows[0]["size"]
+
+    def find_rollup(
+        self,
+        context: ContextKey,
+        compiled_metrics: list[CompiledMetric],
+        dimensions: set[Dimension],
+    ) -> Rollup | None:
+        """
+        Return the smallest rollup that can answer a context query, if any.
+        """
+        metrics = {compiled.metric for compiled in compiled_metrics}
+        candidates = [
+            rollup
+            for name, rollup in self.rollups.items()
+            if name in self.rollup_sizes
+            and rollup.context == context
+            and rollup.covers(metrics, dimensions)
+        ]
+        if not candidates:
+            return None
 
-        return Query(sql=query.sql())
+        return min(candidates, key=lambda rollup: self.rollup_sizes[rollup.table.name])
+
+    def build_rollup_query(
+        self,
+        rollup: Rollup,
+        compiled_metrics: list[CompiledMetric],
+        dimensions: set[Dimension],
+    ) -> exp.Select:
+        """
+        Build a context query reading from a rollup instead of the fact table.
+        """
+        dimensions_by_name = sorted(dimensions, key=lambda dim: dim.name)
+        query = exp.Select(
+            **{
+                "expressions": [
+                    exp.alias_(
+                        rollup.metrics[compiled.metric].copy(),
+                        compiled.metric.name,
+                    )
+                    for compiled in compiled_metrics
+                ]
+                + [
+                    exp.alias_(exp.column(dimension.name), dimension.name)
+                    for dimension in dimensions_by_name
+                ],
+                "from": exp.From(
+                    this=exp.Table(this=exp.to_identifier(rollup.table.name))
+                ),
+            }
+        )
+        if dimensions:
+            query.args["group"] = exp.Group(
+                expressions=[
+                    exp.column(dimension.name) for dimension in dimensions_by_name
+                ]
+            )
+
+        return query
 
     def get_query_from_standard_sql(
         self,
@@ -271,40 +2409,40 @@ class BaseSemanticLayer:
     ) -> Query:
         raise NotImplementedError()
 
-    def get_metric_as_expression(self, metric: exp.Select) -> list[exp.Expression]:
+    def get_metric_as_expression(self, metric: CompiledMetric) -> exp.Expression:
         """
         Convert a metric query into an expression for a projection.
         """
-        expression = metric.expressions[0]
+        expression = metric.expression.copy()
 
-        where = metric.args.get("where")
-        if not where:
+        if not metric.where:
             return expression
+        where = metric.where.copy()
 
         if self.supports_filter_clause:
-            return exp.Filter(this=expression, expression=where)
+            return exp.Filter(this=expression, expression=exp.Where(this=where))
 
-        if expression == exp.Count:
+        if isinstance(expression, exp.Count):
             return exp.Sum(
                 this=exp.Case(
-                    expressions=[exp.When(this=where, expression=exp.One())],
-                    else_=exp.Zero(),
+                    ifs=[exp.If(this=where, true=exp.Literal.number(1))],
+                    default=exp.Literal.number(0),
                 )
             )
 
-        if expression == exp.Sum:
+        if isinstance(expression, exp.Sum):
             return exp.Sum(
                 this=exp.Case(
-                    expressions=[exp.When(this=where, expression=expression.this)],
-                    else_=exp.Zero(),
+                    ifs=[exp.If(this=where, true=expression.this)],
+                    default=exp.Literal.number(0),
                 )
             )
 
         if isinstance(expression, (exp.Max, exp.Min, exp.Avg)):
             return expression.__class__(
                 this=exp.Case(
-                    expressions=[exp.When(this=where, expression=expression.this)],
-                    else_=exp.Null(),
+                    ifs=[exp.If(this=where, true=expression.this)],
+                    default=exp.Null(),
                 )
             )
 
@@ -314,7 +2452,7 @@ class BaseSemanticLayer:
         """
         Return a map of view names to their parsed SQL expressions.
         """
-        raise NotImplementedError()
+        return dict(self.get_catalog().views)
 
     def get_dimensions_per_table(
         self,
@@ -323,43 +2461,174 @@ class BaseSemanticLayer:
         """
         Return a map of tables and their joinable dimensions.
         """
+        dimensions_per_table = self.get_catalog().dimensions_per_table
+        return {
+            table: set(dimensions)
+            for table, dimensions in dimensions_per_table.get(semantic_view, {}).items()
+        }
+
+    def get_dimension_joins(self) -> dict[Relation, set[exp.Join]]:
+        """
+        Return a map of tables and the joins to their dimension tables.
+        """
+        return {
+            table: set(joins)
+            for table, joins in self.get_catalog().dimension_joins.items()
+        }
+
+    def load_views(self) -> dict[Relation, exp.Select]:
+        """
+        Read all views from the database and parse their SQL.
+        """
         raise NotImplementedError()
 
-    def get_relations(self, sql: exp.Select) -> set[Relation]:
+    def get_view_dependencies(
+        self,
+        views: dict[Relation, exp.Select],
+        previous: Catalog | None = None,
+    ) -> dict[Relation, frozenset[Relation]]:
+        """
+        Return the relations each view reads from directly.
+
+        The dependencies of a `previous` snapshot are reused for views that are the same
+        AST object (ie, they weren't parsed again).
+        """
         return {
-            Relation(
-                source.name,
-                source.db if source.db != "" else self.default_schema,
-                source.catalog if source.catalog != "" else self.default_catalog,
+            relation: (
+                previous.view_dependencies[relation]
+                if previous is not None and previous.views.get(relation) is ast
+                else frozenset(self.get_relations(ast))
             )
+            for relation, ast in views.items()
+        }
+
+    def load_metrics(
+        self,
+        views: dict[Relation, exp.Select],
+        view_tables: Mapping[Relation, frozenset[Relation]],
+        previous: Catalog | None = None,
+    ) -> dict[Metric, CompiledMetric]:
+        """
+        Build compiled metrics from the parsed views.
+
+        Metrics from a `previous` snapshot are reused when their view is the same AST
+        object (ie, it wasn't parsed again) and it still resolves to the same tables.
+        """
+        reusable: dict[int, CompiledMetric] = {}
+        if previous is not None:
+            reusable = {
+                id(compiled.ast): compiled
+                for compiled in previous.compiled_metrics.values()
+            }
+
+        metrics: dict[Metric, CompiledMetric] = {}
+        for relation, ast in views.items():
+            compiled = reusable.get(id(ast))
+            if compiled is None or (
+                previous is not None
+                and previous.view_tables.get(relation) != view_tables.get(relation)
+            ):
+                if (compiled := self.compile_metric(ast, view_tables)) is None:
+                    continue
+                self.instrumentation.count("metrics_compiled")
+
+            metrics[compiled.metric] = compiled
+
+        return metrics
+
+    def load_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
+        """
+        Read all dimensions from the database.
+        """
+        raise NotImplementedError()
+
+    def load_dimensions_per_table(
+        self,
+        semantic_view: SemanticView,
+    ) -> dict[Relation, set[Dimension]]:
+        """
+        Read the map of tables and their joinable dimensions from the database.
+        """
+        raise NotImplementedError()
+
+    def load_dimension_joins(self) -> dict[Relation, set[exp.Join]]:
+        """
+        Read the joins from each table to its dimension tables from the database.
+        """
+        raise NotImplementedError()
+
+    def load_column_types(self) -> dict[Relation, dict[str, str]]:
+        """
+        Read the declared type of each column of each table from the database.
+        """
+        return {}
+
+    def get_relation(self, table: exp.Table) -> Relation:
+        return Relation(
+            table.name,
+            table.db if table.db != "" else self.default_schema,
+            table.catalog if table.catalog != "" else self.default_catalog,
+        )
+
+    def get_relations(self, sql: exp.Select) -> set[Relation]:
+        # the optimizer is only needed when compiling metrics, so it's imported lazily to
+        # keep cold starts from a saved catalog fast
+        from sqlglot.optimizer.scope import traverse_scope
+
+        return {
+            self.get_relation(source)
             for scope in traverse_scope(sql)
             for source in scope.sources.values()
             if isinstance(source, exp.Table)
         }
 
-    def get_tables(self, sql: exp.Select) -> set[Relation]:
+    def get_view_tables(self) -> Mapping[Relation, frozenset[Relation]]:
+        """
+        Return a map of view names to the base tables they read from.
+        """
+        return self.get_catalog().view_tables
+
+    def get_tables(
+        self,
+        sql: exp.Select,
+        view_tables: Mapping[Relation, frozenset[Relation]] | None = None,
+    ) -> set[Relation]:
         """
-        Get the tables of a SQL expression.
+        Get the base tables of a SQL expression, resolving views transitively.
         """
-        views = self.get_views()
+        if view_tables is None:
+            view_tables = self.get_view_tables()
 
         tables: set[Relation] = set()
         for relation in self.get_relations(sql):
-            if relation in views:
-                tables.update(self.get_relations(views[relation]))
-            else:
-                tables.add(relation)
+            tables.update(view_tables.get(relation, {relation}))
 
         return tables
 
     def is_valid_metric(self, sql: exp.Expression) -> bool:
+        """
+        Check if a query defines a metric.
+
+        A metric is a query with a single aggregated expression, reading directly from
+        tables or views (no subqueries or CTEs) and without any grouping.
+        """
         return (
             isinstance(sql, exp.Select)
             and len(sql.expressions) == 1
-            and sql.expressions[0].find(exp.AggFunc)
+            and sql.expressions[0].find(exp.AggFunc) is not None
+            and "from" in sql.args
+            and isinstance(sql.args["from"].this, exp.Table)
+            and all(
+                isinstance(join.this, exp.Table) for join in sql.args.get("joins", [])
+            )
+            and not any(sql.args.get(key) for key in ("with", "group", "having"))
         )
 
-    def get_metric_from_view(self, ast: exp.Select) -> Metric | None:
+    def get_metric_from_view(
+        self,
+        ast: exp.Select,
+        view_tables: Mapping[Relation, frozenset[Relation]] | None = None,
+    ) -> Metric | None:
         """
         Get a metric from a view, if it exists.
         """
@@ -368,8 +2637,31 @@ class BaseSemanticLayer:
 
         return Metric(
             name=ast.expressions[0].alias_or_name,
-            sql=ast.sql(),
-            tables=self.get_tables(ast),
+            sql=ast.expressions[0].unalias().sql(dialect=self.dialect),
+            table=self.get_relation(ast.args["from"].this),
+            tables=frozenset(self.get_tables(ast, view_tables)),
+        )
+
+    def compile_metric(
+        self,
+        ast: exp.Select,
+        view_tables: Mapping[Relation, frozenset[Relation]] | None = None,
+    ) -> CompiledMetric | None:
+        """
+        Compile a metric from a view, if it exists.
+
+        The parts of the view needed to build queries are extracted once, so that
+        `get_query` never has to parse or validate the metric SQL again.
+        """
+        if not (metric := self.get_metric_from_view(ast, view_tables)):
+            return None
+
+        return CompiledMetric(
+            metric=metric,
+            ast=ast,
+            expression=ast.expressions[0].unalias(),
+            context=(ast.args["from"], tuple(ast.args.get("joins", []))),
+            where=ast.args["where"].this if "where" in ast.args else None,
         )
 
     def quote(self, identifier: str) -> str:
@@ -1,162 +1,654 @@
-from collections import defaultdict
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict, deque
+from collections.abc import Hashable, Iterable
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
 
 import sqlglot
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import ConnectionPoolEntry, QueuePool
 from sqlglot import exp
 from sqlglot.dialects.sqlite import SQLite
 
+from cantrip.catalog import Catalog
 from cantrip.implementations.base import BaseSemanticLayer
+from cantrip.instrumentation import Instrumentation, NoopInstrumentation
 from cantrip.models import (
     Dimension,
+    Query,
     Relation,
     SemanticView,
 )
 
 
+@dataclass(frozen=True)
+class ForeignKey:
+    """
+    A single column of a foreign key.
+    """
+
+    table: str
+    column: str
+    referenced_table: str
+    referenced_column: str | None
+
+
+@dataclass(frozen=True)
+class SQLiteSchema:
+    """
+    The raw metadata of a SQLite database.
+    """
+
+    # view name to its `CREATE VIEW` statement
+    views: dict[str, str]
+    # table name to its columns and their declared types, in order
+    columns: dict[str, dict[str, str]]
+    foreign_keys: list[ForeignKey]
+    # table name to the columns of its primary key, in order
+    primary_keys: dict[str, list[str]]
+    # tables declared `WITHOUT ROWID`
+    without_rowid: set[str]
+
+    def is_rowid(self, table: str, column: str) -> bool:
+        """
+        Check if a column is an alias for the rowid, which is always indexed.
+        """
+        return (
+            self.primary_keys.get(table) == [column]
+            and self.columns[table][column].upper() == "INTEGER"
+        )
+
+
+@dataclass(frozen=True)
+class PlanStep:
+    """
+    A step of the plan returned by `EXPLAIN QUERY PLAN`.
+    """
+
+    id: int
+    parent: int
+    detail: str
+
+    @property
+    def scanned_table(self) -> str | None:
+        """
+        The table (or alias) read in full by the step, unless it uses a covering index.
+        """
+        match = re.match(r"SCAN (?:TABLE )?(\S+)(.*)", self.detail)
+        if match is None or "COVERING INDEX" in match.group(2):
+            return None
+
+        return match.group(1)
+
+
+@dataclass(frozen=True)
+class IndexRecommendation:
+    """
+    An index that would avoid full scans in a workload.
+    """
+
+    table: str
+    columns: tuple[str, ...]
+    reason: str
+    # how many queries in the workload would use the index
+    queries: int = field(default=1, compare=False)
+
+    @property
+    def name(self) -> str:
+        return "_".join(["idx", self.table, *self.columns])
+
+    def get_ddl(self) -> str:
+        table = exp.to_identifier(self.table)
+        return (
+            f"CREATE INDEX IF NOT EXISTS {exp.to_identifier(self.name).sql()} "
+            f"ON {table.sql()} "
+            f"({', '.join(exp.to_identifier(column).sql() for column in self.columns)})"
+        )
+
+
+@dataclass(frozen=True)
+class SQLitePragmas:
+    """
+    Pragmas applied to every new connection, to tune SQLite for analytical reads.
+
+    Pragmas set to `None` are left at the SQLite defaults. The journal mode is stored
+    in the database file, so it's only changed by connections that can write.
+    """
+
+    journal_mode: str | None = "WAL"
+    # bytes of the database file mapped into memory
+    mmap_size: int | None = 256 * 1024**2
+    # pages if positive, KiB if negative
+    cache_size: int | None = -64 * 1024
+    temp_store: str | None = "MEMORY"
+    query_only: bool = False
+
+    def get_statements(self) -> list[str]:
+        statements = [
+            f"PRAGMA {name} = {value}"
+            for name, value in [
+                ("journal_mode", self.journal_mode),
+                ("mmap_size", self.mmap_size),
+                ("cache_size", self.cache_size),
+                ("temp_store", self.temp_store),
+            ]
+            if value is not None
+        ]
+        if self.query_only:
+            statements.append("PRAGMA query_only = ON")
+
+        return statements
+
+
+def create_sqlite_engine(
+    path: str | Path,
+    read_only: bool = False,
+    pool_size: int = 5,
+    pragmas: SQLitePragmas | None = None,
+    instrumentation: Instrumentation | None = None,
+) -> Engine:
+    """
+    Create an engine with a pool of reusable, tuned connections to a SQLite file.
+
+    Connections are kept open in a pool of `pool_size` connections (plus overflow), so
+    that each reader thread reuses a warm connection with its page cache and memory
+    map, instead of opening the file for every query. `pragmas` are applied once, when
+    each connection is created. In read-only mode the file is opened with `mode=ro`
+    and `query_only`, so multiple threads can read without taking write locks.
+
+    New connections are counted as `pool.connections` in `instrumentation`; the time
+    spent waiting for a connection is measured by the `connect` span of the semantic
+    layer.
+    """
+    pragmas = pragmas if pragmas is not None else SQLitePragmas()
+    if read_only:
+        pragmas = replace(pragmas, journal_mode=None, query_only=True)
+    statements = pragmas.get_statements()
+    instrumentation = (
+        instrumentation if instrumentation is not None else NoopInstrumentation()
+    )
+
+    mode = "ro" if read_only else "rwc"
+    engine = create_engine(
+        f"sqlite:///file:{quote(str(Path(path).absolute()))}?mode={mode}&uri=true",
+        poolclass=QueuePool,
+        pool_size=pool_size,
+    )
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection: Any, connection_record: ConnectionPoolEntry) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+        instrumentation.count("pool.connections")
+
+    return engine
+
+
+# Knuth's multiplicative hash, used to sample rows by their rowid
+SAMPLE_MULTIPLIER = 2654435761
+SAMPLE_MODULUS = 2**32
+# the rowid bits that are hashed, so that the product fits in a 64-bit integer
+SAMPLE_MASK = 2**31 - 1
+
+# the table options at the end of a `CREATE TABLE` statement declaring no rowid
+WITHOUT_ROWID = re.compile(r"\)[^)]*\bWITHOUT\s+ROWID\b[^)]*$", re.IGNORECASE)
+
+# the schema loaded for the catalog being built, shared by the `load_*` methods
+loaded_schema: ContextVar[SQLiteSchema | None] = ContextVar(
+    "loaded_schema",
+    default=None,
+)
+
+
 class SQLiteSemanticLayer(BaseSemanticLayer):
 
     dialect = SQLite()
 
     supports_filter_clause = True
+    supports_grouping_sets = False
+    supports_approx_distinct = False
+
+    single_pass_catalog = True
+
+    def __init__(self, *args: Any, workload_size: int = 1000, **kwargs: Any) -> None:
+        """
+        Initialize the semantic layer.
+
+        The SQL of the last `workload_size` queries is recorded in `workload`, to be
+        analyzed by `recommend_indexes`.
+        """
+        super().__init__(*args, **kwargs)
+
+        self.workload: deque[str] = deque(maxlen=workload_size)
+
+        self._data_version_connection: sqlite3.Connection | None = None
+        self._data_version_lock = threading.Lock()
+
+        # the SQL and AST of each view, so that only new or changed views are parsed
+        self._parsed_views: dict[str, tuple[str, exp.Select | None]] = {}
+        # the current catalog snapshot and the schema it was built from
+        self._built_schema: tuple[Catalog, SQLiteSchema] | None = None
 
     def get_semantic_views(self) -> set[SemanticView]:
         return {SemanticView("semantic_view")}
 
-    def get_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
-        sql = """
-WITH fk_relations AS (
-  SELECT
-    fk."table" AS referenced_table,
-    fk."to" AS referenced_column
-  FROM sqlite_master m
-  JOIN pragma_foreign_key_list(m.name) fk
-  WHERE m.type = 'table'
-),
-
-referenced_tables AS (
-  SELECT DISTINCT referenced_table FROM fk_relations
-),
-
-table_columns AS (
-  SELECT
-    m.name AS table_name,
-    p.name AS column_name
-  FROM sqlite_master m
-  JOIN pragma_table_info(m.name) p
-  WHERE m.type = 'table'
-),
-
-dimensions AS (
-  SELECT
-    tc.table_name,
-    tc.column_name
-  FROM table_columns tc
-  JOIN referenced_tables rt ON tc.table_name = rt.referenced_table
-  LEFT JOIN fk_relations fk
-    ON tc.table_name = fk.referenced_table
-    AND tc.column_name = fk.referenced_column
-  WHERE fk.referenced_column IS NULL
-)
+    def get_query_from_catalog(self, *args: Any, **kwargs: Any) -> Query:
+        query = super().get_query_from_catalog(*args, **kwargs)
+        self.workload.append(query.sql)
 
-SELECT table_name, column_name
-FROM dimensions;
+        return query
+
+    def sample_query(self, catalog: Catalog, query: exp.Select, rate: float) -> bool:
         """
+        Restrict a context query to the rows whose hashed rowid falls in the sample.
 
-        dimensions: set[Dimension] = set()
+        SQLite has no `TABLESAMPLE`, so rows are chosen by a multiplicative hash of
+        their rowid. The sample is deterministic, and every row in a sample is also in
+        the larger ones, so refining a query only adds rows. Views and `WITHOUT ROWID`
+        tables have no rowid, and are not sampled.
+        """
+        table = query.args["from"].this
+        if (
+            not isinstance(table, exp.Table)
+            or self.get_relation(table) not in catalog.column_types
+        ):
+            return False
+
+        schema = (
+            self._built_schema[1]
+            if self._built_schema is not None and self._built_schema[0] is catalog
+            else self.get_schema()
+        )
+        if table.name in schema.without_rowid:
+            return False
+
+        # only the low bits of the rowid are hashed, since SQLite switches to floating
+        # point when an integer product overflows
+        condition = sqlglot.parse_one(
+            f"(__rowid & {SAMPLE_MASK}) * {SAMPLE_MULTIPLIER} % {SAMPLE_MODULUS} "
+            f"< {int(rate * SAMPLE_MODULUS)}",
+            self.dialect,
+        )
+        condition.find(exp.Column).replace(exp.column("rowid", table.alias_or_name))
+        query.where(condition, copy=False)
+
+        return True
+
+    def explain_query(self, sql: str) -> list[PlanStep]:
+        """
+        Return the steps of the plan SQLite uses to run a query.
+        """
+        return [
+            PlanStep(row["id"], row["parent"], row["detail"])
+            for row in self.execute(f"EXPLAIN QUERY PLAN {sql}")
+        ]
 
+    def get_full_scans(self, sql: str) -> set[str]:
+        """
+        Return the tables that a query reads in full, without an index.
+
+        Scans of CTEs and subqueries are not reported, only of tables in the database.
+        """
+        ast = sqlglot.parse_one(sql, self.dialect)
+        tables = {table.alias_or_name: table.name for table in ast.find_all(exp.Table)}
+        columns = self.get_schema().columns
+
+        return {
+            tables[step.scanned_table]
+            for step in self.explain_query(sql)
+            if step.scanned_table in tables and tables[step.scanned_table] in columns
+        }
+
+    def load_indexes(self) -> dict[str, list[tuple[str, ...]]]:
+        """
+        Read the columns of the existing indexes of each table.
+        """
+        sql = """
+SELECT
+  m.name AS table_name,
+  il.name AS index_name,
+  ii.name AS column_name
+FROM sqlite_master m
+JOIN pragma_index_list(m.name) il
+JOIN pragma_index_info(il.name) ii
+WHERE m.type = 'table'
+ORDER BY m.name, il.name, ii.seqno;
+        """
+        indexes: dict[tuple[str, str], list[str]] = defaultdict(list)
         for row in self.execute(sql):
-            table = self.quote(row["table_name"])
-            column = self.quote(row["column_name"])
-            name = f"{table}.{column}"
-            dimensions.add(
-                Dimension(
-                    table=Relation(table, self.default_schema, self.default_catalog),
-                    column=row["column_name"],
-                    name=name,
-                )
-            )
+            indexes[(row["table_name"], row["index_name"])].append(row["column_name"])
 
-        return dimensions
+        output: dict[str, list[tuple[str, ...]]] = defaultdict(list)
+        for (table_name, _), index_columns in indexes.items():
+            output[table_name].append(tuple(index_columns))
 
-    def get_dimensions_per_table(
+        return output
+
+    def recommend_indexes(
         self,
-        semantic_view: SemanticView,
-    ) -> dict[Relation, set[Dimension]]:
+        queries: Iterable[str] | None = None,
+    ) -> list[IndexRecommendation]:
+        """
+        Recommend indexes to avoid the full scans in a workload.
+
+        Each query (by default, the recorded `workload`) is explained, and for every
+        table it scans in full an index is recommended based on the foreign key graph:
+
+        - dimension tables joined on a column that is not the rowid get an index on it;
+        - other tables (usually fact tables) get a covering index, with the columns
+          compared in the `WHERE` clause first, then the foreign keys to the joined
+          tables, and then the remaining columns used by the query, so that the scan
+          reads the smaller index instead of the table.
+
+        Indexes that already exist (or are a prefix of one) are not recommended.
+        Recommendations are sorted by the number of queries that would use them.
+        """
+        schema = self.get_schema()
+        existing = self.load_indexes()
+        workload = Counter(self.workload if queries is None else queries)
+
+        recommendations: dict[IndexRecommendation, int] = {}
+        for sql, count in workload.items():
+            for recommendation in self.get_index_recommendations(schema, sql):
+                if any(
+                    index[: len(recommendation.columns)] == recommendation.columns
+                    for index in existing.get(recommendation.table, [])
+                ):
+                    continue
+                recommendations[recommendation] = (
+                    recommendations.get(recommendation, 0) + count
+                )
+
+        return sorted(
+            (
+                replace(recommendation, queries=count)
+                for recommendation, count in recommendations.items()
+            ),
+            key=lambda recommendation: (
+                -recommendation.queries,
+                recommendation.table,
+                recommendation.columns,
+            ),
+        )
+
+    def get_index_recommendations(
+        self,
+        schema: SQLiteSchema,
+        sql: str,
+    ) -> list[IndexRecommendation]:
+        """
+        Recommend indexes for the tables a single query scans in full.
+        """
+        ast = sqlglot.parse_one(sql, self.dialect)
+        aliases = {
+            table.alias_or_name: table.name
+            for table in ast.find_all(exp.Table)
+            if table.name in schema.columns
+        }
+        tables = set(aliases.values())
+
+        # the columns used from each table, and the ones compared in `WHERE`
+        used: dict[str, dict[str, None]] = defaultdict(dict)
+        filtered: dict[str, dict[str, None]] = defaultdict(dict)
+        for column in ast.find_all(exp.Column):
+            if column.table:
+                owners = [aliases[column.table]] if column.table in aliases else []
+            else:
+                owners = [
+                    table for table in tables if column.name in schema.columns[table]
+                ]
+            if len(owners) != 1 or column.name not in schema.columns[owners[0]]:
+                continue
+
+            used[owners[0]][column.name] = None
+            where = column.find_ancestor(exp.Where)
+            if (
+                where is not None
+                and not isinstance(where.parent, exp.Filter)
+                and isinstance(column.parent, (exp.EQ, exp.In))
+            ):
+                filtered[owners[0]][column.name] = None
+
+        joins = [
+            foreign_key
+            for foreign_key in schema.foreign_keys
+            if foreign_key.table in tables and foreign_key.referenced_table in tables
+        ]
+
+        recommendations: list[IndexRecommendation] = []
+        for table in sorted(self.get_full_scans(sql)):
+            if referencing := [
+                foreign_key
+                for foreign_key in joins
+                if foreign_key.referenced_table == table
+                and foreign_key.referenced_column is not None
+                and not schema.is_rowid(table, foreign_key.referenced_column)
+            ]:
+                recommendations.extend(
+                    IndexRecommendation(
+                        table,
+                        (foreign_key.referenced_column,),
+                        f"{foreign_key.table} is joined on "
+                        f"{table}.{foreign_key.referenced_column}",
+                    )
+                    for foreign_key in referencing
+                    if foreign_key.referenced_column is not None
+                )
+                continue
+
+            columns = [
+                *filtered[table],
+                *(
+                    foreign_key.column
+                    for foreign_key in joins
+                    if foreign_key.table == table
+                ),
+                *used[table],
+            ]
+            if columns:
+                recommendations.append(
+                    IndexRecommendation(
+                        table,
+                        tuple(dict.fromkeys(columns)),
+                        f"covering index for the scan of {table}",
+                    )
+                )
+
+        return recommendations
+
+    def create_indexes(self, recommendations: Iterable[IndexRecommendation]) -> None:
+        """
+        Create recommended indexes.
+
+        This requires a writable engine. Creating an index changes the schema version,
+        so the catalog is refreshed on the next lookup.
+        """
+        with self.engine.begin() as connection:
+            for recommendation in recommendations:
+                connection.exec_driver_sql(recommendation.get_ddl())
+
+    def build_catalog(self, version: Hashable | None) -> Catalog:
+        """
+        Introspect the database in a single pass and build a new catalog snapshot.
+
+        The catalog is refreshed incrementally: only new or changed views are parsed and
+        compiled, and when the tables and foreign keys are the same as in the current
+        snapshot its dimensions and joins are reused.
+        """
+        schema = self.load_schema()
+        token = loaded_schema.set(schema)
+        try:
+            previous = self._catalog
+            if (
+                previous is not None
+                and self._built_schema is not None
+                and self._built_schema[0] is previous
+                and self._built_schema[1].columns == schema.columns
+                and self._built_schema[1].foreign_keys == schema.foreign_keys
+            ):
+                with self.instrumentation.span("introspect.views"):
+                    views = self.load_views()
+                with self.instrumentation.span("compile"):
+                    catalog = self.update_catalog(previous, version, views)
+            else:
+                catalog = super().build_catalog(version)
+        finally:
+            loaded_schema.reset(token)
+
+        self._built_schema = (catalog, schema)
+        return catalog
+
+    def get_schema(self) -> SQLiteSchema:
+        """
+        Return the schema loaded for the current catalog build, or load it.
+        """
+        return loaded_schema.get() or self.load_schema()
+
+    def load_schema(self) -> SQLiteSchema:
+        """
+        Read views, columns, foreign keys and table options from the database.
+
+        Everything is read with a single statement, so that the pragmas are evaluated
+        once per table, and the result is a consistent snapshot of the schema.
+        """
         sql = """
-WITH fk_relations AS (
-  SELECT
-    m.name AS fact_table,
-    fk."table" AS dimension_table,
-    fk."from" AS fk_column,
-    fk."to" AS dimension_column
-  FROM sqlite_master m
-  JOIN pragma_foreign_key_list(m.name) fk
-  WHERE m.type = 'table'
-),
-
-dimension_columns AS (
-  SELECT
-    m.name AS dimension_table,
-    p.name AS column_name
-  FROM sqlite_master m
-  JOIN pragma_table_info(m.name) p
-  WHERE m.type = 'table'
-),
-
-fk_and_columns AS (
-  SELECT
-    fk.fact_table,
-    fk.dimension_table,
-    dc.column_name
-  FROM fk_relations fk
-  JOIN dimension_columns dc
-    ON fk.dimension_table = dc.dimension_table
-),
-
-referenced_columns AS (
-  SELECT DISTINCT
-    fact_table,
-    dimension_table,
-    dimension_column AS column_name
-  FROM fk_relations
-),
-
-filtered_columns AS (
-  SELECT
-    fkc.fact_table,
-    fkc.dimension_table,
-    fkc.column_name
-  FROM fk_and_columns fkc
-  LEFT JOIN referenced_columns rc
-    ON fkc.fact_table = rc.fact_table
-    AND fkc.dimension_table = rc.dimension_table
-    AND fkc.column_name = rc.column_name
-  WHERE rc.column_name IS NULL
-)
+SELECT
+  'view' AS kind,
+  m.name AS table_name,
+  m.sql AS a,
+  NULL AS b,
+  NULL AS c
+FROM sqlite_master m
+WHERE m.type = 'view'
+
+UNION ALL
 
 SELECT
-  fact_table,
-  dimension_table,
-  column_name
-FROM filtered_columns;
+  'column' AS kind,
+  m.name AS table_name,
+  p.name AS a,
+  p.type AS b,
+  p.pk AS c
+FROM sqlite_master m
+JOIN pragma_table_info(m.name) p
+WHERE m.type = 'table'
+
+UNION ALL
+
+SELECT
+  'foreign_key' AS kind,
+  m.name AS table_name,
+  fk."from" AS a,
+  fk."table" AS b,
+  fk."to" AS c
+FROM sqlite_master m
+JOIN pragma_foreign_key_list(m.name) fk
+WHERE m.type = 'table'
+
+UNION ALL
+
+SELECT
+  'table' AS kind,
+  m.name AS table_name,
+  m.sql AS a,
+  NULL AS b,
+  NULL AS c
+FROM sqlite_master m
+WHERE m.type = 'table';
         """
 
-        dimensions: dict[Relation, set[Dimension]] = defaultdict(set)
+        views: dict[str, str] = {}
+        columns: dict[str, dict[str, str]] = defaultdict(dict)
+        foreign_keys: list[ForeignKey] = []
+        primary_keys: dict[str, dict[int, str]] = defaultdict(dict)
+        without_rowid: set[str] = set()
 
         for row in self.execute(sql):
-            relation = Relation(
-                row["fact_table"],
-                self.default_schema,
-                self.default_catalog,
-            )
-            table = self.quote(row["dimension_table"])
-            column = self.quote(row["column_name"])
-            name = f"{table}.{column}"
-            dimensions[relation].add(
-                Dimension(
-                    table=Relation(table, self.default_schema, self.default_catalog),
-                    column=row["column_name"],
-                    name=name,
+            if row["kind"] == "view":
+                views[row["table_name"]] = row["a"]
+            elif row["kind"] == "column":
+                columns[row["table_name"]][row["a"]] = row["b"]
+                if row["c"]:
+                    primary_keys[row["table_name"]][row["c"]] = row["a"]
+            elif row["kind"] == "table":
+                if row["a"] and WITHOUT_ROWID.search(row["a"]):
+                    without_rowid.add(row["table_name"])
+            else:
+                foreign_keys.append(
+                    ForeignKey(row["table_name"], row["a"], row["b"], row["c"])
                 )
+
+        return SQLiteSchema(
+            views,
+            dict(columns),
+            foreign_keys,
+            {
+                table: [key[position] for position in sorted(key)]
+                for table, key in primary_keys.items()
+            },
+            without_rowid,
+        )
+
+    def get_dimension(self, table_name: str, column_name: str) -> Dimension:
+        table = self.quote(table_name)
+        column = self.quote(column_name)
+        return Dimension(
+            table=Relation(table, self.default_schema, self.default_catalog),
+            column=column_name,
+            name=f"{table}.{column}",
+        )
+
+    def load_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
+        """
+        Return the columns of referenced tables, except for the referenced columns.
+        """
+        schema = self.get_schema()
+        referenced = {
+            (foreign_key.referenced_table, foreign_key.referenced_column)
+            for foreign_key in schema.foreign_keys
+        }
+
+        return {
+            self.get_dimension(table_name, column_name)
+            for table_name in {table_name for table_name, _ in referenced}
+            for column_name in schema.columns.get(table_name, {})
+            if (table_name, column_name) not in referenced
+        }
+
+    def load_dimensions_per_table(
+        self,
+        semantic_view: SemanticView,
+    ) -> dict[Relation, set[Dimension]]:
+        """
+        Return the dimensions of the tables referenced by each table.
+
+        The columns used in the foreign keys of a table are not dimensions of it.
+        """
+        schema = self.get_schema()
+        referenced: dict[tuple[str, str], set[str | None]] = defaultdict(set)
+        for foreign_key in schema.foreign_keys:
+            referenced[(foreign_key.table, foreign_key.referenced_table)].add(
+                foreign_key.referenced_column
+            )
+
+        dimensions: dict[Relation, set[Dimension]] = defaultdict(set)
+        for (table_name, dimension_table), columns in referenced.items():
+            relation = Relation(table_name, self.default_schema, self.default_catalog)
+            dimensions[relation].update(
+                self.get_dimension(dimension_table, column_name)
+                for column_name in schema.columns.get(dimension_table, {})
+                if column_name not in columns
             )
 
         return dimensions
@@ -167,36 +659,107 @@ FROM filtered_columns;
     def get_default_catalog(self) -> None:
         return None
 
-    def get_views(self) -> dict[Relation, exp.Select]:
-        views: dict[str, exp.Select] = {}
+    def get_version(self) -> int:
+        rows = list(self.execute("PRAGMA schema_version"))
+        return rows[0]["schema_version"]
 
-        for name, sql in self.execute(
-            "SELECT name, sql FROM sqlite_master WHERE type='view'"
-        ):
-            relation = Relation(name, self.default_schema, self.default_catalog)
-            ast = sqlglot.parse_one(sql, self.dialect)
-            if isinstance(ast, exp.Create) and isinstance(ast.expression, exp.Select):
-                views[relation] = ast.expression
+    def get_data_version(self) -> int | None:
+        """
+        Return the value of `PRAGMA data_version`.
 
-        return views
+        The pragma only changes when a different connection commits, so it's always read
+        from a dedicated connection owned by the layer, outside of the engine pool, and
+        closed by `close`. In-memory databases are private to a connection, and have no
+        data version.
+        """
+        if self.engine.url.database in {None, "", ":memory:"}:
+            return None
+
+        with self._data_version_lock:
+            if self._data_version_connection is None:
+                args, kwargs = self.engine.dialect.create_connect_args(self.engine.url)
+                self._data_version_connection = sqlite3.connect(
+                    *args,
+                    **{**kwargs, "check_same_thread": False},
+                )
 
-    def get_dimension_joins(self) -> dict[Relation, set[exp.Join]]:
-        sql = """
-WITH tables AS (
-  SELECT name FROM sqlite_master WHERE type='table'
-)
-SELECT
-  t.name AS table_name,
-  fk."from" AS fk_column,
-  fk."table" AS referenced_table,
-  fk."to" AS referenced_column
-FROM tables t
-JOIN pragma_foreign_key_list(t.name) fk;
+            cursor = self._data_version_connection.cursor()
+            try:
+                cursor.execute("PRAGMA data_version")
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+    def close(self) -> None:
         """
+        Close the connection used to read the data version.
 
-        output = defaultdict(set)
+        The layer can still be used afterwards, and the connection is opened again when
+        needed; since the data version is per connection, cached results are then
+        computed again.
+        """
+        with self._data_version_lock:
+            if self._data_version_connection is not None:
+                self._data_version_connection.close()
+                self._data_version_connection = None
 
-        for row in self.execute(sql):
-            table = Relation(row["table_name"], self.default_schema, self.default_catalog)
+    def load_views(self) -> dict[Relation, exp.Select]:
+        """
+        Parse the views, reusing the ASTs of views whose SQL hasn't changed.
+        """
+        views: dict[Relation, exp.Select] = {}
+        parsed: dict[str, tuple[str, exp.Select | None]] = {}
+
+        for name, sql in self.get_schema().views.items():
+            if name in self._parsed_views and self._parsed_views[name][0] == sql:
+                select = self._parsed_views[name][1]
+            else:
+                ast = sqlglot.parse_one(sql, self.dialect)
+                self.instrumentation.count("asts_parsed")
+                select = (
+                    ast.expression
+                    if isinstance(ast, exp.Create)
+                    and isinstance(ast.expression, exp.Select)
+                    else None
+                )
+
+            parsed[name] = (sql, select)
+            if select is not None:
+                views[Relation(name, self.default_schema, self.default_catalog)] = (
+                    select
+                )
+
+        self._parsed_views = parsed
+        return views
+
+    def load_dimension_joins(self) -> dict[Relation, set[exp.Join]]:
+        output: dict[Relation, set[exp.Join]] = defaultdict(set)
+
+        for foreign_key in self.get_schema().foreign_keys:
+            table = Relation(
+                foreign_key.table, self.default_schema, self.default_catalog
+            )
             output[table].add(
+                exp.Join(
+                    this=exp.to_table(foreign_key.referenced_table),
+                    on=exp.EQ(
+                        this=exp.column(foreign_key.column, foreign_key.table),
+                        expression=exp.column(
+                            foreign_key.referenced_column,
+                            foreign_key.referenced_table,
+                        ),
+                    ),
+                )
+            )
 
+        return output
+
+    def load_column_types(self) -> dict[Relation, dict[str, str]]:
+        return {
+            Relation(
+                self.quote(table_name),
+                self.default_schema,
+                self.default_catalog,
+            ): dict(columns)
+            for table_name, columns in self.get_schema().columns.items()
+        }
@@ -0,0 +1,138 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Iterator, Protocol
+
+
+class Instrumentation(Protocol):
+    """
+    Receiver for timed spans and counters emitted by a semantic layer.
+
+    Spans cover the phases of a request: `connect` (acquiring a connection),
+    `introspect.<metadata>` (reading metadata from the database), `compile` (building
+    metrics from the views), `generate` and `render` (building the SQL of a query), and
+    `execute` (running a statement). Counters include `rows_fetched`, `asts_parsed`,
+    `metrics_compiled`, `pool.connections` (connections opened by the pool), and the
+    hits and misses of each cache.
+    """
+
+    def span(self, name: str) -> AbstractContextManager[None]:
+        """
+        Return a context manager that times a phase.
+        """
+        ...
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increment a counter.
+        """
+        ...
+
+
+class NoopInstrumentation:
+    """
+    Instrumentation that discards everything; the default.
+    """
+
+    _span = nullcontext()
+
+    def span(self, name: str) -> AbstractContextManager[None]:
+        return self._span
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+
+@dataclass(frozen=True)
+class SpanStats:
+    """
+    Summary of the durations of a span, in milliseconds.
+
+    Percentiles are computed over the most recent samples only.
+    """
+
+    count: int
+    total: float
+    p50: float
+    p99: float
+
+
+def get_percentile(samples: list[float], percentile: float) -> float:
+    """
+    Return a percentile of sorted samples, using the nearest-rank method.
+    """
+    rank = math.ceil(percentile / 100 * len(samples))
+    return samples[max(rank, 1) - 1]
+
+
+class Aggregator:
+    """
+    In-process instrumentation that aggregates spans and counters.
+
+    Up to `max_samples` recent durations are kept per span to compute percentiles, while
+    counts and totals cover every span since the last reset.
+    """
+
+    def __init__(self, max_samples: int = 10_000) -> None:
+        self.max_samples = max_samples
+
+        self._samples: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=max_samples)
+        )
+        self._counts: dict[str, int] = defaultdict(int)
+        self._totals: dict[str, float] = defaultdict(float)
+        self._counters: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._samples[name].append(duration)
+                self._counts[name] += 1
+                self._totals[name] += duration
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    @property
+    def counters(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def report(self) -> dict[str, SpanStats]:
+        """
+        Return the statistics of each span.
+        """
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+            totals = dict(self._totals)
+
+        return {
+            name: SpanStats(
+                count=counts[name],
+                total=totals[name],
+                p50=get_percentile(values, 50),
+                p99=get_percentile(values, 99),
+            )
+            for name, values in samples.items()
+        }
+
+    def reset(self) -> None:
+        """
+        Discard all spans and counters.
+        """
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._counters.clear()
@@ -1,41 +1,90 @@
 import enum
-from dataclasses import dataclass
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+from weakref import WeakValueDictionary
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SemanticView:
 
     name: str
     description: str | None = None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True, weakref_slot=True, init=False)
 class Relation:
+    """
+    A table or view.
+
+    Relations are interned: creating a relation equal to an existing one returns the
+    existing object, so that large catalogs don't hold duplicates and lookups can
+    short-circuit on identity.
+    """
 
     name: str
     schema: str | None = None
     catalog: str | None = None
 
-
-@dataclass(frozen=True)
+    def __new__(
+        cls,
+        name: str,
+        schema: str | None = None,
+        catalog: str | None = None,
+    ) -> "Relation":
+        key = (cls, name, schema, catalog)
+        if (relation := _relations.get(key)) is not None:
+            return relation
+
+        relation = object.__new__(cls)
+        object.__setattr__(relation, "name", sys.intern(name))
+        object.__setattr__(relation, "schema", schema and sys.intern(schema))
+        object.__setattr__(relation, "catalog", catalog and sys.intern(catalog))
+
+        with _relations_lock:
+            return _relations.setdefault(key, relation)
+
+    def __init__(
+        self,
+        name: str,
+        schema: str | None = None,
+        catalog: str | None = None,
+    ) -> None:
+        # the attributes are set when the relation is interned, in `__new__`
+        pass
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (type(self), (self.name, self.schema, self.catalog))
+
+
+_relations: WeakValueDictionary[
+    tuple[type[Relation], str, str | None, str | None],
+    Relation,
+] = WeakValueDictionary()
+_relations_lock = threading.Lock()
+
+
+@dataclass(frozen=True, slots=True)
 class Metric:
 
     name: str
     sql: str
-    tables: set[Relation]
+    table: Relation
+    tables: frozenset[Relation]
 
 
 class Grain:
     pass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Dimension:
 
     table: Relation
     column: str
     name: str
-    grains: set[Grain]
+    grains: frozenset[Grain] = field(default_factory=frozenset)
     grain: Grain | None = None
 
 
@@ -45,7 +94,7 @@ class FilterTypeEnum(enum.Enum):
     HAVING = enum.auto()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Filter:
 
     type: FilterTypeEnum
@@ -58,14 +107,46 @@ class SortDirectionEnum(enum.Enum):
     DESC = enum.auto()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Sort:
 
-    fields: list[Metric | Dimension]
+    fields: tuple[Metric | Dimension, ...]
     direction: SortDirectionEnum
 
 
-@dataclass(frozen=True)
+def get_rollup_sets(dimensions: list[Dimension]) -> list[set[Dimension]]:
+    """
+    Return the grouping sets of `ROLLUP`: every prefix of a dimension hierarchy.
+    """
+    return [set(dimensions[:i]) for i in range(len(dimensions), -1, -1)]
+
+
+def get_cube_sets(dimensions: list[Dimension]) -> list[set[Dimension]]:
+    """
+    Return the grouping sets of `CUBE`: every subset of the dimensions.
+    """
+    return [
+        {dimension for i, dimension in enumerate(dimensions) if bits & (1 << i)}
+        for bits in range(2 ** len(dimensions) - 1, -1, -1)
+    ]
+
+
+@dataclass(frozen=True, slots=True)
 class Query:
 
     sql: str
+
+
+@dataclass(frozen=True, slots=True)
+class QueryRequest:
+    """
+    A semantic query, as one of the requests of a batch.
+    """
+
+    semantic_view: SemanticView
+    metrics: frozenset[Metric]
+    dimensions: frozenset[Dimension] = frozenset()
+    filters: frozenset[Filter] = frozenset()
+    sort: Sort | None = None
+    limit: int | None = None
+    offset: int | None = None
@@ -62,9 +62,16 @@ class SemanticLayer(Protocol):
         sort: Sort,
         limit: int | None = None,
         offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
     ) -> Query:
         """
         Build a SQL query from the given metrics, dimensions, filters, and sort order.
+
+        With `grouping_sets` the metrics are computed for each subset of the dimensions
+        (eg, for drill-downs), in a single query with a `__grouping_id` column telling
+        the levels apart. With `sample` the metrics are estimated from a fraction of
+        the rows, with a `<metric>__error` column for each one.
         """
         ...
 
@@ -92,3 +99,81 @@ class SemanticLayer(Protocol):
 
         """
         ...
+
+
+class AsyncSemanticLayer(Protocol):
+    """
+    An asynchronous version of the `SemanticLayer` protocol.
+    """
+
+    async def get_semantic_views(self) -> set[SemanticView]:
+        """
+        Returns a set of all semantic views available in the semantic layer.
+        """
+        ...
+
+    async def get_metrics(self, semantic_view: SemanticView) -> set[Metric]:
+        """
+        Returns a set of all available metrics.
+        """
+        ...
+
+    async def get_dimensions(self, semantic_view: SemanticView) -> set[Dimension]:
+        """
+        Returns a set of all available dimensions.
+        """
+        ...
+
+    async def get_valid_metrics(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Metric]:
+        """
+        Return compatible metrics for the given metrics and dimensions.
+        """
+        ...
+
+    async def get_valid_dimensions(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+    ) -> set[Dimension]:
+        """
+        Return compatible dimensions for the given metrics.
+        """
+        ...
+
+    async def get_query(
+        self,
+        semantic_view: SemanticView,
+        metrics: set[Metric],
+        dimensions: set[Dimension],
+        filters: set[Filter],
+        sort: Sort,
+        limit: int | None = None,
+        offset: int | None = None,
+        grouping_sets: list[set[Dimension]] | None = None,
+        sample: float | None = None,
+    ) -> Query:
+        """
+        Build a SQL query from the given metrics, dimensions, filters, and sort order.
+
+        With `grouping_sets` the metrics are computed for each subset of the dimensions
+        (eg, for drill-downs), in a single query with a `__grouping_id` column telling
+        the levels apart. With `sample` the metrics are estimated from a fraction of
+        the rows, with a `<metric>__error` column for each one.
+        """
+        ...
+
+    async def get_query_from_standard_sql(
+        self,
+        semantic_view: SemanticView,
+        sql: str,
+    ) -> Query:
+        """
+        Build a SQL query from a pseudo-query referencing metrics and dimensions.
+        """
+        ...
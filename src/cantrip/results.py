@@ -0,0 +1,353 @@
+import enum
+from array import array
+from collections.abc import Iterable
+from dataclasses import dataclass
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterator
+
+from sqlalchemy.engine import Connection, CursorResult
+
+if TYPE_CHECKING:
+    # the asyncio extension pulls in the ORM, which is slow to import
+    from sqlalchemy.ext.asyncio import AsyncConnection, AsyncResult
+
+from cantrip.instrumentation import Instrumentation, NoopInstrumentation
+
+
+class ColumnType(enum.Enum):
+
+    INTEGER = enum.auto()
+    REAL = enum.auto()
+    TEXT = enum.auto()
+
+
+@dataclass(frozen=True)
+class Column:
+    """
+    A single result column, stored in a typed buffer.
+
+    `values` is an `array.array` (so it supports the buffer protocol and can be wrapped
+    with `numpy.frombuffer` without copying): 64-bit integers for `INTEGER`, doubles for
+    `REAL`, and 32-bit codes into `dictionary` for `TEXT`. When the column has nulls,
+    `validity` has one byte per row, set to 0 for nulls.
+    """
+
+    name: str
+    type: ColumnType
+    values: array
+    validity: bytearray | None = None
+    dictionary: tuple[Any, ...] | None = None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def to_pylist(self) -> list[Any]:
+        """
+        Decode the column into a list of Python objects.
+        """
+        values: Iterable[Any] = self.values
+        if self.dictionary is not None:
+            values = (self.dictionary[code] for code in self.values)
+
+        if self.validity is None:
+            return list(values)
+
+        return [value if valid else None for value, valid in zip(values, self.validity)]
+
+
+@dataclass(frozen=True)
+class ColumnarResult:
+    """
+    A query result stored column by column.
+    """
+
+    columns: tuple[Column, ...]
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name: str) -> Column:
+        for column in self.columns:
+            if column.name == name:
+                return column
+
+        raise KeyError(name)
+
+
+class ColumnBuilder:
+    """
+    Accumulate batches of values into a typed column.
+
+    If the type is unknown it's inferred from the first non-null value. Values that
+    don't fit the type (possible in databases with dynamic typing, like SQLite) widen
+    the column from `INTEGER` to `REAL`, and from there to `TEXT`.
+    """
+
+    def __init__(self, name: str, type_: ColumnType | None = None) -> None:
+        self.name = name
+        self.type = type_
+
+        self._values: list[Any] = []
+
+    def extend(self, values: Iterable[Any]) -> None:
+        self._values.extend(values)
+
+    def infer_type(self) -> ColumnType:
+        for value in self._values:
+            if value is None or isinstance(value, bool):
+                continue
+            if isinstance(value, int):
+                return ColumnType.INTEGER
+            if isinstance(value, float):
+                return ColumnType.REAL
+            return ColumnType.TEXT
+
+        return ColumnType.TEXT
+
+    def build(self) -> Column:
+        validity: bytearray | None = None
+        values = self._values
+        if None in values:
+            validity = bytearray(value is not None for value in values)
+
+        type_ = self.type or self.infer_type()
+        if type_ == ColumnType.INTEGER:
+            try:
+                return Column(
+                    self.name,
+                    type_,
+                    array("q", values if validity is None else self._fill(0)),
+                    validity,
+                )
+            except (TypeError, OverflowError):
+                type_ = ColumnType.REAL
+
+        if type_ == ColumnType.REAL:
+            try:
+                return Column(
+                    self.name,
+                    type_,
+                    array("d", values if validity is None else self._fill(0.0)),
+                    validity,
+                )
+            except TypeError:
+                type_ = ColumnType.TEXT
+
+        # dictionary-encode everything else; nulls get their own code
+        codes: dict[Any, int] = {}
+        encoded = array(
+            "i",
+            [codes.setdefault(value, len(codes)) for value in values],
+        )
+        return Column(self.name, ColumnType.TEXT, encoded, validity, tuple(codes))
+
+    def _fill(self, default: Any) -> list[Any]:
+        return [default if value is None else value for value in self._values]
+
+
+def hash_join(
+    results: list[tuple[tuple[str, ...], list[tuple[Any, ...]]]],
+    keys: list[str],
+    inner: set[int] | None = None,
+) -> tuple[tuple[str, ...], list[tuple[Any, ...]]]:
+    """
+    Outer join partial results on the key columns.
+
+    Each partial result is given as its column names and rows. The output has the
+    non-key columns of every partial result, in order, followed by the keys. Every key
+    found in any partial result is kept, with nulls for the partial results that don't
+    have it, except for the partial results in `inner` (by position), which must have
+    it. Null keys match each other, like `IS NOT DISTINCT FROM`. With no keys the
+    partial results have at most a single row each, and they're concatenated.
+    """
+    inner = inner or set()
+    columns: list[str] = []
+    partials: list[tuple[int, dict[tuple[Any, ...], list[Any]]]] = []
+
+    for names, rows in results:
+        key_indexes = [names.index(key) for key in keys]
+        value_indexes = [i for i, name in enumerate(names) if name not in keys]
+        columns.extend(names[i] for i in value_indexes)
+        partials.append(
+            (
+                len(value_indexes),
+                {
+                    tuple(row[i] for i in key_indexes): [row[i] for i in value_indexes]
+                    for row in rows
+                },
+            )
+        )
+
+    joined = dict.fromkeys(key for _, partial in partials for key in partial)
+    for i in inner:
+        joined = dict.fromkeys(key for key in joined if key in partials[i][1])
+
+    return (
+        (*columns, *keys),
+        [
+            (
+                *(
+                    value
+                    for size, partial in partials
+                    for value in partial.get(key, [None] * size)
+                ),
+                *key,
+            )
+            for key in joined
+        ],
+    )
+
+
+def get_column_builders(
+    columns: tuple[str, ...],
+    types: dict[str, ColumnType] | None = None,
+) -> list[ColumnBuilder]:
+    types = types or {}
+    return [ColumnBuilder(name, types.get(name)) for name in columns]
+
+
+class BatchedResult:
+    """
+    A streaming query result, fetched in batches of tuples.
+
+    The column names are available upfront in `columns`, and each batch is a list of
+    tuples in the same order. The connection is released as soon as all the batches
+    have been consumed, or when the result is closed (explicitly or by using it as a
+    context manager).
+    """
+
+    def __init__(
+        self,
+        connection: Connection,
+        result: CursorResult[Any],
+        batch_size: int,
+        instrumentation: Instrumentation | None = None,
+    ) -> None:
+        self.columns = tuple(result.keys())
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation or NoopInstrumentation()
+
+        self._connection: Connection | None = connection
+        self._result = result
+
+    def __iter__(self) -> Iterator[list[tuple[Any, ...]]]:
+        try:
+            while self._connection is not None and (
+                rows := self._result.fetchmany(self.batch_size)
+            ):
+                self.instrumentation.count("rows_fetched", len(rows))
+                yield [row._tuple() for row in rows]
+        finally:
+            self.close()
+
+    def __enter__(self) -> "BatchedResult":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def to_columnar(
+        self,
+        types: dict[str, ColumnType] | None = None,
+    ) -> ColumnarResult:
+        """
+        Consume the result and return it column by column.
+        """
+        builders = get_column_builders(self.columns, types)
+
+        for batch in self:
+            for builder, values in zip(builders, zip(*batch)):
+                builder.extend(values)
+
+        return ColumnarResult(tuple(builder.build() for builder in builders))
+
+    @property
+    def closed(self) -> bool:
+        return self._connection is None
+
+    def close(self) -> None:
+        """
+        Discard any pending rows and release the connection.
+        """
+        if self._connection is None:
+            return
+
+        self._result.close()
+        self._connection.close()
+        self._connection = None
+
+
+class AsyncBatchedResult:
+    """
+    An asynchronous version of `BatchedResult`.
+    """
+
+    def __init__(
+        self,
+        connection: "AsyncConnection",
+        result: "AsyncResult",
+        batch_size: int,
+        instrumentation: Instrumentation | None = None,
+    ) -> None:
+        self.columns = tuple(result.keys())
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation or NoopInstrumentation()
+
+        self._connection: "AsyncConnection | None" = connection
+        self._result = result
+
+    async def __aiter__(self) -> AsyncIterator[list[tuple[Any, ...]]]:
+        try:
+            while self._connection is not None and (
+                rows := await self._result.fetchmany(self.batch_size)
+            ):
+                self.instrumentation.count("rows_fetched", len(rows))
+                yield [row._tuple() for row in rows]
+        finally:
+            await self.aclose()
+
+    async def __aenter__(self) -> "AsyncBatchedResult":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.aclose()
+
+    async def to_columnar(
+        self,
+        types: dict[str, ColumnType] | None = None,
+    ) -> ColumnarResult:
+        """
+        Consume the result and return it column by column.
+        """
+        builders = get_column_builders(self.columns, types)
+
+        async for batch in self:
+            for builder, values in zip(builders, zip(*batch)):
+                builder.extend(values)
+
+        return ColumnarResult(tuple(builder.build() for builder in builders))
+
+    @property
+    def closed(self) -> bool:
+        return self._connection is None
+
+    async def aclose(self) -> None:
+        """
+        Discard any pending rows and release the connection.
+        """
+        if self._connection is None:
+            return
+
+        connection, self._connection = self._connection, None
+        await self._result.close()
+        await connection.close()
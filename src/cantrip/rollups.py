@@ -0,0 +1,95 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+from sqlglot import exp
+
+from cantrip.catalog import ContextKey
+from cantrip.models import Dimension, Metric, Relation
+
+# how the partial aggregates stored in a rollup are combined
+REAGGREGATIONS: dict[type[exp.AggFunc], type[exp.AggFunc]] = {
+    exp.Sum: exp.Sum,
+    exp.Count: exp.Sum,
+    exp.Min: exp.Min,
+    exp.Max: exp.Max,
+}
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """
+    A pre-aggregated table for a set of metrics sharing a context.
+
+    Each metric is stored as one or more partial aggregates (eg, `AVG` is stored as a
+    sum and a count), and `metrics` maps each metric to the expression that combines
+    the partial aggregates back into the metric value.
+    """
+
+    table: Relation
+    context: ContextKey
+    dimensions: frozenset[Dimension]
+    metrics: Mapping[Metric, exp.Expression]
+    query: exp.Select
+
+    def covers(self, metrics: set[Metric], dimensions: set[Dimension]) -> bool:
+        """
+        Check if the rollup can answer a request for the metrics and dimensions.
+        """
+        return metrics <= self.metrics.keys() and dimensions <= self.dimensions
+
+
+def split_aggregates(
+    expression: exp.Expression,
+    prefix: str,
+) -> tuple[list[exp.Expression], exp.Expression]:
+    """
+    Split a metric expression into re-aggregatable partial aggregates.
+
+    Returns the partial aggregates (aliased `<prefix>__<n>`) that need to be stored in
+    the rollup, and an expression that computes the metric from them. Raises
+    `ValueError` if the metric can't be re-aggregated (eg, `COUNT(DISTINCT ...)`).
+    """
+    expression = expression.copy()
+    components: list[exp.Expression] = []
+
+    def add_component(node: exp.Expression) -> exp.Column:
+        name = f"{prefix}__{len(components)}"
+        components.append(exp.alias_(node, name))
+        return exp.column(name)
+
+    for aggregate in list(expression.find_all(exp.AggFunc)):
+        # keep the filter together with its aggregate
+        node = (
+            aggregate.parent if isinstance(aggregate.parent, exp.Filter) else aggregate
+        )
+
+        if isinstance(aggregate, exp.Count) and isinstance(
+            aggregate.this, exp.Distinct
+        ):
+            raise ValueError(f"Metric can't be re-aggregated: {aggregate.sql()}")
+
+        if isinstance(aggregate, exp.Avg):
+            sum_ = node.copy()
+            count = node.copy()
+            if isinstance(node, exp.Filter):
+                sum_.set("this", exp.Sum(this=aggregate.this.copy()))
+                count.set("this", exp.Count(this=aggregate.this.copy()))
+            else:
+                sum_ = exp.Sum(this=aggregate.this.copy())
+                count = exp.Count(this=aggregate.this.copy())
+
+            replacement: exp.Expression = exp.Div(
+                this=exp.cast(exp.Sum(this=add_component(sum_)), "double"),
+                expression=exp.Sum(this=add_component(count)),
+            )
+        elif reaggregation := REAGGREGATIONS.get(type(aggregate)):
+            replacement = reaggregation(this=add_component(node.copy()))
+        else:
+            raise ValueError(f"Metric can't be re-aggregated: {aggregate.sql()}")
+
+        if node is expression:
+            expression = replacement
+        else:
+            node.replace(replacement)
+
+    return components, expression
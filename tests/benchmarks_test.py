@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from benchmarks.run import Timing, compare, run_benchmarks
+from benchmarks.star_schema import StarSchema, generate
+from cantrip.implementations.sqlite import SQLiteSemanticLayer
+from cantrip.models import SemanticView
+
+
+def test_generate(tmp_path: Path) -> None:
+    schema = StarSchema(
+        facts=2,
+        chains=3,
+        chain_length=2,
+        metrics_per_fact=12,
+        rows=100,
+        dimension_rows=10,
+    )
+    generate(tmp_path / "star.db", schema)
+    engine = create_engine(f"sqlite:///{tmp_path / 'star.db'}")
+    semantic_layer = SQLiteSemanticLayer(engine)
+    semantic_view = SemanticView("semantic_view")
+
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    assert len(metrics) == 24
+
+    # fact_0 references chains 0 and 2, fact_1 references chains 0 and 1
+    dimensions = semantic_layer.get_valid_dimensions(
+        semantic_view,
+        {metrics["fact_1_metric_0"]},
+        set(),
+    )
+    assert {dimension.table.name for dimension in dimensions} == {
+        "dim_0_0",
+        "dim_0_1",
+        "dim_1_0",
+        "dim_1_1",
+    }
+
+    # dimensions are joined through the chain
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["fact_1_metric_1"]},
+        {next(d for d in dimensions if d.name == "dim_1_1.category")},
+        set(),
+    )
+    assert "LEFT JOIN dim_1_0" in query.sql
+    assert "LEFT JOIN dim_1_1" in query.sql
+    rows = list(semantic_layer.execute(query.sql))
+    assert sum(row["fact_1_metric_1"] for row in rows) == 100
+
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["fact_0_metric_1"], metrics["fact_0_metric_7"]},
+        set(),
+        set(),
+    )
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"fact_0_metric_1": 100, "fact_0_metric_7": 50},
+    ]
+
+    engine.dispose()
+
+
+def test_run_benchmarks(tmp_path: Path) -> None:
+    generate(tmp_path / "star.db", StarSchema(rows=100, dimension_rows=10))
+    engine = create_engine(f"sqlite:///{tmp_path / 'star.db'}")
+
+    results = run_benchmarks(engine, repeat=1)
+    assert "get_query" in results
+    assert "execute" in results
+
+    engine.dispose()
+
+
+def test_compare() -> None:
+    baseline = {"a": Timing(10, 9), "b": Timing(10, 9)}
+    results = {"a": Timing(11, 9), "b": Timing(13, 9), "c": Timing(100, 9)}
+
+    assert compare(results, baseline, tolerance=0.2) == ["b"]
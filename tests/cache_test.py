@@ -0,0 +1,116 @@
+from pathlib import Path
+
+from cantrip.cache import (
+    CachedResult,
+    CacheStats,
+    DiskResultStore,
+    LRUCache,
+    MemoryResultStore,
+    ResultCache,
+    ResultCacheStats,
+    get_result_key,
+)
+
+
+def test_lru_cache_eviction() -> None:
+    cache: LRUCache[int] = LRUCache(maxsize=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+    assert cache.stats == CacheStats(hits=3, misses=1, evictions=1, expirations=0)
+
+
+def test_lru_cache_ttl() -> None:
+    now = 0.0
+    cache: LRUCache[int] = LRUCache(maxsize=2, ttl=10, clock=lambda: now)
+
+    cache.set("a", 1)
+    now = 5
+    assert cache.get("a") == 1
+
+    now = 11
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+    assert cache.stats == CacheStats(hits=1, misses=1, evictions=0, expirations=1)
+
+
+def test_memory_result_store_byte_budget() -> None:
+    result = CachedResult(("a",), tuple((i,) for i in range(100)))
+    store = MemoryResultStore(max_bytes=1000)
+
+    store.set("a", result)
+    store.set("b", result)
+    assert store.get("a") == result
+
+    # evicts the least recently used entry
+    store.set("c", result)
+    assert store.get("b") is None
+    assert store.get("a") == result
+    assert store.size <= 1000
+    assert store.evictions == 1
+
+    # too big to be stored
+    store.set("d", CachedResult(("a",), tuple((i,) for i in range(1000))))
+    assert store.get("d") is None
+
+
+def test_disk_result_store(tmp_path: Path) -> None:
+    result = CachedResult(("a", "b"), ((1, "x"), (2, None)), created=10.0)
+    store = DiskResultStore(tmp_path / "cache")
+
+    store.set("key", result)
+    assert DiskResultStore(tmp_path / "cache").get("key") == result
+
+    (tmp_path / "cache" / "key.pickle").write_bytes(b"garbage")
+    assert store.get("key") is None
+    assert not (tmp_path / "cache" / "key.pickle").exists()
+
+
+def test_result_cache_stale_while_revalidate() -> None:
+    now = 0.0
+    calls: list[int] = []
+    pending: list = []
+
+    def compute() -> tuple[tuple[str, ...], list[tuple[int, ...]]]:
+        calls.append(1)
+        return ("a",), [(len(calls),)]
+
+    cache = ResultCache(
+        ttl=10,
+        stale_ttl=5,
+        clock=lambda: now,
+        submit=pending.append,
+    )
+    key = get_result_key("SELECT 1", None, None)
+
+    assert cache.get(key, compute).rows == ((1,),)
+    assert cache.get(key, compute).rows == ((1,),)
+
+    # stale entries are returned, and refreshed once in the background
+    now = 12
+    assert cache.get(key, compute).rows == ((1,),)
+    assert cache.get(key, compute).rows == ((1,),)
+    assert len(pending) == 1
+    pending.pop()()
+    assert cache.get(key, compute).rows == ((2,),)
+
+    # expired entries are recomputed
+    now = 30
+    assert cache.get(key, compute).rows == ((3,),)
+
+    assert cache.stats == ResultCacheStats(
+        hits=4,
+        misses=2,
+        evictions=0,
+        expirations=1,
+        stale_hits=2,
+        refreshes=1,
+    )
@@ -0,0 +1,94 @@
+import pickle
+from pathlib import Path
+
+import pytest
+from sqlalchemy.engine import Engine
+
+from cantrip.catalog import (
+    CompatibilityIndex,
+    decode_bitset,
+    dump_catalog,
+    read_catalog,
+    resolve_view_tables,
+)
+from cantrip.implementations.sqlite import SQLiteSemanticLayer
+from cantrip.models import Dimension, Metric, Relation
+
+
+def test_decode_bitset() -> None:
+    assert decode_bitset(0b1010, "abcd") == {"b", "d"}
+    assert decode_bitset(0, "abcd") == set()
+
+
+def test_resolve_view_tables() -> None:
+    orders = Relation("orders")
+    customers = Relation("customers")
+    recent = Relation("recent_orders")
+    enriched = Relation("enriched_orders")
+    report = Relation("report")
+
+    assert resolve_view_tables(
+        {
+            report: {enriched, recent},
+            enriched: {recent, customers},
+            recent: {orders},
+        }
+    ) == {
+        recent: {orders},
+        enriched: {orders, customers},
+        report: {orders, customers},
+    }
+
+    with pytest.raises(
+        ValueError,
+        match="Views have a circular dependency: report -> recent_orders -> report",
+    ):
+        resolve_view_tables({report: {recent}, recent: {report, orders}})
+
+
+def test_compatibility_index() -> None:
+    orders = Relation("orders")
+    tickets = Relation("tickets")
+    customers = Relation("customers")
+    products = Relation("products")
+
+    revenue = Metric("revenue", "SUM(amount)", orders, frozenset({orders}))
+    count = Metric("count", "COUNT(*)", tickets, frozenset({tickets}))
+    country = Dimension(customers, "country", "customers.country")
+    category = Dimension(products, "category", "products.category")
+
+    index = CompatibilityIndex.build(
+        [revenue, count],
+        [country, category],
+        {orders: {country, category}, tickets: {country}},
+    )
+
+    assert index.get_valid_metrics(set()) == {revenue, count}
+    assert index.get_valid_metrics({country}) == {revenue, count}
+    assert index.get_valid_metrics({country, category}) == {revenue}
+    assert index.get_valid_dimensions(set()) == {country, category}
+    assert index.get_valid_dimensions({revenue}) == {country, category}
+    assert index.get_valid_dimensions({revenue, count}) == {country}
+
+
+def test_dump_catalog(tmp_path: Path, sqlite_engine: Engine) -> None:
+    catalog = SQLiteSemanticLayer(sqlite_engine).get_catalog()
+    dump_catalog(catalog, tmp_path / "catalog")
+
+    restored = read_catalog(tmp_path / "catalog")
+    assert restored.version == catalog.version
+    assert restored.metrics == catalog.metrics
+    assert restored.dimensions == catalog.dimensions
+    assert restored.dimension_joins == catalog.dimension_joins
+    assert restored.compatibility == catalog.compatibility
+    for metric, compiled in catalog.compiled_metrics.items():
+        assert restored.compiled_metrics[metric].expression == compiled.expression
+
+
+def test_read_catalog_incompatible(tmp_path: Path) -> None:
+    path = tmp_path / "catalog"
+    with open(path, "wb") as file:
+        pickle.dump((0, "1.0.0", b""), file)
+
+    with pytest.raises(ValueError, match="Incompatible catalog file"):
+        read_catalog(path)
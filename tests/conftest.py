@@ -0,0 +1,28 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+INIT_SQL = Path(__file__).parent.parent / "init.sql"
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path: Path) -> Engine:
+    """
+    A SQLite engine with the sample star schema from `init.sql`.
+    """
+    path = tmp_path / "sample.db"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(INIT_SQL.read_text())
+
+    return create_engine(f"sqlite:///{path}")
+
+
+@pytest.fixture
+def sqlite_path(sqlite_engine: Engine) -> str:
+    """
+    The path to the SQLite database with the sample star schema.
+    """
+    return sqlite_engine.url.database
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from pytest_mock import MockerFixture
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from cantrip.implementations.async_sqlite import AsyncSQLiteSemanticLayer
+from cantrip.instrumentation import Aggregator
+from cantrip.models import SemanticView
+
+pytest.importorskip("aiosqlite")
+
+
+def test_async_semantic_layer(sqlite_path: str) -> None:
+    async def main() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+        semantic_layer = AsyncSQLiteSemanticLayer(engine)
+        semantic_view = SemanticView("semantic_view")
+
+        try:
+            metrics, dimensions = await asyncio.gather(
+                semantic_layer.get_metrics(semantic_view),
+                semantic_layer.get_dimensions(semantic_view),
+            )
+            assert len(metrics) == 7
+            assert len(dimensions) == 11
+            assert semantic_layer.catalog_stats.misses == 1
+
+            metric = next(
+                metric for metric in metrics if metric.name == "total_tickets"
+            )
+            query = await semantic_layer.get_query(
+                semantic_view, {metric}, set(), set()
+            )
+            assert [row async for row in semantic_layer.execute(query.sql)] == [
+                {"total_tickets": 3},
+            ]
+
+            result = await semantic_layer.execute_batches(
+                "SELECT order_id FROM fact_orders ORDER BY order_id",
+                batch_size=2,
+            )
+            assert result.columns == ("order_id",)
+            assert [batch async for batch in result] == [[(1,), (2,)], [(3,)]]
+            assert result.closed
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_async_catalog_is_built_in_a_single_pass(
+    mocker: MockerFixture,
+    sqlite_path: str,
+) -> None:
+    async def main() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+        aggregator = Aggregator()
+        semantic_layer = AsyncSQLiteSemanticLayer(engine, instrumentation=aggregator)
+        load_schema = mocker.spy(semantic_layer.layer, "load_schema")
+        semantic_view = SemanticView("semantic_view")
+
+        try:
+            assert len(await semantic_layer.get_metrics(semantic_view)) == 7
+            assert load_schema.call_count == 1
+
+            # the catalog is refreshed incrementally
+            aggregator.reset()
+            async with engine.begin() as connection:
+                await connection.execute(text("DROP VIEW total_discount"))
+                await connection.execute(text("""
+CREATE VIEW total_discount AS
+SELECT SUM(quantity * discount) AS total_discount
+FROM fact_orders
+                    """))
+            assert len(await semantic_layer.get_metrics(semantic_view)) == 7
+            assert load_schema.call_count == 2
+            assert aggregator.counters["metrics_compiled"] == 1
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_async_catalog_is_introspected_concurrently(
+    mocker: MockerFixture,
+    sqlite_path: str,
+) -> None:
+    async def main() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+        semantic_layer = AsyncSQLiteSemanticLayer(engine)
+        # a layer that runs an independent query in each `load_*` method
+        semantic_layer.layer.single_pass_catalog = False
+        build_catalog = mocker.spy(semantic_layer.layer, "build_catalog")
+        gather = mocker.spy(asyncio, "gather")
+        semantic_view = SemanticView("semantic_view")
+
+        try:
+            assert len(await semantic_layer.get_metrics(semantic_view)) == 7
+            assert len(await semantic_layer.get_dimensions(semantic_view)) == 11
+            build_catalog.assert_not_called()
+            assert len(gather.call_args_list[-1].args) == 5
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
@@ -2,7 +2,11 @@ import pytest
 import sqlglot
 from pytest_mock import MockerFixture
 
-from cantrip.implementations.base import BaseSemanticLayer
+from cantrip.implementations.base import (
+    BaseSemanticLayer,
+    get_sampling_error,
+    scale_aggregates,
+)
 from cantrip.models import Metric, Relation
 
 
@@ -42,7 +46,40 @@ def test_get_metric_from_view(
 ) -> None:
     engine = mocker.MagicMock()
     semantic_layer = BaseSemanticLayer(engine)
-    mocker.patch.object(semantic_layer, "get_views", return_value={})
+    mocker.patch.object(semantic_layer, "get_view_tables", return_value={})
 
     ast = sqlglot.parse_one(sql)
     assert semantic_layer.get_metric_from_view(ast) == expected
+
+
+@pytest.mark.parametrize(
+    "sql, scaled, error",
+    [
+        (
+            "SUM(quantity)",
+            "(SUM(quantity) / 0.1)",
+            "1.96 * SQRT((1 - 0.1) * SUM((quantity) * (quantity))) / 0.1",
+        ),
+        (
+            "COUNT(*) FILTER(WHERE discount > 0)",
+            "(COUNT(*) FILTER(WHERE discount > 0) / 0.1)",
+            "1.96 * SQRT((1 - 0.1) * COUNT(*) FILTER(WHERE discount > 0)) / 0.1",
+        ),
+        (
+            "AVG(quantity)",
+            "AVG(quantity)",
+            "1.96 * SQRT((AVG((quantity) * (quantity)) - AVG(quantity) * "
+            "AVG(quantity)) * (1 - 0.1) / COUNT(quantity))",
+        ),
+        (
+            "SUM(quantity) / COUNT(*)",
+            "(SUM(quantity) / 0.1) / (COUNT(*) / 0.1)",
+            "NULL",
+        ),
+    ],
+)
+def test_sampled_metric(sql: str, scaled: str, error: str) -> None:
+    expression = sqlglot.parse_one(sql)
+
+    assert scale_aggregates(expression, 0.1).sql() == scaled
+    assert get_sampling_error(expression, 0.1).sql() == error
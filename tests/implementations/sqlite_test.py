@@ -0,0 +1,1302 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+import sqlglot
+from pytest_mock import MockerFixture
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from cantrip.catalog import CatalogStats
+from cantrip.implementations.sqlite import (
+    IndexRecommendation,
+    SQLitePragmas,
+    SQLiteSemanticLayer,
+    create_sqlite_engine,
+)
+from cantrip.instrumentation import Aggregator
+from cantrip.models import (
+    Filter,
+    FilterTypeEnum,
+    QueryRequest,
+    Relation,
+    SemanticView,
+    Sort,
+    SortDirectionEnum,
+    get_rollup_sets,
+)
+from cantrip.results import ColumnType
+
+
+def test_catalog_is_cached(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+
+    metrics = semantic_layer.get_metrics(semantic_view)
+    assert {metric.name for metric in metrics} == {
+        "total_revenue",
+        "total_units_sold",
+        "avg_order_value",
+        "total_discount",
+        "total_tickets",
+        "avg_resolution_time",
+        "avg_satisfaction_score",
+    }
+    assert semantic_layer.get_metrics(semantic_view) == metrics
+    semantic_layer.get_dimensions(semantic_view)
+
+    assert semantic_layer.catalog_stats == CatalogStats(hits=2, misses=1, rebuilds=0)
+
+
+def test_catalog_is_rebuilt_on_schema_change(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+
+    catalog = semantic_layer.get_catalog()
+    assert semantic_layer.get_catalog() is catalog
+
+    with sqlite_engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE VIEW max_quantity AS "
+                "SELECT MAX(quantity) AS max_quantity FROM fact_orders"
+            )
+        )
+
+    assert semantic_layer.get_catalog() is not catalog
+    assert "max_quantity" in {
+        metric.name for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    assert semantic_layer.catalog_stats == CatalogStats(hits=2, misses=2, rebuilds=1)
+
+
+def test_get_query_outer_join(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE VIEW customer_units AS
+SELECT SUM(quantity) AS customer_units
+FROM fact_orders
+LEFT JOIN dim_customers ON fact_orders.customer_id = dim_customers.customer_id
+                """))
+        connection.execute(text("""
+CREATE VIEW customer_tickets AS
+SELECT COUNT(*) AS customer_tickets
+FROM fact_customer_support
+LEFT JOIN dim_customers
+ON fact_customer_support.customer_id = dim_customers.customer_id
+                """))
+        connection.execute(text("""
+INSERT INTO dim_customers VALUES (4, 'Dan Brown', 'dan@example.com', 'Brazil')
+                """))
+        connection.execute(text("""
+INSERT INTO fact_customer_support VALUES
+(4, 4, 20240601, 'Agent B', 1.0, 5, 'Billing')
+                """))
+        connection.execute(text("""
+INSERT INTO fact_orders VALUES (4, NULL, 1, 20240601, 5, 10.00, 0.0, 1.00)
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    country = next(
+        dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+        if dimension.name == "dim_customers.country"
+    )
+
+    def by_country(filters: set[Filter]) -> list[tuple]:
+        query = semantic_layer.get_query(
+            semantic_view,
+            {metrics["customer_units"], metrics["customer_tickets"]},
+            {country},
+            filters,
+        )
+        return sorted(
+            (
+                row["dim_customers.country"] or "",
+                row["customer_units"],
+                row["customer_tickets"],
+            )
+            for row in semantic_layer.execute(query.sql)
+        )
+
+    # groups missing from a context, and groups with a NULL dimension, are kept
+    assert by_country(set()) == [
+        ("", 5, None),
+        ("Brazil", None, 1),
+        ("Canada", 1, 1),
+        ("UK", 3, 1),
+        ("USA", 2, 1),
+    ]
+
+    # filters on the metrics of a context keep only its groups
+    assert by_country({Filter(FilterTypeEnum.HAVING, "customer_units > 1")}) == [
+        ("", 5, None),
+        ("UK", 3, 1),
+        ("USA", 2, 1),
+    ]
+
+    # filters on the dimensions keep the groups of every context
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+INSERT INTO dim_customers VALUES (5, 'Eva Diaz', 'eva@example.com', 'Peru')
+                """))
+        connection.execute(text("""
+INSERT INTO fact_orders VALUES (5, 5, 1, 20240601, 4, 10.00, 0.0, 1.00)
+                """))
+    for type_ in FilterTypeEnum:
+        peru = {Filter(type_, "dim_customers.country = 'Peru'")}
+        assert by_country(peru) == [("Peru", 4, None)]
+        assert semantic_layer.execute_parallel(
+            semantic_view,
+            {metrics["customer_units"], metrics["customer_tickets"]},
+            {country},
+            peru,
+        ) == [
+            {
+                "customer_units": 4,
+                "customer_tickets": None,
+                "dim_customers.country": "Peru",
+            },
+        ]
+
+
+def test_get_query_uses_compiled_metrics(
+    mocker: MockerFixture,
+    sqlite_engine: Engine,
+) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+
+    parse_one = mocker.spy(sqlglot, "parse_one")
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"], metrics["total_tickets"]},
+        set(),
+        set(),
+    )
+    parse_one.assert_not_called()
+
+    assert query.sql == (
+        "WITH context_0 AS ("
+        "SELECT SUM(quantity * unit_price * (1 - discount) + tax_amount) AS total_revenue "
+        "FROM fact_orders"
+        "), context_1 AS ("
+        "SELECT COUNT(*) AS total_tickets FROM fact_customer_support"
+        ") "
+        "SELECT context_0.total_revenue AS total_revenue, "
+        "context_1.total_tickets AS total_tickets "
+        "FROM context_0 CROSS JOIN context_1"
+    )
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_revenue": 96.30000000000001, "total_tickets": 3},
+    ]
+
+
+def test_get_query_is_cached(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"], metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"], dimensions["dim_products.category"]},
+        set(),
+    )
+    assert (
+        semantic_layer.get_query(
+            semantic_view,
+            {metrics["total_units_sold"], metrics["total_revenue"]},
+            {dimensions["dim_products.category"], dimensions["dim_customers.country"]},
+            set(),
+        )
+        is query
+    )
+    assert semantic_layer.query_cache.stats.hits == 1
+
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE other (id INTEGER PRIMARY KEY)"))
+
+    assert len(semantic_layer.query_cache) == 1
+    semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"], metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"], dimensions["dim_products.category"]},
+        set(),
+    )
+    assert semantic_layer.query_cache.stats.hits == 1
+    assert semantic_layer.catalog_stats.rebuilds == 1
+
+
+def test_get_valid_metrics_and_dimensions(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    valid_metrics = semantic_layer.get_valid_metrics(
+        semantic_view,
+        {metrics["total_revenue"]},
+        {dimensions["dim_products.category"]},
+    )
+    assert {metric.name for metric in valid_metrics} == {
+        "avg_order_value",
+        "total_discount",
+        "total_revenue",
+        "total_units_sold",
+    }
+
+    valid_dimensions = semantic_layer.get_valid_dimensions(
+        semantic_view,
+        {metrics["total_tickets"]},
+        set(),
+    )
+    assert "dim_products.category" not in {
+        dimension.name for dimension in valid_dimensions
+    }
+
+    with pytest.raises(ValueError) as excinfo:
+        semantic_layer.get_valid_metrics(
+            semantic_view,
+            {metrics["total_tickets"]},
+            {dimensions["dim_products.category"]},
+        )
+    assert str(excinfo.value) == (
+        "Some given metrics are not valid for the given dimensions: total_tickets"
+    )
+
+
+def test_execute_batches(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+
+    result = semantic_layer.execute_batches(
+        "SELECT order_id, quantity FROM fact_orders ORDER BY order_id",
+        batch_size=2,
+    )
+    assert result.columns == ("order_id", "quantity")
+    assert list(result) == [[(1, 2), (2, 1)], [(3, 3)]]
+    assert result.closed
+
+    with semantic_layer.execute_batches(
+        "SELECT order_id FROM fact_orders WHERE order_id > :id",
+        {"id": 1},
+        batch_size=1,
+    ) as result:
+        assert next(iter(result)) == [(2,)]
+    assert result.closed
+    assert sqlite_engine.pool.checkedout() == 0
+
+
+def test_execute_columnar(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    types = semantic_layer.get_column_types(
+        {metrics["total_tickets"]},
+        {dimensions["dim_customers.country"]},
+    )
+    assert types == {
+        "total_tickets": ColumnType.INTEGER,
+        "dim_customers.country": ColumnType.TEXT,
+    }
+
+    result = semantic_layer.execute_columnar(
+        'SELECT COUNT(*) AS total_tickets, c.country AS "dim_customers.country" '
+        "FROM fact_customer_support f "
+        "JOIN dim_customers c ON f.customer_id = c.customer_id "
+        "GROUP BY c.country ORDER BY c.country",
+        types=types,
+    )
+    assert len(result) == 3
+    assert result["total_tickets"].values == array("q", [1, 1, 1])
+    assert result["dim_customers.country"].dictionary == ("Canada", "UK", "USA")
+
+
+def test_execute_parallel(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric
+        for metric in semantic_layer.get_metrics(semantic_view)
+        if metric.name in {"total_revenue", "total_units_sold", "total_tickets"}
+    }
+
+    query = semantic_layer.get_query(semantic_view, metrics, set(), set())
+    assert semantic_layer.execute_parallel(semantic_view, metrics, set(), set()) == (
+        list(semantic_layer.execute(query.sql))
+    )
+
+    # groups missing from a context, or with a NULL dimension, are kept like in SQL
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE VIEW customer_units AS
+SELECT SUM(quantity) AS customer_units
+FROM fact_orders
+LEFT JOIN dim_customers ON fact_orders.customer_id = dim_customers.customer_id
+                """))
+        connection.execute(text("""
+CREATE VIEW customer_tickets AS
+SELECT COUNT(*) AS customer_tickets
+FROM fact_customer_support
+LEFT JOIN dim_customers
+ON fact_customer_support.customer_id = dim_customers.customer_id
+                """))
+        connection.execute(text("""
+INSERT INTO dim_customers VALUES (4, 'Dan Brown', 'dan@example.com', 'Brazil')
+                """))
+        connection.execute(text("""
+INSERT INTO fact_customer_support VALUES
+(4, 4, 20240601, 'Agent B', 1.0, 5, 'Billing')
+                """))
+        connection.execute(text("""
+INSERT INTO fact_orders VALUES (4, NULL, 1, 20240601, 5, 10.00, 0.0, 1.00)
+                """))
+    metrics = {
+        metric
+        for metric in semantic_layer.get_metrics(semantic_view)
+        if metric.name in {"customer_units", "customer_tickets"}
+    }
+    country = {
+        dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+        if dimension.name == "dim_customers.country"
+    }
+    for direction in SortDirectionEnum:
+        sort = Sort(tuple(country), direction)
+        query = semantic_layer.get_query(semantic_view, metrics, country, set(), sort)
+        assert semantic_layer.execute_parallel(
+            semantic_view,
+            metrics,
+            country,
+            set(),
+            sort,
+        ) == list(semantic_layer.execute(query.sql))
+
+    with pytest.raises(
+        ValueError,
+        match="At least one metric is required for parallel execution",
+    ):
+        semantic_layer.execute_parallel(semantic_view, set(), country, set())
+
+
+def test_rollups(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    semantic_layer.add_rollup(
+        "rollup_orders_by_country",
+        {metrics["total_revenue"], metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"], dimensions["dim_products.category"]},
+    )
+    semantic_layer.add_rollup(
+        "rollup_orders",
+        {metrics["total_revenue"], metrics["total_units_sold"]},
+        set(),
+    )
+    assert semantic_layer.rollup_sizes == {
+        "rollup_orders_by_country": 3,
+        "rollup_orders": 1,
+    }
+
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"]},
+        {dimensions["dim_customers.country"]},
+        set(),
+    )
+    assert query.sql == (
+        "SELECT SUM(total_revenue__0) AS total_revenue, "
+        '"dim_customers.country" AS "dim_customers.country" '
+        "FROM rollup_orders_by_country "
+        'GROUP BY "dim_customers.country"'
+    )
+    assert sorted(
+        (row["dim_customers.country"], round(row["total_revenue"], 2))
+        for row in semantic_layer.execute(query.sql)
+    ) == [("Canada", 16.2), ("UK", 60.6), ("USA", 19.5)]
+
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"]},
+        set(),
+        set(),
+    )
+    assert query.sql == (
+        "SELECT SUM(total_revenue__0) AS total_revenue FROM rollup_orders"
+    )
+
+    # not covered by any rollup
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["avg_order_value"]},
+        set(),
+        set(),
+    )
+    assert "fact_orders" in query.sql
+
+    semantic_layer.drop_rollup("rollup_orders")
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_revenue"]},
+        set(),
+        set(),
+    )
+    assert "rollup_orders_by_country" in query.sql
+
+
+def test_execute_cached(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    sql = "SELECT SUM(quantity) AS quantity FROM fact_orders"
+
+    result = semantic_layer.execute_cached(sql)
+    assert result.columns == ("quantity",)
+    assert semantic_layer.execute_cached(sql) == result
+    assert semantic_layer.result_cache.stats.hits == 1
+
+    # new data changes the data version
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("DELETE FROM fact_orders"))
+    assert semantic_layer.execute_cached(sql).rows == ((None,),)
+    assert semantic_layer.result_cache.stats.misses == 2
+
+    # a user-supplied token overrides the data version
+    assert semantic_layer.execute_cached(sql, data_version="v1").rows == ((None,),)
+    assert semantic_layer.execute_cached(sql, data_version="v1").rows == ((None,),)
+    assert semantic_layer.result_cache.stats.misses == 3
+
+    # the data version is read outside of the pool, from a connection the layer closes
+    assert sqlite_engine.pool.checkedout() == 0
+    assert isinstance(semantic_layer.get_data_version(), int)
+    semantic_layer.close()
+    assert semantic_layer._data_version_connection is None
+    assert isinstance(semantic_layer.get_data_version(), int)
+    semantic_layer.close()
+
+
+def test_instrumentation(sqlite_engine: Engine) -> None:
+    aggregator = Aggregator()
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine, instrumentation=aggregator)
+    semantic_view = SemanticView("semantic_view")
+
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    assert aggregator.report().keys() == {
+        "connect",
+        "execute",
+        "introspect.views",
+        "introspect.dimensions",
+        "introspect.dimensions_per_table",
+        "introspect.dimension_joins",
+        "introspect.column_types",
+        "compile",
+    }
+    assert aggregator.counters["asts_parsed"] == 7
+
+    aggregator.reset()
+    for _ in range(2):
+        query = semantic_layer.get_query(
+            semantic_view,
+            {metrics["total_units_sold"]},
+            set(),
+            set(),
+        )
+    assert list(semantic_layer.execute(query.sql)) == [{"total_units_sold": 6}]
+    with semantic_layer.execute_batches("SELECT * FROM fact_orders") as result:
+        list(result)
+
+    assert aggregator.report().keys() == {"connect", "execute", "generate", "render"}
+    assert aggregator.report()["generate"].count == 1
+    assert aggregator.counters == {
+        "catalog.hits": 2,
+        "query_cache.misses": 1,
+        "query_cache.hits": 1,
+        # includes the schema version checks
+        "rows_fetched": 6,
+    }
+
+
+def test_catalog_is_introspected_in_a_single_pass(
+    mocker: MockerFixture,
+    sqlite_engine: Engine,
+) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    load_schema = mocker.spy(semantic_layer, "load_schema")
+    execute = mocker.spy(semantic_layer, "execute")
+
+    catalog = semantic_layer.get_catalog()
+
+    load_schema.assert_called_once()
+    # the schema version, and the schema itself
+    assert execute.call_count == 2
+
+    schema = load_schema.spy_return
+    assert list(schema.columns["dim_customers"]) == [
+        "customer_id",
+        "name",
+        "email",
+        "country",
+    ]
+    assert {
+        foreign_key.referenced_table
+        for foreign_key in schema.foreign_keys
+        if foreign_key.table == "fact_orders"
+    } == {"dim_customers", "dim_products", "dim_dates"}
+    assert len(catalog.views) == len(schema.views) == 7
+
+
+def test_restore_catalog(
+    mocker: MockerFixture,
+    tmp_path: Path,
+    sqlite_engine: Engine,
+) -> None:
+    semantic_view = SemanticView("semantic_view")
+    SQLiteSemanticLayer(sqlite_engine).save_catalog(tmp_path / "catalog")
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    load_schema = mocker.spy(semantic_layer, "load_schema")
+    semantic_layer.restore_catalog(tmp_path / "catalog")
+
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        set(),
+        set(),
+    )
+    assert list(semantic_layer.execute(query.sql)) == [{"total_units_sold": 6}]
+    load_schema.assert_not_called()
+
+    # the restored catalog is rebuilt once the schema changes
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (a INTEGER)"))
+    semantic_layer.get_metrics(semantic_view)
+    load_schema.assert_called_once()
+
+
+def test_get_query_filters(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    requested = {metrics["total_units_sold"], metrics["total_tickets"]}
+
+    # WHERE filters are only pushed into the contexts that have their tables
+    where = Filter(FilterTypeEnum.WHERE, "fact_orders.quantity > 1")
+    query = semantic_layer.get_query(semantic_view, requested, set(), {where})
+    assert "FROM fact_orders WHERE fact_orders.quantity > 1" in query.sql
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_tickets": 3, "total_units_sold": 5},
+    ]
+
+    # unqualified columns are resolved to the table that has them
+    where = Filter(FilterTypeEnum.WHERE, "quantity > 1")
+    query = semantic_layer.get_query(semantic_view, requested, set(), {where})
+    assert "FROM fact_orders WHERE quantity > 1" in query.sql
+    assert "FROM fact_customer_support WHERE" not in query.sql
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_tickets": 3, "total_units_sold": 5},
+    ]
+
+    # HAVING filters are applied to a context, or to the combined result
+    having = {
+        Filter(FilterTypeEnum.HAVING, "total_tickets > 3"),
+        Filter(FilterTypeEnum.HAVING, "total_units_sold > total_tickets"),
+    }
+    query = semantic_layer.get_query(semantic_view, requested, set(), having)
+    assert "HAVING COUNT(*) > 3" in query.sql
+    assert "WHERE context_1.total_units_sold > context_0.total_tickets" in query.sql
+    assert list(semantic_layer.execute(query.sql)) == []
+
+    with pytest.raises(ValueError, match="reference tables not used by the metrics"):
+        semantic_layer.get_query(
+            semantic_view,
+            requested,
+            set(),
+            {Filter(FilterTypeEnum.WHERE, "unknown.category = 'Widgets'")},
+        )
+
+    with pytest.raises(
+        ValueError,
+        match="Filters reference columns not in any table: unknown > 1",
+    ):
+        semantic_layer.get_query(
+            semantic_view,
+            requested,
+            set(),
+            {Filter(FilterTypeEnum.WHERE, "unknown > 1")},
+        )
+
+    with pytest.raises(
+        ValueError,
+        match="Filters reference ambiguous columns: customer_id = 1",
+    ):
+        semantic_layer.get_query(
+            semantic_view,
+            requested,
+            set(),
+            {Filter(FilterTypeEnum.WHERE, "customer_id = 1")},
+        )
+
+    with pytest.raises(ValueError, match="can only reference the selected metrics"):
+        semantic_layer.get_query(
+            semantic_view,
+            requested,
+            set(),
+            {Filter(FilterTypeEnum.HAVING, "total_revenue > 0")},
+        )
+
+
+def test_get_query_joins(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE VIEW total_units AS
+SELECT SUM(fact_orders.quantity) AS total_units
+FROM fact_orders
+LEFT JOIN dim_products ON fact_orders.product_id = dim_products.product_id
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    # only the dimension tables needed are joined, in each context
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"], metrics["total_tickets"]},
+        {dimensions["dim_customers.country"]},
+        {Filter(FilterTypeEnum.WHERE, "dim_products.category = 'Widgets'")},
+    )
+    assert query.sql.count("LEFT JOIN dim_customers") == 2
+    assert query.sql.count("LEFT JOIN dim_products") == 1
+    assert "LEFT JOIN dim_dates" not in query.sql
+    assert sorted(
+        semantic_layer.execute(query.sql),
+        key=lambda row: row["dim_customers.country"],
+    ) == [
+        {"total_tickets": 1, "total_units_sold": 1, "dim_customers.country": "Canada"},
+        {"total_tickets": 1, "total_units_sold": None, "dim_customers.country": "UK"},
+        {"total_tickets": 1, "total_units_sold": 2, "dim_customers.country": "USA"},
+    ]
+
+    # joins in the view that aren't needed are pruned
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units"]},
+        set(),
+        set(),
+    )
+    assert "JOIN" not in query.sql
+    assert list(semantic_layer.execute(query.sql)) == [{"total_units": 6}]
+
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units"]},
+        {dimensions["dim_products.category"]},
+        set(),
+    )
+    assert query.sql.count("JOIN dim_products") == 1
+    assert sorted(
+        semantic_layer.execute(query.sql), key=lambda row: row["total_units"]
+    ) == [
+        {"total_units": 3, "dim_products.category": "Gadgets"},
+        {"total_units": 3, "dim_products.category": "Widgets"},
+    ]
+
+
+def test_get_query_fusion(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE VIEW widget_units AS
+SELECT SUM(fact_orders.quantity) AS widget_units
+FROM fact_orders
+JOIN dim_products ON fact_orders.product_id = dim_products.product_id
+WHERE dim_products.category = 'Widgets'
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+
+    # metrics over the same fact table are computed in a single scan
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["widget_units"], metrics["total_units_sold"]},
+        set(),
+        set(),
+    )
+    assert query.sql.count("FROM fact_orders") == 1
+    assert "context_1" not in query.sql
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_units_sold": 6, "widget_units": 3},
+    ]
+
+    # groups without widgets are kept, as they would be when joining contexts
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["widget_units"], metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"]},
+        set(),
+    )
+    assert query.sql.count("FROM fact_orders") == 1
+    assert sorted(
+        semantic_layer.execute(query.sql),
+        key=lambda row: row["dim_customers.country"],
+    ) == [
+        {"total_units_sold": 1, "widget_units": 1, "dim_customers.country": "Canada"},
+        {"total_units_sold": 3, "widget_units": None, "dim_customers.country": "UK"},
+        {"total_units_sold": 2, "widget_units": 2, "dim_customers.country": "USA"},
+    ]
+
+
+def test_create_sqlite_engine(sqlite_path: str) -> None:
+    aggregator = Aggregator()
+    engine = create_sqlite_engine(
+        sqlite_path,
+        read_only=True,
+        pool_size=2,
+        instrumentation=aggregator,
+    )
+    semantic_layer = SQLiteSemanticLayer(engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        set(),
+        set(),
+    )
+
+    # connections are reused across queries and threads
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(
+            executor.map(lambda _: list(semantic_layer.execute(query.sql)), range(20))
+        )
+    assert results == [[{"total_units_sold": 6}]] * 20
+    assert aggregator.counters["pool.connections"] <= 3
+
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA query_only")).scalar() == 1
+        assert connection.execute(text("PRAGMA temp_store")).scalar() == 2
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.execute(text("DELETE FROM fact_orders"))
+
+    engine.dispose()
+
+
+def test_create_sqlite_engine_writable(sqlite_path: str) -> None:
+    engine = create_sqlite_engine(sqlite_path, pragmas=SQLitePragmas(mmap_size=None))
+
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA mmap_size")).scalar() == 0
+        assert connection.execute(text("PRAGMA query_only")).scalar() == 0
+
+    engine.dispose()
+
+
+def test_execute_batch(sqlite_engine: Engine) -> None:
+    aggregator = Aggregator()
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine, instrumentation=aggregator)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+    widgets = frozenset(
+        {Filter(FilterTypeEnum.WHERE, "dim_products.category = 'Widgets'")}
+    )
+    requests = [
+        QueryRequest(
+            semantic_view,
+            frozenset({metrics["total_units_sold"], metrics["total_tickets"]}),
+            frozenset({dimensions["dim_customers.country"]}),
+        ),
+        QueryRequest(
+            semantic_view,
+            frozenset({metrics["total_units_sold"]}),
+            frozenset({dimensions["dim_products.category"]}),
+        ),
+        QueryRequest(semantic_view, frozenset({metrics["total_units_sold"]})),
+        QueryRequest(
+            semantic_view,
+            frozenset({metrics["total_units_sold"]}),
+            frozenset({dimensions["dim_customers.country"]}),
+            widgets,
+        ),
+        # can't be re-aggregated, so it runs on its own
+        QueryRequest(
+            semantic_view,
+            frozenset({metrics["avg_order_value"]}),
+            frozenset(),
+            widgets,
+        ),
+    ]
+
+    def by_row(rows: list[dict]) -> list[dict]:
+        return sorted(rows, key=lambda row: sorted(row.items()))
+
+    expected = [
+        list(
+            semantic_layer.execute(
+                semantic_layer.get_query(
+                    request.semantic_view,
+                    set(request.metrics),
+                    set(request.dimensions),
+                    set(request.filters),
+                ).sql
+            )
+        )
+        for request in requests
+    ]
+    aggregator.reset()
+    assert [by_row(rows) for rows in semantic_layer.execute_batch(requests)] == [
+        by_row(rows) for rows in expected
+    ]
+    # the schema version, one statement for the requests without filters, and two for
+    # the requests with filters, since one of them can't share the scan
+    assert aggregator.report()["execute"].count == 4
+
+    # the fact tables are scanned once, even if they're used by different requests
+    query = semantic_layer.build_batch_query(semantic_layer.get_catalog(), requests[:3])
+    assert query is not None
+    assert query.sql.count("FROM fact_orders") == 1
+    assert query.sql.count("FROM fact_customer_support") == 1
+
+    # sorted requests keep their order after the union
+    units = metrics["total_units_sold"]
+    country = dimensions["dim_customers.country"]
+    sorted_requests = [
+        QueryRequest(
+            semantic_view,
+            frozenset({units}),
+            frozenset({country}),
+            sort=Sort((units,), SortDirectionEnum.DESC),
+            limit=2,
+        ),
+        QueryRequest(
+            semantic_view,
+            frozenset({units, metrics["total_tickets"]}),
+            frozenset({country}),
+            sort=Sort((country,), SortDirectionEnum.ASC),
+        ),
+    ]
+    assert semantic_layer.build_batch_query(
+        semantic_layer.get_catalog(),
+        sorted_requests,
+    )
+    assert [
+        [row["dim_customers.country"] for row in rows]
+        for rows in semantic_layer.execute_batch(sorted_requests)
+    ] == [["UK", "USA"], ["Canada", "UK", "USA"]]
+
+
+def test_get_query_grouping_sets(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+    country = dimensions["dim_customers.country"]
+    category = dimensions["dim_products.category"]
+
+    # every level reads from a single scan of the fact table
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        {country, category},
+        set(),
+        grouping_sets=get_rollup_sets([country, category]),
+    )
+    assert query.sql.count("FROM fact_orders") == 1
+    assert sorted(
+        (
+            row["__grouping_id"],
+            row["dim_customers.country"] or "",
+            row["dim_products.category"] or "",
+            row["total_units_sold"],
+        )
+        for row in semantic_layer.execute(query.sql)
+    ) == [
+        (0, "Canada", "Widgets", 1),
+        (0, "UK", "Gadgets", 3),
+        (0, "USA", "Widgets", 2),
+        (1, "Canada", "", 1),
+        (1, "UK", "", 3),
+        (1, "USA", "", 2),
+        (3, "", "", 6),
+    ]
+
+    # with HAVING filters each level is computed on its own
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        {country},
+        {Filter(FilterTypeEnum.HAVING, "total_units_sold > 1")},
+        grouping_sets=get_rollup_sets([country]),
+    )
+    assert query.sql.count("FROM fact_orders") == 2
+    assert sorted(
+        (row["__grouping_id"], row["total_units_sold"])
+        for row in semantic_layer.execute(query.sql)
+    ) == [(0, 2), (0, 3), (1, 6)]
+
+    with pytest.raises(
+        ValueError,
+        match="Grouping sets can only reference the selected dimensions: "
+        "dim_products.category",
+    ):
+        semantic_layer.get_query(
+            semantic_view,
+            {metrics["total_units_sold"]},
+            {country},
+            set(),
+            grouping_sets=[{category}],
+        )
+
+    with pytest.raises(ValueError, match="At least one grouping set is required"):
+        semantic_layer.get_query(
+            semantic_view,
+            {metrics["total_units_sold"]},
+            {country},
+            set(),
+            grouping_sets=[],
+        )
+
+    # dialects with support compute the levels in each context
+    semantic_layer.supports_grouping_sets = True
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"], metrics["total_tickets"]},
+        {country},
+        set(),
+        grouping_sets=get_rollup_sets([country]),
+    )
+    assert query.sql.count("GROUP BY GROUPING SETS ((), (dim_customers.country))") == 2
+    assert (
+        '__keys."dim_customers.country" IS NOT DISTINCT FROM '
+        'context_1."dim_customers.country"'
+    ) in query.sql
+
+
+def test_incremental_catalog_refresh(sqlite_engine: Engine) -> None:
+    aggregator = Aggregator()
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine, instrumentation=aggregator)
+    semantic_view = SemanticView("semantic_view")
+    catalog = semantic_layer.get_catalog()
+    assert aggregator.counters["asts_parsed"] == 7
+    assert aggregator.counters["metrics_compiled"] == 7
+
+    aggregator.reset()
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("DROP VIEW total_discount"))
+        connection.execute(text("""
+CREATE VIEW total_discount AS
+SELECT SUM(quantity * discount) AS total_discount
+FROM fact_orders
+                """))
+
+    # only the changed view is parsed and compiled again
+    refreshed = semantic_layer.get_catalog()
+    assert refreshed.version != catalog.version
+    assert aggregator.counters["asts_parsed"] == 1
+    assert aggregator.counters["metrics_compiled"] == 1
+    assert refreshed.dimensions is catalog.dimensions
+    assert refreshed.join_graph is catalog.join_graph
+    metrics = {metric.name: metric for metric in refreshed.metrics}
+    assert metrics["total_discount"].sql == "SUM(quantity * discount)"
+    assert (
+        refreshed.compiled_metrics[metrics["total_tickets"]]
+        is catalog.compiled_metrics[metrics["total_tickets"]]
+    )
+
+    # new foreign keys rebuild the dimensions, without parsing the views
+    aggregator.reset()
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE TABLE dim_agents (agent_name TEXT PRIMARY KEY, team TEXT)
+                """))
+        connection.execute(text("""
+CREATE TABLE fact_calls (
+    call_id INTEGER PRIMARY KEY,
+    agent_name TEXT REFERENCES dim_agents(agent_name)
+)
+                """))
+
+    dimensions = semantic_layer.get_dimensions(semantic_view)
+    assert "dim_agents.team" in {dimension.name for dimension in dimensions}
+    assert "asts_parsed" not in aggregator.counters
+    assert "metrics_compiled" not in aggregator.counters
+
+
+def test_metric_over_views_of_views(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE VIEW large_orders AS
+SELECT * FROM fact_orders WHERE quantity > 1
+                """))
+        connection.execute(text("""
+CREATE VIEW large_order_customers AS
+SELECT large_orders.quantity, dim_customers.country
+FROM large_orders
+JOIN dim_customers ON large_orders.customer_id = dim_customers.customer_id
+                """))
+        connection.execute(text("""
+CREATE VIEW large_units AS
+SELECT SUM(quantity) AS large_units FROM large_order_customers
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+
+    # views are resolved to their base tables, through any number of views
+    assert metrics["large_units"].tables == {
+        Relation("fact_orders", "main"),
+        Relation("dim_customers", "main"),
+    }
+    assert semantic_layer.get_view_tables()[
+        Relation("large_order_customers", "main")
+    ] == {Relation("fact_orders", "main"), Relation("dim_customers", "main")}
+
+
+def test_recommend_indexes(sqlite_engine: Engine) -> None:
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    dimensions = {
+        dimension.name: dimension
+        for dimension in semantic_layer.get_dimensions(semantic_view)
+    }
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"]},
+        {Filter(FilterTypeEnum.WHERE, "fact_orders.product_id = 1")},
+    )
+    assert list(semantic_layer.workload) == [query.sql]
+    assert "SCAN fact_orders" in {
+        step.detail for step in semantic_layer.explain_query(query.sql)
+    }
+    assert semantic_layer.get_full_scans(query.sql) == {"fact_orders"}
+
+    # the filtered column comes first, then the foreign keys, then the other columns
+    semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_units_sold"]},
+        {dimensions["dim_customers.country"]},
+        {Filter(FilterTypeEnum.WHERE, "fact_orders.product_id = 1")},
+    )
+    recommendations = semantic_layer.recommend_indexes()
+    assert recommendations == [
+        IndexRecommendation(
+            "fact_orders",
+            ("product_id", "customer_id", "quantity"),
+            "covering index for the scan of fact_orders",
+        ),
+    ]
+    assert recommendations[0].queries == 2
+    assert recommendations[0].get_ddl() == (
+        "CREATE INDEX IF NOT EXISTS idx_fact_orders_product_id_customer_id_quantity "
+        "ON fact_orders (product_id, customer_id, quantity)"
+    )
+
+    semantic_layer.create_indexes(recommendations)
+    assert semantic_layer.get_full_scans(query.sql) == set()
+    assert semantic_layer.recommend_indexes() == []
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_units_sold": 2, "dim_customers.country": "USA"},
+    ]
+
+    # the primary key of the dimension is indexed, so the foreign key gets the index
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE TABLE dim_agents (agent_name TEXT PRIMARY KEY, team TEXT)
+                """))
+        connection.execute(text("""
+CREATE TABLE fact_calls (
+    call_id INTEGER PRIMARY KEY,
+    agent_name TEXT REFERENCES dim_agents(agent_name)
+)
+                """))
+    sql = (
+        "SELECT dim_agents.team, COUNT(*) FROM fact_calls "
+        "JOIN dim_agents ON fact_calls.agent_name = dim_agents.agent_name "
+        "GROUP BY dim_agents.team"
+    )
+    assert [
+        (recommendation.table, recommendation.columns)
+        for recommendation in semantic_layer.recommend_indexes([sql])
+    ] == [("fact_calls", ("agent_name",))]
+
+
+def test_get_query_sample(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+WITH RECURSIVE numbers(n) AS (SELECT 4 UNION ALL SELECT n + 1 FROM numbers WHERE n < 5000)
+INSERT INTO fact_orders
+SELECT n, n % 3 + 1, n % 3 + 1, 20240601, n % 5 + 1, 10.0, 0.0, 1.0 FROM numbers
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+    selected = {metrics["total_units_sold"], metrics["total_revenue"]}
+    exact = list(
+        semantic_layer.execute(
+            semantic_layer.get_query(semantic_view, selected, set(), set()).sql
+        )
+    )[0]
+
+    query = semantic_layer.get_query(semantic_view, selected, set(), set(), sample=0.1)
+    assert "TABLESAMPLE" not in query.sql
+    assert "fact_orders.rowid" in query.sql
+    rows = list(semantic_layer.execute(query.sql))
+    assert rows == list(semantic_layer.execute(query.sql))
+    for name in ("total_units_sold", "total_revenue"):
+        estimate, error = rows[0][name], rows[0][f"{name}__error"]
+        assert estimate != exact[name]
+        assert 0 < error < exact[name] / 10
+        assert estimate - error <= exact[name] <= estimate + error
+
+    # sampling everything gives the exact values
+    query = semantic_layer.get_query(semantic_view, selected, set(), set(), sample=1)
+    assert list(semantic_layer.execute(query.sql)) == [
+        {**exact, "total_revenue__error": 0.0, "total_units_sold__error": 0.0},
+    ]
+
+    # distinct counts can't be scaled, so their context reads all the rows
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["avg_order_value"], metrics["total_tickets"]},
+        set(),
+        set(),
+        sample=0.1,
+    )
+    assert "fact_orders.rowid" not in query.sql
+    assert "fact_customer_support.rowid" in query.sql
+    assert list(semantic_layer.execute(query.sql))[0]["avg_order_value__error"] == 0
+
+    with pytest.raises(ValueError, match="Sample rate must be between 0 and 1: 2"):
+        semantic_layer.get_query(semantic_view, selected, set(), set(), sample=2)
+
+
+def test_get_query_sample_rowids(sqlite_engine: Engine) -> None:
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("""
+CREATE TABLE fact_events (event_id INTEGER PRIMARY KEY, quantity INTEGER)
+                """))
+        connection.execute(text("""
+WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers WHERE n < 1000)
+INSERT INTO fact_events SELECT 1700000000000 + n, 1 FROM numbers
+                """))
+        connection.execute(text("""
+CREATE TABLE fact_visits (visit_id INTEGER PRIMARY KEY, quantity INTEGER)
+WITHOUT ROWID
+                """))
+        connection.execute(text("""
+INSERT INTO fact_visits SELECT event_id, quantity FROM fact_events
+                """))
+        connection.execute(text("""
+CREATE VIEW total_events AS SELECT SUM(quantity) AS total_events FROM fact_events
+                """))
+        connection.execute(text("""
+CREATE VIEW total_visits AS SELECT SUM(quantity) AS total_visits FROM fact_visits
+                """))
+
+    semantic_layer = SQLiteSemanticLayer(sqlite_engine)
+    semantic_view = SemanticView("semantic_view")
+    metrics = {
+        metric.name: metric for metric in semantic_layer.get_metrics(semantic_view)
+    }
+
+    # large rowids are still spread over the sample
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_events"]},
+        set(),
+        set(),
+        sample=0.5,
+    )
+    assert "fact_events.rowid" in query.sql
+    row = list(semantic_layer.execute(query.sql))[0]
+    estimate, error = row["total_events"], row["total_events__error"]
+    assert 0 < error < 1000
+    assert estimate - error <= 1000 <= estimate + error
+
+    # tables without a rowid are read in full
+    query = semantic_layer.get_query(
+        semantic_view,
+        {metrics["total_visits"]},
+        set(),
+        set(),
+        sample=0.5,
+    )
+    assert "fact_visits.rowid" not in query.sql
+    assert list(semantic_layer.execute(query.sql)) == [
+        {"total_visits": 1000, "total_visits__error": 0},
+    ]
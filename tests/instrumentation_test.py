@@ -0,0 +1,53 @@
+from pytest_mock import MockerFixture
+
+from cantrip.instrumentation import (
+    Aggregator,
+    NoopInstrumentation,
+    SpanStats,
+    get_percentile,
+)
+
+
+def test_get_percentile() -> None:
+    samples = [float(i) for i in range(1, 101)]
+
+    assert get_percentile(samples, 50) == 50
+    assert get_percentile(samples, 99) == 99
+    assert get_percentile(samples, 100) == 100
+    assert get_percentile([1.0], 99) == 1
+
+
+def test_aggregator(mocker: MockerFixture) -> None:
+    mocker.patch(
+        "cantrip.instrumentation.time.perf_counter",
+        side_effect=[0, 0.001, 0, 0.003, 0, 0.002],
+    )
+    aggregator = Aggregator()
+
+    for _ in range(3):
+        with aggregator.span("execute"):
+            pass
+    aggregator.count("rows_fetched", 10)
+    aggregator.count("rows_fetched", 5)
+
+    report = aggregator.report()
+    assert report.keys() == {"execute"}
+    assert report["execute"].count == 3
+    assert round(report["execute"].total, 6) == 6
+    assert round(report["execute"].p50, 6) == 2
+    assert round(report["execute"].p99, 6) == 3
+    assert aggregator.counters == {"rows_fetched": 15}
+
+    aggregator.reset()
+    assert aggregator.report() == {}
+    assert aggregator.counters == {}
+
+
+def test_noop_instrumentation() -> None:
+    instrumentation = NoopInstrumentation()
+
+    with instrumentation.span("execute"):
+        instrumentation.count("rows_fetched", 10)
+
+    assert instrumentation.span("a") is instrumentation.span("b")
+    assert SpanStats(1, 1.0, 1.0, 1.0) == SpanStats(1, 1.0, 1.0, 1.0)
@@ -0,0 +1,53 @@
+import copy
+import pickle
+
+import pytest
+
+from cantrip.models import (
+    Dimension,
+    Metric,
+    Relation,
+    get_cube_sets,
+    get_rollup_sets,
+)
+
+
+def test_relations_are_interned() -> None:
+    relation = Relation("orders", "main")
+
+    assert Relation("orders", "main") is relation
+    assert Relation("orders") is not relation
+    assert pickle.loads(pickle.dumps(relation)) is relation
+    assert copy.deepcopy(relation) is relation
+
+    with pytest.raises(AttributeError):
+        relation.name = "customers"  # type: ignore[misc]
+
+
+def test_models_are_slotted() -> None:
+    orders = Relation("orders")
+    metric = Metric("revenue", "SUM(amount)", orders, frozenset({orders}))
+    dimension = Dimension(Relation("customers"), "country", "customers.country")
+
+    assert not hasattr(orders, "__dict__")
+    assert not hasattr(metric, "__dict__")
+    assert not hasattr(dimension, "__dict__")
+    assert pickle.loads(pickle.dumps(metric)) == metric
+    assert dimension.grains == frozenset()
+
+
+def test_grouping_sets() -> None:
+    country = Dimension(Relation("dim_customers"), "country", "dim_customers.country")
+    category = Dimension(Relation("dim_products"), "category", "dim_products.category")
+
+    assert get_rollup_sets([country, category]) == [
+        {country, category},
+        {country},
+        set(),
+    ]
+    assert get_cube_sets([country, category]) == [
+        {country, category},
+        {category},
+        {country},
+        set(),
+    ]
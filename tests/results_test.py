@@ -0,0 +1,78 @@
+from array import array
+
+from cantrip.results import ColumnBuilder, ColumnType, hash_join
+
+
+def test_column_builder_integer() -> None:
+    builder = ColumnBuilder("a", ColumnType.INTEGER)
+    builder.extend((1, None, 3))
+    column = builder.build()
+
+    assert column.type == ColumnType.INTEGER
+    assert column.values == array("q", [1, 0, 3])
+    assert column.validity == bytearray([1, 0, 1])
+    assert column.to_pylist() == [1, None, 3]
+
+
+def test_column_builder_widens_type() -> None:
+    builder = ColumnBuilder("a", ColumnType.INTEGER)
+    builder.extend((1, 2.5))
+    assert builder.build().type == ColumnType.REAL
+
+    builder = ColumnBuilder("a", ColumnType.REAL)
+    builder.extend((1.0, "two"))
+    column = builder.build()
+    assert column.type == ColumnType.TEXT
+    assert column.to_pylist() == [1.0, "two"]
+
+
+def test_column_builder_dictionary_encoding() -> None:
+    builder = ColumnBuilder("country")
+    builder.extend(("BR", "US", "BR", None))
+    column = builder.build()
+
+    assert column.type == ColumnType.TEXT
+    assert column.values == array("i", [0, 1, 0, 2])
+    assert column.dictionary == ("BR", "US", None)
+    assert column.to_pylist() == ["BR", "US", "BR", None]
+
+
+def test_hash_join() -> None:
+    columns, rows = hash_join(
+        [
+            (("revenue", "country"), [(10, "BR"), (20, "US"), (5, None)]),
+            (("country", "tickets"), [("US", 2), ("BR", 1), ("UK", 3)]),
+        ],
+        ["country"],
+    )
+
+    assert columns == ("revenue", "tickets", "country")
+    assert sorted(rows, key=str) == [
+        (10, 1, "BR"),
+        (20, 2, "US"),
+        (5, None, None),
+        (None, 3, "UK"),
+    ]
+
+    # keys missing from the inner partial results are dropped
+    columns, rows = hash_join(
+        [
+            (("revenue", "country"), [(10, "BR"), (20, "US"), (5, None)]),
+            (("country", "tickets"), [("US", 2), ("BR", 1), ("UK", 3)]),
+        ],
+        ["country"],
+        inner={0},
+    )
+    assert sorted(rows, key=str) == [(10, 1, "BR"), (20, 2, "US"), (5, None, None)]
+
+
+def test_hash_join_without_keys() -> None:
+    assert hash_join(
+        [(("revenue",), [(10,)]), (("tickets",), [(3,)])],
+        [],
+    ) == (("revenue", "tickets"), [(10, 3)])
+    assert hash_join(
+        [(("revenue",), []), (("tickets",), [(3,)])],
+        [],
+        inner={0},
+    ) == (("revenue", "tickets"), [])
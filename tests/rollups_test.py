@@ -0,0 +1,37 @@
+import pytest
+import sqlglot
+
+from cantrip.rollups import split_aggregates
+
+
+@pytest.mark.parametrize(
+    "sql, components, expression",
+    [
+        ("SUM(a)", ["SUM(a) AS m__0"], "SUM(m__0)"),
+        ("COUNT(*)", ["COUNT(*) AS m__0"], "SUM(m__0)"),
+        (
+            "SUM(a) / COUNT(b)",
+            ["SUM(a) AS m__0", "COUNT(b) AS m__1"],
+            "SUM(m__0) / SUM(m__1)",
+        ),
+        (
+            "AVG(b) FILTER(WHERE c > 1)",
+            [
+                "SUM(b) FILTER(WHERE c > 1) AS m__0",
+                "COUNT(b) FILTER(WHERE c > 1) AS m__1",
+            ],
+            "CAST(SUM(m__0) AS DOUBLE) / SUM(m__1)",
+        ),
+    ],
+)
+def test_split_aggregates(sql: str, components: list[str], expression: str) -> None:
+    parts, combined = split_aggregates(sqlglot.parse_one(sql), "m")
+
+    assert [part.sql() for part in parts] == components
+    assert combined.sql() == expression
+
+
+def test_split_aggregates_distinct() -> None:
+    with pytest.raises(ValueError) as excinfo:
+        split_aggregates(sqlglot.parse_one("COUNT(DISTINCT a)"), "m")
+    assert str(excinfo.value) == "Metric can't be re-aggregated: COUNT(DISTINCT a)"